@@ -4,7 +4,7 @@ from alembic import context
 
 # ✅ Import database and settings
 from app.core.database import Base
-from app.models import payment, vending
+from app.models import payment, vending, meter, callback_queue, sms_outbox, rollup
   # import all models
 from app.core.config import settings
 
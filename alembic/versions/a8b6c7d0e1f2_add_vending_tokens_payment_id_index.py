@@ -0,0 +1,28 @@
+"""add vending_tokens.payment_id index
+
+Revision ID: a8b6c7d0e1f2
+Revises: f7a5b6c9d0e1
+Create Date: 2026-10-18 15:02:09.553120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8b6c7d0e1f2'
+down_revision: Union[str, Sequence[str], None] = 'f7a5b6c9d0e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_vending_tokens_payment_id'), 'vending_tokens', ['payment_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_vending_tokens_payment_id'), table_name='vending_tokens')
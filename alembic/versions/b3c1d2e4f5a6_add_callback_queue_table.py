@@ -0,0 +1,44 @@
+"""add callback_queue table
+
+Revision ID: b3c1d2e4f5a6
+Revises: a016031a7ea4
+Create Date: 2026-10-18 09:12:40.118230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c1d2e4f5a6'
+down_revision: Union[str, Sequence[str], None] = 'a016031a7ea4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('callback_queue',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('trans_id', sa.String(length=50), nullable=True),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_callback_queue_id'), 'callback_queue', ['id'], unique=False)
+    op.create_index('ix_callback_queue_status_next_attempt', 'callback_queue', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_callback_queue_status_next_attempt', table_name='callback_queue')
+    op.drop_index(op.f('ix_callback_queue_id'), table_name='callback_queue')
+    op.drop_table('callback_queue')
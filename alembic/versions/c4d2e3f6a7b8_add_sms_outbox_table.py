@@ -0,0 +1,45 @@
+"""add sms_outbox table
+
+Revision ID: c4d2e3f6a7b8
+Revises: b3c1d2e4f5a6
+Create Date: 2026-10-18 10:02:13.520471
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d2e3f6a7b8'
+down_revision: Union[str, Sequence[str], None] = 'b3c1d2e4f5a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sms_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('provider', sa.String(length=30), nullable=False),
+    sa.Column('phone_number', sa.String(length=20), nullable=False),
+    sa.Column('message', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_sms_outbox_id'), 'sms_outbox', ['id'], unique=False)
+    op.create_index('ix_sms_outbox_status_next_attempt', 'sms_outbox', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_sms_outbox_status_next_attempt', table_name='sms_outbox')
+    op.drop_index(op.f('ix_sms_outbox_id'), table_name='sms_outbox')
+    op.drop_table('sms_outbox')
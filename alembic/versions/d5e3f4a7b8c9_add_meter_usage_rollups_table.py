@@ -0,0 +1,44 @@
+"""add meter_usage_rollups table
+
+Revision ID: d5e3f4a7b8c9
+Revises: c4d2e3f6a7b8
+Create Date: 2026-10-18 11:24:52.804113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e3f4a7b8c9'
+down_revision: Union[str, Sequence[str], None] = 'c4d2e3f6a7b8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('meter_usage_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('meter_number', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(length=4), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('units_dispensed', sa.Float(), nullable=False),
+    sa.Column('token_count', sa.Integer(), nullable=False),
+    sa.Column('amount_vended', sa.Float(), nullable=False),
+    sa.Column('amount_paid', sa.Float(), nullable=False),
+    sa.Column('payment_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('meter_number', 'granularity', 'bucket_start', name='uq_meter_usage_rollup_bucket')
+    )
+    op.create_index(op.f('ix_meter_usage_rollups_id'), 'meter_usage_rollups', ['id'], unique=False)
+    op.create_index('ix_meter_usage_rollups_granularity_bucket', 'meter_usage_rollups', ['granularity', 'bucket_start'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_meter_usage_rollups_granularity_bucket', table_name='meter_usage_rollups')
+    op.drop_index(op.f('ix_meter_usage_rollups_id'), table_name='meter_usage_rollups')
+    op.drop_table('meter_usage_rollups')
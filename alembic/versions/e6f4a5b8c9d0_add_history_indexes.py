@@ -0,0 +1,33 @@
+"""add per-meter history indexes
+
+Revision ID: e6f4a5b8c9d0
+Revises: d5e3f4a7b8c9
+Create Date: 2026-10-18 13:05:17.412906
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6f4a5b8c9d0'
+down_revision: Union[str, Sequence[str], None] = 'd5e3f4a7b8c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_vending_tokens_meter_timestamp', 'vending_tokens',
+                    ['meter_number', sa.text('timestamp DESC'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_mpesa_transactions_bill_ref_id', 'mpesa_transactions', ['bill_ref_number', 'id'], unique=False)
+    op.create_index('ix_mpesa_transactions_msisdn_id', 'mpesa_transactions', ['msisdn', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_mpesa_transactions_msisdn_id', table_name='mpesa_transactions')
+    op.drop_index('ix_mpesa_transactions_bill_ref_id', table_name='mpesa_transactions')
+    op.drop_index('ix_vending_tokens_meter_timestamp', table_name='vending_tokens')
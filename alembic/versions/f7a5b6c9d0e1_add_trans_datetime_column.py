@@ -0,0 +1,82 @@
+"""add parsed trans_datetime column to mpesa_transactions
+
+Revision ID: f7a5b6c9d0e1
+Revises: e6f4a5b8c9d0
+Create Date: 2026-10-18 14:12:40.118374
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f7a5b6c9d0e1'
+down_revision: Union[str, Sequence[str], None] = 'e6f4a5b8c9d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+mpesa_transactions = sa.table(
+    'mpesa_transactions',
+    sa.column('id', sa.Integer),
+    sa.column('trans_time', sa.String),
+    sa.column('trans_datetime', sa.DateTime),
+)
+
+
+def _parse(value):
+    try:
+        return datetime.strptime(str(value).strip(), "%Y%m%d%H%M%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable with no default, so adding it does not rewrite the table
+    op.add_column('mpesa_transactions', sa.Column('trans_datetime', sa.DateTime(), nullable=True))
+
+    # Outside the migration transaction: every batch UPDATE commits on its own,
+    # so no transaction spans the whole table and row locks are held briefly
+    with op.get_context().autocommit_block():
+        conn = op.get_bind()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                sa.select(mpesa_transactions.c.id, mpesa_transactions.c.trans_time)
+                .where(mpesa_transactions.c.id > last_id)
+                .where(mpesa_transactions.c.trans_datetime.is_(None))
+                .where(mpesa_transactions.c.trans_time.isnot(None))
+                .order_by(mpesa_transactions.c.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            params = [{"row_id": r.id, "parsed": _parse(r.trans_time)} for r in rows]
+            params = [p for p in params if p["parsed"] is not None]
+            if params:
+                conn.execute(
+                    mpesa_transactions.update()
+                    .where(mpesa_transactions.c.id == sa.bindparam("row_id"))
+                    .values(trans_datetime=sa.bindparam("parsed")),
+                    params,
+                )
+
+        # Built after the backfill; CONCURRENTLY (Postgres) does not block writes
+        op.create_index('ix_mpesa_transactions_trans_datetime', 'mpesa_transactions',
+                        ['trans_datetime', 'id'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_mpesa_transactions_trans_datetime', table_name='mpesa_transactions',
+                      postgresql_concurrently=True)
+    with op.batch_alter_table('mpesa_transactions') as batch_op:
+        batch_op.drop_column('trans_datetime')
@@ -7,11 +7,111 @@ load_dotenv()
 class Settings:
     """Application configuration and environment variables."""
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./mpesa_transactions.db")
+    DB_ECHO: bool = os.getenv("DB_ECHO", "false").lower() == "true"
+    # Schema step at startup: "auto" (create_all only if the DB is not at the Alembic head),
+    # "create_all" (always, the old behaviour) or "skip" (migrations are run separately)
+    DB_SCHEMA_STARTUP: str = os.getenv("DB_SCHEMA_STARTUP", "auto").lower()
+
+    # Async engine (aiosqlite/asyncpg) for the async Daraja routes; derived from DATABASE_URL if unset
+    DB_ASYNC: bool = os.getenv("DB_ASYNC", "false").lower() == "true"
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+
+    # Connection pool (Postgres and other server databases)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+    # SQLite PRAGMAs applied on every connection
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-64000"))  # negative = KiB
+
+    # Logging: "sync" (handler writes on the calling thread) or "queue" (QueueHandler +
+    # background QueueListener); LOG_FORMAT "text" or "json" (one compact object per line)
+    LOG_MODE: str = os.getenv("LOG_MODE", "sync").lower()
+    LOG_FORMAT: str = os.getenv("LOG_FORMAT", "text").lower()
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO").upper()
+    # Fraction of callback payloads dumped in full (0 disables the dumps)
+    LOG_PAYLOAD_SAMPLE_RATE: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1.0"))
+    # Mask phone numbers and 20-digit tokens in log output
+    LOG_REDACT: bool = os.getenv("LOG_REDACT", "true").lower() == "true"
 
     # M-Pesa credentials
     CONSUMER_KEY: str = os.getenv("CONSUMER_KEY")
     CONSUMER_SECRET: str = os.getenv("CONSUMER_SECRET")
     SHORTCODE: str = os.getenv("SHORTCODE")
     NGROK_URL: str = os.getenv("NGROK_URL")
+    ENVIRONMENT: str = os.getenv("ENVIRONMENT", "sandbox")
+
+    # Daraja HTTP client
+    DARAJA_TOKEN_REFRESH_MARGIN: int = int(os.getenv("DARAJA_TOKEN_REFRESH_MARGIN", "300"))
+    DARAJA_POOL_CONNECTIONS: int = int(os.getenv("DARAJA_POOL_CONNECTIONS", "4"))
+    DARAJA_POOL_MAXSIZE: int = int(os.getenv("DARAJA_POOL_MAXSIZE", "10"))
+
+    # Confirmation processing: "inline" (process before replying) or "queued"
+    CONFIRMATION_MODE: str = os.getenv("CONFIRMATION_MODE", "inline").lower()
+    CALLBACK_QUEUE_WORKERS: int = int(os.getenv("CALLBACK_QUEUE_WORKERS", "2"))
+    CALLBACK_QUEUE_BATCH_SIZE: int = int(os.getenv("CALLBACK_QUEUE_BATCH_SIZE", "20"))
+    CALLBACK_QUEUE_POLL_INTERVAL: float = float(os.getenv("CALLBACK_QUEUE_POLL_INTERVAL", "0.5"))
+    CALLBACK_QUEUE_MAX_ATTEMPTS: int = int(os.getenv("CALLBACK_QUEUE_MAX_ATTEMPTS", "5"))
+    CALLBACK_QUEUE_RETRY_BASE_SECONDS: float = float(os.getenv("CALLBACK_QUEUE_RETRY_BASE_SECONDS", "2"))
+    CALLBACK_QUEUE_LEASE_SECONDS: int = int(os.getenv("CALLBACK_QUEUE_LEASE_SECONDS", "300"))
+
+    # Validation callback checks BillRefNumber against an in-memory set of meters.meter_number,
+    # refreshed from new rows every METER_REGISTRY_REFRESH_INTERVAL seconds and fully reloaded
+    # every METER_REGISTRY_FULL_RELOAD_INTERVAL seconds (picks up deletions)
+    METER_VALIDATION_ENABLED: bool = os.getenv("METER_VALIDATION_ENABLED", "true").lower() == "true"
+    METER_REGISTRY_REFRESH_INTERVAL: float = float(os.getenv("METER_REGISTRY_REFRESH_INTERVAL", "30"))
+    METER_REGISTRY_FULL_RELOAD_INTERVAL: float = float(os.getenv("METER_REGISTRY_FULL_RELOAD_INTERVAL", "3600"))
+
+    # Versioned block tariffs as JSON ({"tariffs": [...]}, see tariffs.example.json);
+    # unset means the flat 10 KES per unit rate
+    TARIFF_FILE: str = os.getenv("TARIFF_FILE", "")
+
+    # Size of the in-memory LRU of recently processed M-Pesa TransIDs
+    IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+    # SMS delivery: "inline" (send during the vend) or "outbox" (bulk background dispatch)
+    SMS_PROVIDER: str = os.getenv("SMS_PROVIDER", "mock").lower()
+    SMS_DELIVERY_MODE: str = os.getenv("SMS_DELIVERY_MODE", "inline").lower()
+    SMS_OUTBOX_BATCH_SIZE: int = int(os.getenv("SMS_OUTBOX_BATCH_SIZE", "50"))
+    SMS_OUTBOX_FLUSH_INTERVAL: float = float(os.getenv("SMS_OUTBOX_FLUSH_INTERVAL", "1.0"))
+    SMS_OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("SMS_OUTBOX_MAX_ATTEMPTS", "5"))
+    SMS_OUTBOX_RETRY_BASE_SECONDS: float = float(os.getenv("SMS_OUTBOX_RETRY_BASE_SECONDS", "5"))
+    SMS_OUTBOX_LEASE_SECONDS: int = int(os.getenv("SMS_OUTBOX_LEASE_SECONDS", "300"))
+
+    # Per-meter aggregate read cache ("memory" per worker, or "sqlite" shared file)
+    AGGREGATE_CACHE_ENABLED: bool = os.getenv("AGGREGATE_CACHE_ENABLED", "true").lower() == "true"
+    AGGREGATE_CACHE_BACKEND: str = os.getenv("AGGREGATE_CACHE_BACKEND", "memory").lower()
+    AGGREGATE_CACHE_PATH: str = os.getenv("AGGREGATE_CACHE_PATH", "./aggregate_cache.db")
+    AGGREGATE_CACHE_TTL: float = float(os.getenv("AGGREGATE_CACHE_TTL", "30"))
+    AGGREGATE_CACHE_MAX_ENTRIES: int = int(os.getenv("AGGREGATE_CACHE_MAX_ENTRIES", "10000"))
+
+    # Set to a shared directory when running several uvicorn workers so
+    # /metrics reports the sum of all workers
+    METRICS_MULTIPROC_DIR: str = os.getenv("METRICS_MULTIPROC_DIR")
+    METRICS_FLUSH_INTERVAL: float = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+    # Maintain hourly/daily per-meter rollups inside update_on_vend/update_on_payment
+    ROLLUPS_ENABLED: bool = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+
+    # Time-series export of vend/payment events: "off", "http" (InfluxDB v2) or "file"
+    TIMESERIES_EXPORT: str = os.getenv("TIMESERIES_EXPORT", "off").lower()
+    INFLUX_URL: str = os.getenv("INFLUX_URL", "http://localhost:8086")
+    INFLUX_TOKEN: str = os.getenv("INFLUX_TOKEN", "")
+    INFLUX_ORG: str = os.getenv("INFLUX_ORG", "smartwater")
+    INFLUX_BUCKET: str = os.getenv("INFLUX_BUCKET", "vending")
+    TIMESERIES_FILE_PATH: str = os.getenv("TIMESERIES_FILE_PATH", "./timeseries/events.lp")
+    TIMESERIES_FILE_MAX_BYTES: int = int(os.getenv("TIMESERIES_FILE_MAX_BYTES", str(50 * 1024 * 1024)))
+    TIMESERIES_FILE_BACKUPS: int = int(os.getenv("TIMESERIES_FILE_BACKUPS", "5"))
+    TIMESERIES_BUFFER_SIZE: int = int(os.getenv("TIMESERIES_BUFFER_SIZE", "10000"))
+    TIMESERIES_BATCH_SIZE: int = int(os.getenv("TIMESERIES_BATCH_SIZE", "500"))
+    TIMESERIES_FLUSH_INTERVAL: float = float(os.getenv("TIMESERIES_FLUSH_INTERVAL", "1.0"))
+    # "drop_newest", "drop_oldest" or "block" (waits at most 50ms, then drops)
+    TIMESERIES_OVERFLOW_POLICY: str = os.getenv("TIMESERIES_OVERFLOW_POLICY", "drop_newest").lower()
 
 settings = Settings()
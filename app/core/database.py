@@ -1,13 +1,110 @@
-from sqlalchemy import create_engine
+from typing import Optional
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.core.config import settings
 
+
+def default_sqlite_pragmas() -> dict:
+    """PRAGMAs applied to every new SQLite connection (see Settings)"""
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+    }
+
+
+def _on_connect_apply_pragmas(engine: Engine, pragmas: dict):
+    @event.listens_for(engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def _sqlite_pragmas_for(url: str, sqlite_pragmas: Optional[dict]) -> dict:
+    pragmas = default_sqlite_pragmas() if sqlite_pragmas is None else sqlite_pragmas
+    if url.split("?")[0] in ("sqlite://", "sqlite:///:memory:", "sqlite+aiosqlite://", "sqlite+aiosqlite:///:memory:"):
+        pragmas = {k: v for k, v in pragmas.items() if k != "journal_mode"}
+    return pragmas
+
+
+def create_db_engine(database_url: Optional[str] = None, sqlite_pragmas: Optional[dict] = None) -> Engine:
+    """
+    Build the SQLAlchemy engine for `database_url` (defaults to settings.DATABASE_URL).
+
+    - SQLite: every connection gets the configured PRAGMAs (WAL, synchronous, etc.);
+      pass sqlite_pragmas={} to use SQLite's defaults.
+    - Other backends: a QueuePool sized by the DB_POOL_* settings, with pre-ping and recycle.
+    """
+    url = database_url or settings.DATABASE_URL
+
+    if url.startswith("sqlite"):
+        engine = create_engine(
+            url,
+            echo=settings.DB_ECHO,
+            connect_args={"check_same_thread": False, "timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000},
+        )
+        pragmas = _sqlite_pragmas_for(url, sqlite_pragmas)
+        if pragmas:
+            _on_connect_apply_pragmas(engine, pragmas)
+        return engine
+
+    return create_engine(
+        url,
+        echo=settings.DB_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+
+def async_database_url(database_url: Optional[str] = None) -> str:
+    """settings.ASYNC_DATABASE_URL, or DATABASE_URL with its driver swapped for aiosqlite/asyncpg"""
+    if database_url is None and settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    url = database_url or settings.DATABASE_URL
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+")[0]
+    if backend == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    if backend in ("postgresql", "postgres"):
+        return f"postgresql+asyncpg://{rest}"
+    return url
+
+
+def create_async_db_engine(database_url: Optional[str] = None, sqlite_pragmas: Optional[dict] = None) -> AsyncEngine:
+    """Async counterpart of create_db_engine (same PRAGMAs / pool settings)."""
+    url = async_database_url(database_url)
+
+    if url.startswith("sqlite"):
+        engine = create_async_engine(url, echo=settings.DB_ECHO,
+                                     connect_args={"timeout": settings.SQLITE_BUSY_TIMEOUT_MS / 1000})
+        pragmas = _sqlite_pragmas_for(url, sqlite_pragmas)
+        if pragmas:
+            _on_connect_apply_pragmas(engine.sync_engine, pragmas)
+        return engine
+
+    return create_async_engine(
+        url,
+        echo=settings.DB_ECHO,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+
 # Create the SQLAlchemy engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
-)
+engine = create_db_engine()
 
 # Session and Base class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -20,3 +117,53 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# The async engine is only built when first used, so aiosqlite/asyncpg are
+# only needed with DB_ASYNC=true
+_async_session_factory: Optional[async_sessionmaker] = None
+
+
+def get_async_session_factory() -> async_sessionmaker:
+    global _async_session_factory
+    if _async_session_factory is None:
+        # expire_on_commit=False: attributes stay readable after commit
+        # without an implicit (and, under asyncio, forbidden) lazy reload
+        _async_session_factory = async_sessionmaker(create_async_db_engine(), autoflush=False,
+                                                    expire_on_commit=False)
+    return _async_session_factory
+
+
+async def dispose_async_engine():
+    if _async_session_factory is not None:
+        await _async_session_factory.kw["bind"].dispose()
+
+
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
+
+
+async def get_route_db():
+    """Dependency for async handlers: an AsyncSession with DB_ASYNC=true, else a plain Session"""
+    if settings.DB_ASYNC:
+        async with get_async_session_factory()() as db:
+            yield db
+        return
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def run_with_session(db, fn, *args, **kwargs):
+    """
+    Call a sync service function `fn(session, ...)` with either session type:
+    an AsyncSession runs it through run_sync (I/O awaited, loop not blocked),
+    a Session calls it directly.
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return fn(db, *args, **kwargs)
+
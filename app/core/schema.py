@@ -0,0 +1,74 @@
+import re
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import MetaData, inspect, text
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger("Schema")
+
+ALEMBIC_INI = Path(__file__).resolve().parents[2] / "alembic.ini"
+VERSIONS_DIR = ALEMBIC_INI.parent / "alembic" / "versions"
+
+_REVISION_RE = re.compile(r"^revision(?:\s*:[^=]+)?\s*=\s*['\"](\w+)['\"]", re.M)
+_DOWN_REVISION_RE = re.compile(r"^down_revision(?:\s*:[^=]+)?\s*=\s*(.+)$", re.M)
+
+
+def alembic_head(versions_dir: Path = VERSIONS_DIR) -> Optional[str]:
+    """
+    The single head revision of the migration scripts (None if there are several).
+    Read straight from the files: importing alembic and every revision module
+    costs more than the create_all this check is meant to save.
+    """
+    revisions, parents = set(), set()
+    for path in versions_dir.glob("*.py"):
+        source = path.read_text(encoding="utf-8")
+        revision = _REVISION_RE.search(source)
+        if not revision:
+            continue
+        revisions.add(revision.group(1))
+        down = _DOWN_REVISION_RE.search(source)
+        if down:
+            parents.update(re.findall(r"['\"](\w+)['\"]", down.group(1)))
+    heads = sorted(revisions - parents)
+    if len(heads) != 1:
+        logger.warning(f"⚠️ Alembic has {len(heads)} heads: {heads}")
+        return None
+    return heads[0]
+
+
+def database_revision(engine: Engine) -> Optional[str]:
+    """The revision stamped in alembic_version (one query), None if unversioned"""
+    if not inspect(engine).has_table("alembic_version"):
+        return None
+    with engine.connect() as conn:
+        heads = conn.execute(text("SELECT version_num FROM alembic_version")).scalars().all()
+    return heads[0] if len(heads) == 1 else None
+
+
+def prepare_schema(engine: Engine, metadata: MetaData, mode: str = None) -> str:
+    """
+    Run at startup instead of at import. Returns what was done:
+    "at_head" (create_all skipped), "created" or "skipped".
+    """
+    mode = mode or settings.DB_SCHEMA_STARTUP
+    if mode == "skip":
+        return "skipped"
+
+    if mode == "auto":
+        try:
+            head = alembic_head()
+            current = database_revision(engine)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not compare schema with Alembic head: {str(e)}")
+            head = current = None
+        if head is not None and current == head:
+            logger.info(f"✅ Schema at Alembic head {head}, skipping create_all")
+            return "at_head"
+        logger.info(f"Schema revision {current} != head {head}, running create_all")
+
+    metadata.create_all(bind=engine)
+    return "created"
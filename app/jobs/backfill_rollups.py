@@ -0,0 +1,36 @@
+"""
+Rebuild the hourly/daily meter_usage_rollups from existing history.
+
+    python -m app.jobs.backfill_rollups [--granularity hour|day]
+
+Existing buckets for the chosen granularities are replaced in one transaction.
+"""
+import argparse
+
+from app.core.database import SessionLocal
+from app.services.rollup_service import GRANULARITIES, backfill_rollups
+from app.utils.logger import get_logger
+
+logger = get_logger("BackfillRollups")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild meter usage rollups from history")
+    parser.add_argument("--granularity", choices=GRANULARITIES, action="append",
+                        help="granularity to rebuild (repeatable, default: all)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        written = backfill_rollups(db, args.granularity or GRANULARITIES)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    logger.info(f"✅ Rollup backfill complete: {written}")
+
+
+if __name__ == "__main__":
+    main()
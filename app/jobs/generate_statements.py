@@ -0,0 +1,52 @@
+"""
+Write monthly per-meter statements (payments, tokens, units, balance carried forward).
+
+    python -m app.jobs.generate_statements --month 2025-10
+    python -m app.jobs.generate_statements --month 2025-10 --workers 8 --format csv --out statements
+
+Statements go to <out>/<month>/shard-NNNNN.<format>. Re-running the same command
+resumes: only shards without a file are written (--force rewrites everything).
+"""
+import argparse
+import json
+import time
+
+from app.core.database import SessionLocal
+from app.services.statement_service import FORMATS, generate_statements
+from app.utils.logger import get_logger
+
+logger = get_logger("GenerateStatements")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write monthly per-meter statements")
+    parser.add_argument("--month", required=True, help="statement period, YYYY-MM")
+    parser.add_argument("--out", default="statements", help="output directory")
+    parser.add_argument("--format", choices=FORMATS, default="jsonl",
+                        help="jsonl: one statement with line items per line; csv: one summary row per meter")
+    parser.add_argument("--shard-size", type=int, default=5000, help="meters per shard")
+    parser.add_argument("--workers", type=int, default=1, help="processes writing shards in parallel")
+    parser.add_argument("--force", action="store_true", help="re-plan and rewrite every shard")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    totals = {"shards": 0, "meters": 0, "payments": 0, "tokens": 0}
+    started = time.perf_counter()
+    try:
+        for shard in generate_statements(db, args.month, args.out, fmt=args.format, shard_size=args.shard_size,
+                                         workers=args.workers, force=args.force):
+            totals["shards"] += 1
+            for key in ("meters", "payments", "tokens"):
+                totals[key] += shard[key]
+            logger.info(f"Shard {shard['index']}: {shard['meters']} meter(s)")
+    finally:
+        db.close()
+
+    elapsed = time.perf_counter() - started
+    totals["seconds"] = round(elapsed, 2)
+    totals["meters_per_sec"] = round(totals["meters"] / elapsed, 1) if elapsed else 0.0
+    print(json.dumps(totals, indent=2))
+
+
+if __name__ == "__main__":
+    main()
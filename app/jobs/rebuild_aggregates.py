@@ -0,0 +1,41 @@
+"""
+Verify or rebuild meter_aggregates from the payment and token history.
+
+    python -m app.jobs.rebuild_aggregates --verify-only
+    python -m app.jobs.rebuild_aggregates --workers 4 --chunk-size 5000
+
+Drifted meters are printed as JSON lines; a summary is printed at the end.
+"""
+import argparse
+import json
+
+from app.core.database import SessionLocal
+from app.services.aggregate_rebuild_service import rebuild_aggregates
+from app.utils.logger import get_logger
+
+logger = get_logger("RebuildAggregates")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify or rebuild meter_aggregates")
+    parser.add_argument("--verify-only", action="store_true", help="report drift without writing")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="meters per range")
+    parser.add_argument("--workers", type=int, default=1, help="processes checking ranges in parallel")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    drifted = 0
+    try:
+        for record in rebuild_aggregates(db, repair=not args.verify_only,
+                                         chunk_size=args.chunk_size, workers=args.workers):
+            drifted += 1
+            print(json.dumps(record, default=str))
+    finally:
+        db.close()
+
+    action = "reported" if args.verify_only else "repaired"
+    logger.info(f"✅ {drifted} drifted meter(s) {action}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Reconcile an M-Pesa statement CSV against the mpesa_transactions table.
+
+    python -m app.jobs.reconcile_statement statement.csv --report discrepancies.csv
+    python -m app.jobs.reconcile_statement statement.csv --enqueue-missing
+
+Missing, extra, duplicate and amount-mismatched transactions are written to the
+report CSV; a summary is printed at the end.
+"""
+import argparse
+import json
+from datetime import datetime
+
+from app.core.database import SessionLocal
+from app.services.reconciliation_service import reconcile_statement
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reconcile an M-Pesa statement CSV")
+    parser.add_argument("statement", help="statement CSV exported from the M-Pesa org portal")
+    parser.add_argument("--report", default="reconciliation_report.csv", help="discrepancy report CSV")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--tolerance", type=float, default=0.005, help="allowed amount difference")
+    parser.add_argument("--enqueue-missing", action="store_true",
+                        help="process missing transactions like late confirmations (queued for the "
+                             "callback workers when CONFIRMATION_MODE=queued, else inline)")
+    parser.add_argument("--from", dest="window_start", type=datetime.fromisoformat,
+                        help="start of the extra-transaction window, EAT (default: first statement row)")
+    parser.add_argument("--to", dest="window_end", type=datetime.fromisoformat,
+                        help="end of the extra-transaction window, EAT (default: last statement row)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        report = reconcile_statement(
+            db, args.statement, args.report,
+            chunk_size=args.chunk_size,
+            enqueue_missing=args.enqueue_missing,
+            tolerance=args.tolerance,
+            window_start=args.window_start,
+            window_end=args.window_end,
+        )
+    finally:
+        db.close()
+    print(json.dumps(report.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
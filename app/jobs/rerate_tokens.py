@@ -0,0 +1,46 @@
+"""
+Re-rate the tokens vended in a period under the configured (or a proposed) tariff.
+
+    python -m app.jobs.rerate_tokens --from 2025-10-01 --to 2025-11-01
+    python -m app.jobs.rerate_tokens --from 2025-10-01 --to 2025-11-01 --tariff-file proposed.json
+
+Meters whose re-rated units differ from the stored ones are printed as JSON
+lines; a summary is printed at the end. Nothing is written to the database.
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from app.core.database import SessionLocal
+from app.models import payment  # noqa: F401  VenderToken.payment resolves MpesaTransaction
+from app.services.tariff_service import load_tariff_schedule, rerate_by_meter, rerate_tokens, summarize_rerate
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-rate vending_tokens under a tariff schedule")
+    parser.add_argument("--from", dest="start", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--to", dest="end", type=datetime.fromisoformat, required=True)
+    parser.add_argument("--tariff-file", help="tariff JSON to simulate (default: TARIFF_FILE)")
+    parser.add_argument("--meter", help="only this meter")
+    parser.add_argument("--tolerance", type=float, default=0.01, help="allowed units difference")
+    args = parser.parse_args()
+
+    schedule = load_tariff_schedule(args.tariff_file) if args.tariff_file else None
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        result = rerate_tokens(db, args.start, args.end, schedule, meter_number=args.meter)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    for record in rerate_by_meter(result, args.tolerance):
+        print(json.dumps(record))
+    summary = summarize_rerate(result, args.tolerance)
+    summary["seconds"] = round(elapsed, 3)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
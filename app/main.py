@@ -1,11 +1,19 @@
-from fastapi import FastAPI
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
 from app.routes.mpesa_route import mpesa_router
 from app.routes import vending
-from app.core.database import Base, engine
+from app.core.database import Base, engine, dispose_async_engine
 from app.routes.meter_routes import router as meter_router
 from app.routes.aggregate_route import router as aggregate_router
-
-Base.metadata.create_all(bind=engine)
+from app.core.config import settings
+from app.services.callback_queue_service import worker_pool
+from app.services.sms_outbox_service import dispatcher as sms_dispatcher, outbox_enabled
+from app.utils.metrics import metrics, HTTP_REQUESTS, HTTP_REQUEST_SECONDS
+from app.services.timeseries_export import exporter as timeseries_exporter
+from app.services.meter_registry import meter_registry
+from app.utils.logger import stop_logging
+from app.core.schema import prepare_schema
 
 app = FastAPI(title="M-Pesa API Backend")
 
@@ -15,6 +23,55 @@ app.include_router(meter_router)
 app.include_router(aggregate_router)
 
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw path, to keep label cardinality bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=path)
+        HTTP_REQUESTS.inc(method=request.method, route=path, status=status)
+
+
+@app.on_event("startup")
+def start_background_workers():
+    # Not at import: importing the app must not touch the database
+    prepare_schema(engine, Base.metadata)
+    metrics.start_flusher(settings.METRICS_FLUSH_INTERVAL)
+    if settings.CONFIRMATION_MODE == "queued":
+        worker_pool.start()
+    if outbox_enabled():
+        sms_dispatcher.start()
+    if settings.METER_VALIDATION_ENABLED:
+        meter_registry.start()
+
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    worker_pool.stop()
+    sms_dispatcher.stop()
+    timeseries_exporter.stop()
+    meter_registry.stop()
+    metrics.stop_flusher()
+    stop_logging()
+
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await dispose_async_engine()
+
+
 @app.get("/")
 def root():
     return {"message": "Welcome to the M-Pesa API Backend"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from datetime import datetime
+from app.core.database import Base
+
+
+class CallbackQueueItem(Base):
+    """Raw C2B confirmation payload waiting to be processed by the worker pool."""
+    __tablename__ = "callback_queue"
+
+    id = Column(Integer, primary_key=True, index=True)
+    trans_id = Column(String(50), nullable=True)
+    payload = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_callback_queue_status_next_attempt", "status", "next_attempt_at"),
+    )
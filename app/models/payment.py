@@ -1,7 +1,11 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
-from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index
+from datetime import datetime, timedelta
 from app.core.database import Base
 from sqlalchemy.orm import relationship
+
+# TransTime (trans_datetime) is East Africa Time; created_at and token timestamps are UTC
+EAT_OFFSET = timedelta(hours=3)
+
 class MpesaTransaction(Base):
     __tablename__ = "mpesa_transactions"
 
@@ -9,6 +13,8 @@ class MpesaTransaction(Base):
     transaction_type = Column(String(50))
     trans_id = Column(String(50), unique=True)
     trans_time = Column(String(50))
+    # TransTime parsed at ingest (Safaricom local time, as sent) for range queries
+    trans_datetime = Column(DateTime, nullable=True)
     trans_amount = Column(Float)
     business_short_code = Column(String(20))
     bill_ref_number = Column(String(50))
@@ -21,5 +27,11 @@ class MpesaTransaction(Base):
     last_name = Column(String(50))
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    vended_tokens = relationship("VenderToken", back_populates="payment", lazy="joined")
+    # Loaded only when asked for (selectinload per query); listings select columns instead
+    vended_tokens = relationship("VenderToken", back_populates="payment", lazy="select")
 
+    __table_args__ = (
+        Index("ix_mpesa_transactions_bill_ref_id", "bill_ref_number", "id"),
+        Index("ix_mpesa_transactions_msisdn_id", "msisdn", "id"),
+        Index("ix_mpesa_transactions_trans_datetime", "trans_datetime", "id"),
+    )
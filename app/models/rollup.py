@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, Index, UniqueConstraint
+from app.core.database import Base
+
+
+class MeterUsageRollup(Base):
+    """Per-meter consumption and revenue totals for one hour or one day (East Africa Time)."""
+    __tablename__ = "meter_usage_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    meter_number = Column(String, nullable=False)
+    granularity = Column(String(4), nullable=False)  # "hour" or "day"
+    bucket_start = Column(DateTime, nullable=False)
+
+    units_dispensed = Column(Float, nullable=False, default=0.0)
+    token_count = Column(Integer, nullable=False, default=0)
+    amount_vended = Column(Float, nullable=False, default=0.0)
+    amount_paid = Column(Float, nullable=False, default=0.0)
+    payment_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("meter_number", "granularity", "bucket_start", name="uq_meter_usage_rollup_bucket"),
+        Index("ix_meter_usage_rollups_granularity_bucket", "granularity", "bucket_start"),
+    )
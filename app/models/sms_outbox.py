@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from datetime import datetime
+from app.core.database import Base
+
+
+class SmsOutboxMessage(Base):
+    """Outgoing SMS waiting to be dispatched in bulk by the outbox dispatcher."""
+    __tablename__ = "sms_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    provider = Column(String(30), nullable=False)
+    phone_number = Column(String(20), nullable=False)
+    message = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_sms_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
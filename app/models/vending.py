@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, func
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Index, func
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 
@@ -11,7 +11,11 @@ class VenderToken(Base):
     units = Column(Float, nullable=False)
     token = Column(String, unique=True, nullable=False)
     phone_number = Column(String, nullable=False)
-    payment_id = Column(Integer, ForeignKey("mpesa_transactions.id"))
+    payment_id = Column(Integer, ForeignKey("mpesa_transactions.id"), index=True)
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
     
-    payment = relationship("MpesaTransaction", back_populates="vended_tokens", lazy="joined")
+    payment = relationship("MpesaTransaction", back_populates="vended_tokens", lazy="select")
+
+    __table_args__ = (
+        Index("ix_vending_tokens_meter_timestamp", "meter_number", timestamp.desc(), id.desc()),
+    )
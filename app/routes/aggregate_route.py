@@ -1,19 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 
 from sqlalchemy.orm import Session
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, get_db
 from app.services.aggregate_service import get_home_aggregate
 from app.services.aggregate_service import get_all_home_aggregates as fetch_home_data
+from app.services.aggregate_service import get_home_aggregates_page, iter_home_aggregates_ndjson, decode_cursor
+from app.services.aggregate_cache import get_aggregate_cache
+from app.services.rollup_service import get_meter_usage, get_revenue
 
 
 router=APIRouter(prefix="/api/aggregate", tags=['Aggregate'])
-def get_db():
-    db=SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        
+
 @router.get("/home/{meter_number}")
 def get_home_page_data(meter_number:str, db:Session=Depends(get_db)):
     data=get_home_aggregate(db,meter_number)
@@ -21,7 +21,57 @@ def get_home_page_data(meter_number:str, db:Session=Depends(get_db)):
         raise HTTPException(status_code=404, detail="Data not found")
     return data
 
+def _stream_home_data(cursor:Optional[str]):
+    # The request-scoped session may be closed before the body is streamed,
+    # so the stream owns its own session
+    db=SessionLocal()
+    try:
+        yield from iter_home_aggregates_ndjson(db,cursor=cursor)
+    finally:
+        db.close()
+
 @router.get("/home")
-def get_all_home_data(db:Session=Depends(get_db)):
-    data=fetch_home_data(db)
-    return data
\ No newline at end of file
+def get_all_home_data(limit:Optional[int]=Query(None,ge=1,le=1000),
+                      cursor:Optional[str]=None,
+                      format:str=Query("json",pattern="^(json|ndjson)$"),
+                      db:Session=Depends(get_db)):
+    """
+    Without `limit`/`cursor` returns the full list (legacy shape).
+    With them returns one keyset page: {"items": [...], "next_cursor": ...}.
+    format=ndjson streams every summary after `cursor`, one JSON object per line.
+    """
+    try:
+        if format=="ndjson":
+            # Validate the cursor before the response starts streaming
+            if cursor:
+                decode_cursor(cursor)
+            return StreamingResponse(_stream_home_data(cursor),media_type="application/x-ndjson")
+        if limit is None and cursor is None:
+            return fetch_home_data(db)
+        return get_home_aggregates_page(db,limit=limit or 100,cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Hit/miss/eviction counters of the per-meter aggregate cache"""
+    return get_aggregate_cache().stats()
+
+@router.get("/usage/{meter_number}")
+def get_meter_usage_data(meter_number:str,
+                         granularity:str=Query("day",pattern="^(hour|day)$"),
+                         start:Optional[datetime]=Query(None,alias="from"),
+                         end:Optional[datetime]=Query(None,alias="to"),
+                         db:Session=Depends(get_db)):
+    """Units and revenue per hour/day bucket (EAT) for one meter in [from, to)"""
+    buckets=get_meter_usage(db,meter_number,granularity,start,end)
+    return {"meter_number":meter_number,"granularity":granularity,"buckets":buckets}
+
+@router.get("/revenue")
+def get_revenue_data(granularity:str=Query("day",pattern="^(hour|day)$"),
+                     start:Optional[datetime]=Query(None,alias="from"),
+                     end:Optional[datetime]=Query(None,alias="to"),
+                     db:Session=Depends(get_db)):
+    """Revenue and consumption across all meters per hour/day bucket (EAT) in [from, to)"""
+    buckets=get_revenue(db,granularity,start,end)
+    return {"granularity":granularity,"buckets":buckets}
@@ -1,34 +1,39 @@
-from fastapi import APIRouter,Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter,Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from app.core.database import SessionLocal
-from app.models.meter import MeterAggregare
+from app.core.database import get_db
+from app.services.aggregate_service import get_meter_aggregate as fetch_meter_aggregate
+from app.services.meter_history_service import get_meter_tokens_page, get_meter_payments_page
 from app.utils.logger import get_logger
 
 router=APIRouter(prefix="/api/meter", tags=['Meter'])
 logger=get_logger("MeterRoutes")
 
-def get_db():
-    db=SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-        
 @router.get("/{meter_number}/aggregate")
 def get_meter_aggregate(meter_number:str,db:Session=Depends(get_db)):
-    agg=db.query(MeterAggregare).filter(MeterAggregare.meter_number==meter_number).first()
+    agg=fetch_meter_aggregate(db,meter_number)
     if not agg:
         raise HTTPException(status_code=404,detail="Meter not found")
-    return {
-        "meter_number":agg.meter_number,
-        "last_entered_units":agg.last_entered_units,
-        "last_update_at":agg.last_update_at,
-        "last_entered_amount":agg.last_entered_amount,
-        "last_payer":agg.last_payer,
-        "total_dispensed_units":agg.total_dispensed_units,
-        "total_token_count":agg.total_token_count,
-        "last_token_time":agg.last_token_time,
-        "total_amount_paid":agg.total_amount_paid,
-        "total_payment_count":agg.total_payment_count,
-        "last_payment_time":agg.last_payment_time
-    }
\ No newline at end of file
+    return agg
+
+@router.get("/{meter_number}/tokens")
+def get_meter_tokens(meter_number:str,
+                     limit:int=Query(20,ge=1,le=500),
+                     cursor:Optional[str]=None,
+                     db:Session=Depends(get_db)):
+    """Token history, newest first: {"items": [...], "next_cursor": ...}"""
+    try:
+        return get_meter_tokens_page(db,meter_number,limit=limit,cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400,detail="Invalid cursor")
+
+@router.get("/{meter_number}/payments")
+def get_meter_payments(meter_number:str,
+                       limit:int=Query(20,ge=1,le=500),
+                       cursor:Optional[str]=None,
+                       db:Session=Depends(get_db)):
+    """Payments made against this meter, newest first: {"items": [...], "next_cursor": ...}"""
+    try:
+        return get_meter_payments_page(db,meter_number,limit=limit,cursor=cursor)
+    except ValueError:
+        raise HTTPException(status_code=400,detail="Invalid cursor")
@@ -3,30 +3,42 @@
 # CORRECTED: Callbacks that work for both M-Pesa (POST) and browser testing (GET)
 # ============================================
 
-from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
 from sqlalchemy.orm import Session
-from app.core.database import SessionLocal
+from app.core.database import get_db, get_route_db, run_with_session
 from app.models.payment import MpesaTransaction
-from app.services.mpesa_services import get_access_token, register_urls, simulate_payment
-from app.utils.logger import get_logger
+from app.utils.logger import get_logger, log_payload, LazyJson
+from app.utils.metrics import CALLBACKS
+import asyncio
 import json
 from typing import Optional
 from app.core.config import settings
 from app.services.vending_services import vend_meter
-from app.services.mpesa_transaction_service import process_mpesa_transaction
+from app.services.idempotency_service import (
+    process_mpesa_transaction_once,
+    process_mpesa_transaction_once_async,
+    find_processed_transaction,
+    remember_transaction,
+    recent_trans_ids,
+    get_idempotency_stats,
+)
+from app.services.callback_queue_service import enqueue_callback
+from app.services.meter_registry import meter_registry
+from app.services.mpesa_transaction_service import (
+    parse_trans_time,
+    get_payment_receipt,
+    TRANSACTION_SUMMARY_COLUMNS,
+    TRANSACTION_DETAIL_COLUMNS,
+)
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
 
 # IMPORTANT: DO NOT use "mpesa" in the prefix!
 # Use a different word that doesn't trigger Safaricom's keyword filter
 mpesa_router = APIRouter(prefix="/api/daraja", tags=["Daraja"])  # Changed from /api/mpesa
 logger = get_logger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
 # ============================================
 # CALLBACK ENDPOINTS
@@ -34,10 +46,12 @@ def get_db():
 # ============================================
 
 @mpesa_router.api_route("/validation", methods=["GET", "POST"])
-async def c2b_validation(request: Request, db: Session = Depends(get_db)):
+async def c2b_validation(request: Request):
     """
     M-Pesa Validation Callback
     Accepts both GET (for testing) and POST (from M-Pesa)
+    The meter check uses the in-memory meter registry; only a miss is checked
+    against the database (a meter created since the last refresh).
     """
     try:
         # Check if it's a GET request (testing)
@@ -51,37 +65,47 @@ async def c2b_validation(request: Request, db: Session = Depends(get_db)):
         
         # POST request - actual M-Pesa callback
         data = await request.json()
-        logger.info(f"🔥 Validation Callback Received (POST)")
-        logger.info(f"Data: {json.dumps(data, indent=2)}")
         
         # Extract data
-        bill_ref_number = data.get('BillRefNumber', '')
-        trans_amount = data.get('TransAmount', 0)
-        msisdn = data.get('MSISDN', '')
+        bill_ref_number = (data.get('BillRefNumber') or '').strip()
+        trans_amount = float(data.get('TransAmount') or 0)
+        logger.info(f"🔥 Validation Callback Received (POST): TransID={data.get('TransID')}, "
+                    f"meter={bill_ref_number}, amount={trans_amount}")
         
         # Validate meter number
         if not bill_ref_number:
             logger.warning("❌ Missing BillRefNumber")
+            CALLBACKS.inc(kind="validation", outcome="rejected")
             return {"ResultCode": "C2B00011", "ResultDesc": "Invalid account number"}
         
+        if settings.METER_VALIDATION_ENABLED and meter_registry.is_known(bill_ref_number) is False \
+                and not await asyncio.to_thread(meter_registry.lookup, bill_ref_number):
+            logger.warning(f"❌ Unknown meter: {bill_ref_number}")
+            CALLBACKS.inc(kind="validation", outcome="rejected")
+            return {"ResultCode": "C2B00012", "ResultDesc": "Invalid account number"}
+        
         # Validate amount
         if trans_amount < 1:
             logger.warning(f"❌ Amount too low: {trans_amount}")
+            CALLBACKS.inc(kind="validation", outcome="rejected")
             return {"ResultCode": "C2B00013", "ResultDesc": "Amount too low"}
         
         logger.info(f"✅ Validation passed for meter: {bill_ref_number}, amount: {trans_amount}")
+        CALLBACKS.inc(kind="validation", outcome="accepted")
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
         
     except Exception as e:
         logger.error(f"❌ Validation error: {str(e)}")
+        CALLBACKS.inc(kind="validation", outcome="error")
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
 
 
 @mpesa_router.api_route("/confirmation", methods=["GET", "POST"])
-async def c2b_confirmation(request: Request, db: Session = Depends(get_db)):
+async def c2b_confirmation(request: Request, db = Depends(get_route_db)):
     """
     M-Pesa Confirmation Callback
     Accepts both GET (for testing) and POST (from M-Pesa)
+    With DB_ASYNC=true `db` is an AsyncSession and no query blocks the event loop.
     """
     try:
         # Check if it's a GET request (testing)
@@ -89,7 +113,7 @@ async def c2b_confirmation(request: Request, db: Session = Depends(get_db)):
             logger.info("🧪 GET request to confirmation endpoint (testing)")
             
             # Count transactions
-            txn_count = db.query(MpesaTransaction).count()
+            txn_count = await run_with_session(db, lambda session: session.query(func.count(MpesaTransaction.id)).scalar())
             
             return {
                 "status": "confirmation endpoint is working",
@@ -100,21 +124,37 @@ async def c2b_confirmation(request: Request, db: Session = Depends(get_db)):
         
         # POST request - actual M-Pesa callback
         data = await request.json()
-        logger.info(f"✅ Confirmation Callback Received (POST)")
-        logger.info(f"Data: {json.dumps(data, indent=2)}")
+        logger.info("✅ Confirmation Callback Received (POST): TransID=%s", data.get('TransID'))
+        log_payload(logger, "Confirmation payload", data)
         
-        # Save transaction
-        transaction = process_mpesa_transaction(db,data)
-       
+        # Queued mode: persist the raw payload and acknowledge at once,
+        # the callback worker pool does the vend + SMS
+        if settings.CONFIRMATION_MODE == "queued":
+            if recent_trans_ids.get(data.get('TransID')) is not None:
+                logger.info(f"🔁 Duplicate confirmation for {data.get('TransID')}, already processed")
+                CALLBACKS.inc(kind="confirmation", outcome="duplicate")
+                return {"ResultCode": 0, "ResultDesc": "Success"}
+            item = await run_with_session(db, enqueue_callback, data)
+            logger.info(f"📥 Confirmation queued: QueueID={item.id}, TransID={item.trans_id}")
+            CALLBACKS.inc(kind="confirmation", outcome="queued")
+            return {"ResultCode": 0, "ResultDesc": "Success"}
         
+        # Save transaction (repeated TransIDs short-circuit to the original result)
+        if settings.DB_ASYNC:
+            result = await process_mpesa_transaction_once_async(db, data)
+        else:
+            result = process_mpesa_transaction_once(db, data)
         
-        logger.info(f"💾 Transaction saved: ID={transaction.id}, TransID={transaction.trans_id}")
+        if not result["duplicate"]:
+            logger.info(f"💾 Transaction saved: ID={result['id']}, TransID={result['trans_id']}")
         
+        CALLBACKS.inc(kind="confirmation", outcome="duplicate" if result["duplicate"] else "processed")
         return {"ResultCode": 0, "ResultDesc": "Success"}
         
     except Exception as e:
         logger.error(f"❌ Confirmation error: {str(e)}")
-        db.rollback()
+        await run_with_session(db, Session.rollback)
+        CALLBACKS.inc(kind="confirmation", outcome="error")
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
 
 
@@ -131,10 +171,12 @@ async def mpesa_timeout(request: Request):
     
     try:
         data = await request.json()
-        logger.warning(f"⏰ Timeout Callback: {json.dumps(data, indent=2)}")
+        logger.warning("⏰ Timeout Callback: %s", LazyJson(data))
+        CALLBACKS.inc(kind="timeout", outcome="received")
         return {"ResultCode": 0, "ResultDesc": "Timeout received"}
     except Exception as e:
         logger.error(f"Timeout error: {str(e)}")
+        CALLBACKS.inc(kind="timeout", outcome="error")
         return {"ResultCode": 0, "ResultDesc": "Accepted"}
 
 
@@ -150,6 +192,8 @@ async def register_urls_endpoint():
     """
     try:
         logger.info("📝 Registering C2B URLs...")
+        # The Daraja client (and requests) is only imported when first needed
+        from app.services.mpesa_services import get_access_token, register_urls
         token = get_access_token()
         result = register_urls(token)
         
@@ -184,6 +228,7 @@ async def simulate_payment_endpoint(
         logger.info(f"💸 Initiating sandbox simulation: {amount} KSh for meter {meter_number}")
 
         # STEP 1: Call Daraja sandbox to simulate a payment
+        from app.services.mpesa_services import get_access_token, simulate_payment
         token = get_access_token()
         result = simulate_payment(token, meter_number, amount)
         logger.info(f"✅ Sandbox response: {json.dumps(result, indent=2)}")
@@ -203,6 +248,7 @@ async def simulate_payment_endpoint(
             transaction_type="Pay Bill",
             trans_id=simulated_trans_id,
             trans_time="20251016120000",  # mock time
+            trans_datetime=parse_trans_time("20251016120000"),
             trans_amount=float(amount),
             business_short_code=settings.SHORTCODE,
             bill_ref_number=meter_number,
@@ -219,7 +265,7 @@ async def simulate_payment_endpoint(
 
         # STEP 4: Trigger vending + SMS
         logger.info(f"⚙️ Triggering vending for meter {meter_number}")
-        vended_token = vend_meter(db, meter_number, transaction.msisdn, float(amount))
+        vended_token = vend_meter(db, meter_number, transaction.msisdn, float(amount), payment_id=transaction.id)
         logger.info(f"✅ Vending completed for meter {meter_number} → token: {vended_token.token}")
 
         # STEP 5: Return consolidated result
@@ -251,6 +297,7 @@ async def test_mpesa_connection():
     """Test M-Pesa API connectivity"""
     try:
         logger.info("🔌 Testing M-Pesa connection...")
+        from app.services.mpesa_services import get_access_token
         token = get_access_token()
         return {
             "success": True,
@@ -266,60 +313,86 @@ async def test_mpesa_connection():
 @mpesa_router.get("/transactions")
 async def get_transactions(
     limit: int = 50,
-    db: Session = Depends(get_db)
+    msisdn: Optional[str] = None,
+    from_time: Optional[datetime] = Query(None, alias="from"),
+    to_time: Optional[datetime] = Query(None, alias="to"),
+    db = Depends(get_route_db)
 ):
-    """Get recent transactions"""
-    transactions = db.query(MpesaTransaction).order_by(
-        MpesaTransaction.id.desc()
-    ).limit(limit).all()
+    """
+    Get recent transactions, optionally only those paid from one phone number.
+    `from`/`to` bound the transaction time (half-open, Safaricom local time)
+    and are served by the (trans_datetime, id) index.
+    """
+    def load(session: Session):
+        query = session.query(*TRANSACTION_SUMMARY_COLUMNS)
+        if msisdn:
+            # Served by the (msisdn, id) index
+            query = query.filter(MpesaTransaction.msisdn == msisdn)
+        if from_time or to_time:
+            if from_time:
+                query = query.filter(MpesaTransaction.trans_datetime >= from_time)
+            if to_time:
+                query = query.filter(MpesaTransaction.trans_datetime < to_time)
+            query = query.order_by(MpesaTransaction.trans_datetime.desc(), MpesaTransaction.id.desc())
+        else:
+            query = query.order_by(MpesaTransaction.id.desc())
+        return query.limit(limit).all()
+
+    transactions = await run_with_session(db, load)
     
     return {
         "success": True,
         "count": len(transactions),
-        "transactions": [
-            {
-                "id": txn.id,
-                "trans_id": txn.trans_id,
-                "trans_amount": txn.trans_amount,
-                "bill_ref_number": txn.bill_ref_number,
-                "msisdn": txn.msisdn,
-                "trans_time": txn.trans_time,
-                "first_name": txn.first_name,
-                "last_name": txn.last_name
-            }
-            for txn in transactions
-        ]
+        "transactions": [dict(txn._mapping) for txn in transactions]
     }
 
 
 @mpesa_router.get("/transactions/{trans_id}")
 async def get_transaction(
     trans_id: str,
-    db: Session = Depends(get_db)
+    db = Depends(get_route_db)
 ):
     """Get specific transaction"""
-    transaction = db.query(MpesaTransaction).filter(
+    transaction = await run_with_session(db, lambda session: session.query(*TRANSACTION_DETAIL_COLUMNS).filter(
         MpesaTransaction.trans_id == trans_id
-    ).first()
+    ).first())
     
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
     return {
         "success": True,
-        "transaction": {
-            "id": transaction.id,
-            "trans_id": transaction.trans_id,
-            "trans_amount": transaction.trans_amount,
-            "bill_ref_number": transaction.bill_ref_number,
-            "msisdn": transaction.msisdn,
-            "trans_time": transaction.trans_time,
-            "first_name": transaction.first_name,
-            "middle_name": transaction.middle_name,
-            "last_name": transaction.last_name,
-            "business_short_code": transaction.business_short_code,
-            "org_account_balance": transaction.org_account_balance
-        }
+        "transaction": dict(transaction._mapping)
+    }
+
+
+@mpesa_router.get("/transactions/{trans_id}/receipt")
+async def get_transaction_receipt(
+    trans_id: str,
+    db = Depends(get_route_db)
+):
+    """A payment and the token(s) it bought"""
+    receipt = await run_with_session(db, get_payment_receipt, trans_id)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Transaction not found")
+    return {"success": True, "receipt": receipt}
+
+
+@mpesa_router.get("/idempotency/stats")
+async def idempotency_stats():
+    """Duplicate-confirmation counters and TransID cache usage"""
+    return {
+        "success": True,
+        "stats": get_idempotency_stats()
+    }
+
+
+@mpesa_router.get("/meter-registry/stats")
+async def meter_registry_stats():
+    """Size and change cursor of the in-memory meter registry used by validation"""
+    return {
+        "success": True,
+        "stats": meter_registry.stats()
     }
 
 
@@ -353,7 +426,11 @@ logger = get_logger("M-Pesa")
 @router.post("/callback")
 def mpesa_callback(payload: dict, db: Session = Depends(get_db)):
     logger.info("📥 Received simulated M-Pesa callback")
-    logger.info(payload)
+    log_payload(logger, "Callback payload", payload)
+
+    if find_processed_transaction(db, payload.get("TransID")) is not None:
+        logger.info(f"🔁 Duplicate callback for {payload.get('TransID')}, not vending again")
+        return {"ResultCode": 0, "ResultDesc": "Accepted"}
 
     # Save payment record
     payment = MpesaTransaction(
@@ -366,8 +443,15 @@ def mpesa_callback(payload: dict, db: Session = Depends(get_db)):
         business_short_code="123456",
     )
     db.add(payment)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent delivery of the same TransID won the insert
+        db.rollback()
+        logger.info(f"🔁 Concurrent duplicate callback for {payload.get('TransID')}, not vending again")
+        return {"ResultCode": 0, "ResultDesc": "Accepted"}
     db.refresh(payment)
+    remember_transaction(payment)
 
     # Trigger vending immediately
     vend_meter(
@@ -375,6 +459,7 @@ def mpesa_callback(payload: dict, db: Session = Depends(get_db)):
         meter_number=payment.bill_ref_number,
         phone_number=payment.msisdn,
         amount=payment.trans_amount,
+        payment_id=payment.id,
     )
 
     return {"ResultCode": 0, "ResultDesc": "Accepted"}
\ No newline at end of file
@@ -1,9 +1,10 @@
-from fastapi import APIRouter,Depends
+from typing import List
+from fastapi import APIRouter,Depends,Body
 from sqlalchemy.orm import Session 
 from app.core.database import get_db
-from app.services.vending_services import vend_meter
+from app.services.vending_services import vend_meter, vend_batch
 
-from app.schemas.vending_schema import VendedToken
+from app.schemas.vending_schema import VendedToken, VendBatchItem, VendBatchResponse
 
 router=APIRouter(prefix="/api/vending", tags=['Vending'])
 @router.post("/generate", response_model=VendedToken)
@@ -14,4 +15,14 @@ def generate_vending_token(
                            db:Session=Depends(get_db)):
     """Simulate vending process and return token info"""
     token_data=vend_meter(db,meter_number,phone_number,amount)
-    return token_data
\ No newline at end of file
+    return token_data
+
+@router.post("/generate-batch", response_model=VendBatchResponse)
+def generate_vending_tokens_batch(items:List[VendBatchItem]=Body(...,max_length=10000),
+                                  db:Session=Depends(get_db)):
+    """Vend many meters at once (promotions, field top-ups) with per-item results"""
+    results=vend_batch(db,[item.model_dump() for item in items])
+    return {"count":len(results),
+            "vended":sum(1 for r in results if r["status"]=="vended"),
+            "results":results}
+
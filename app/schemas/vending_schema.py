@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import List, Optional
 
 
 class VendedTokenbase(BaseModel):
@@ -18,3 +19,22 @@ class VendedToken(VendedTokenbase):
 
     class Config:
         orm_mode = True
+
+class VendBatchItem(BaseModel):
+    meter_number:str
+    phone_number:str
+    amount:float
+
+class VendBatchResult(VendBatchItem):
+    status:str  # "vended", "rejected" or "failed"
+    id:Optional[int]=None
+    units:Optional[float]=None
+    token:Optional[str]=None
+    timestamp:Optional[datetime]=None
+    error:Optional[str]=None
+
+class VendBatchResponse(BaseModel):
+    count:int
+    vended:int
+    results:List[VendBatchResult]
+
@@ -0,0 +1,277 @@
+# app/services/aggregate_cache.py
+
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger("AggregateCache")
+
+
+class MemoryCacheBackend:
+    """Bounded in-process TTL/LRU store. Private to one worker process."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        """Returns (value, status) where status is "hit", "miss" or "expired"."""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None, "miss"
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None, "expired"
+            self._items.move_to_end(key)
+            return value, "hit"
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def set(self, key: str, value, ttl: float, generation: Optional[int] = None) -> int:
+        """
+        Store a value; returns the number of entries evicted to stay within bounds.
+        Skipped if `generation` is given and the key was invalidated since.
+        """
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                return 0
+            self._items[key] = (value, time.monotonic() + ttl)
+            self._items.move_to_end(key)
+            evicted = 0
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._items.pop(key, None) is not None
+
+    def invalidate(self, key: str) -> bool:
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            return self._items.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def size(self) -> int:
+        return len(self._items)
+
+
+class SqliteFileCacheBackend:
+    """
+    TTL store in a local SQLite file shared by every uvicorn worker on the host,
+    so an invalidation in one worker is seen by all of them.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS aggregate_cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_aggregate_cache_expires ON aggregate_cache (expires_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS aggregate_cache_generation ("
+            "key TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM aggregate_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, "miss"
+        if row[1] < time.time():
+            self.delete(key)
+            return None, "expired"
+        return pickle.loads(row[0]), "hit"
+
+    def generation(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT generation FROM aggregate_cache_generation WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def set(self, key: str, value, ttl: float, generation: Optional[int] = None) -> int:
+        conn = self._conn()
+        if generation is None:
+            conn.execute(
+                "INSERT OR REPLACE INTO aggregate_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, pickle.dumps(value), time.time() + ttl),
+            )
+        else:
+            # Conditional write: a no-op if any worker invalidated the key since `generation` was read
+            conn.execute(
+                "INSERT OR REPLACE INTO aggregate_cache (key, value, expires_at) SELECT ?, ?, ? "
+                "WHERE COALESCE((SELECT generation FROM aggregate_cache_generation WHERE key = ?), 0) = ?",
+                (key, pickle.dumps(value), time.time() + ttl, key, generation),
+            )
+        self._sets += 1
+        # Bounds are enforced periodically rather than on every write
+        if self._sets % 100:
+            return 0
+        conn.execute("DELETE FROM aggregate_cache WHERE expires_at < ?", (time.time(),))
+        overflow = self.size() - self.max_entries
+        if overflow <= 0:
+            return 0
+        conn.execute(
+            "DELETE FROM aggregate_cache WHERE key IN "
+            "(SELECT key FROM aggregate_cache ORDER BY expires_at LIMIT ?)",
+            (overflow,),
+        )
+        return overflow
+
+    def delete(self, key: str) -> bool:
+        return self._conn().execute("DELETE FROM aggregate_cache WHERE key = ?", (key,)).rowcount > 0
+
+    def invalidate(self, key: str) -> bool:
+        # Bump first: a concurrent conditional set then either fails or is deleted below
+        self._conn().execute(
+            "INSERT INTO aggregate_cache_generation (key, generation) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET generation = generation + 1",
+            (key,),
+        )
+        return self.delete(key)
+
+    def clear(self):
+        self._conn().execute("DELETE FROM aggregate_cache")
+
+    def size(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM aggregate_cache").fetchone()[0]
+
+
+class AggregateCache:
+    """Read-through cache of per-meter aggregate snapshots with hit/miss/eviction stats."""
+
+    def __init__(self, backend, ttl: float, enabled: bool = True):
+        self.backend = backend
+        self.ttl = ttl
+        self.enabled = enabled
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0, "invalidations": 0}
+
+    def _count(self, key: str, n: int = 1):
+        if n:
+            with self._stats_lock:
+                self._stats[key] += n
+
+    def get(self, meter_number: str) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        value, status = self.backend.get(meter_number)
+        if status == "hit":
+            self._count("hits")
+            return value
+        self._count("misses")
+        if status == "expired":
+            self._count("expirations")
+        return None
+
+    def generation(self, meter_number: str) -> Optional[int]:
+        """Read before loading a snapshot from the database and pass it to set()"""
+        return self.backend.generation(meter_number) if self.enabled else None
+
+    def set(self, meter_number: str, snapshot: dict, generation: Optional[int] = None):
+        """Cache a snapshot, unless the meter was invalidated after `generation` was read"""
+        if self.enabled:
+            self._count("evictions", self.backend.set(meter_number, snapshot, self.ttl, generation))
+
+    def invalidate(self, meter_number: str):
+        if self.enabled and self.backend.invalidate(meter_number):
+            self._count("invalidations")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["size"] = self.backend.size()
+        stats["max_entries"] = self.backend.max_entries
+        stats["ttl_seconds"] = self.ttl
+        stats["backend"] = type(self.backend).__name__
+        stats["enabled"] = self.enabled
+        return stats
+
+
+def _build_cache() -> AggregateCache:
+    if settings.AGGREGATE_CACHE_BACKEND == "sqlite":
+        backend = SqliteFileCacheBackend(settings.AGGREGATE_CACHE_PATH, settings.AGGREGATE_CACHE_MAX_ENTRIES)
+    else:
+        backend = MemoryCacheBackend(settings.AGGREGATE_CACHE_MAX_ENTRIES)
+    return AggregateCache(backend, settings.AGGREGATE_CACHE_TTL, enabled=settings.AGGREGATE_CACHE_ENABLED)
+
+
+_aggregate_cache = None
+_aggregate_cache_lock = threading.Lock()
+
+
+def get_aggregate_cache() -> AggregateCache:
+    """
+    The process-wide cache, built on first use so importing this module does
+    not create or open the SQLite cache file.
+    """
+    global _aggregate_cache
+    if _aggregate_cache is None:
+        with _aggregate_cache_lock:
+            if _aggregate_cache is None:
+                _aggregate_cache = _build_cache()
+    return _aggregate_cache
+
+
+# ============================================
+# Write-through invalidation
+# Meters changed in a session are invalidated only once that session
+# commits, so readers never cache a value that is later rolled back.
+# ============================================
+
+def mark_meter_changed(db: Session, meter_number: str):
+    db.info.setdefault("changed_meters", set()).add(meter_number)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_meters(session):
+    changed = session.info.pop("changed_meters", ())
+    if changed:
+        # Built here if needed: with the shared SQLite backend, other workers may hold the entry
+        cache = get_aggregate_cache()
+        for meter_number in changed:
+            cache.invalidate(meter_number)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_meters(session):
+    session.info.pop("changed_meters", None)
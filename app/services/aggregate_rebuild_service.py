@@ -0,0 +1,240 @@
+# app/services/aggregate_rebuild_service.py
+"""
+Recompute meter_aggregates from vending_tokens and mpesa_transactions.
+
+Meters are processed in ranges of `chunk_size` meter numbers. For each range a
+handful of GROUP BY / window queries compute the expected totals and last values,
+which are compared with the stored rows. Verify mode only reports drift; rebuild
+mode re-checks a drifted range with its rows locked and corrects it in that one
+short transaction, so no long write lock is held and concurrent increments are
+kept. Ranges can be spread over a process pool.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, func, text, union
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.database import create_db_engine
+from app.models.meter import MeterAggregare
+from app.models.payment import MpesaTransaction
+from app.models.vending import VenderToken
+from app.services.aggregate_cache import mark_meter_changed
+from app.utils.db_utils import upsert_increment
+from app.utils.logger import get_logger
+
+logger = get_logger("AggregateRebuildService")
+
+TOTAL_FIELDS = ("total_dispensed_units", "total_token_count", "total_amount_paid", "total_payment_count")
+LAST_FIELDS = ("last_entered_units", "last_update_at", "last_entered_amount", "last_payer",
+               "last_token_time", "last_payment_time")
+FLOAT_TOLERANCE = 0.005
+TIME_TOLERANCE_SECONDS = 5  # payment time is stamped at processing, created_at at insert
+
+
+def meter_ranges(db: Session, chunk_size: int) -> Iterator[Tuple[str, str]]:
+    """Stream every known meter number in order and yield inclusive (first, last) ranges."""
+    meters = union(
+        select(VenderToken.meter_number.label("meter_number")),
+        select(MpesaTransaction.bill_ref_number).where(MpesaTransaction.bill_ref_number.isnot(None)),
+        select(MeterAggregare.meter_number),
+    ).subquery()
+    stmt = select(meters.c.meter_number).order_by(meters.c.meter_number).execution_options(yield_per=chunk_size)
+
+    first, last, count = None, None, 0
+    for (meter_number,) in db.execute(stmt):
+        if first is None:
+            first = meter_number
+        last = meter_number
+        count += 1
+        if count == chunk_size:
+            yield first, last
+            first, count = None, 0
+    if first is not None:
+        yield first, last
+
+
+def compute_expected(db: Session, first: str, last: str) -> dict:
+    """Expected aggregate values for every meter in [first, last]"""
+    expected = {}
+
+    def entry(meter_number):
+        return expected.setdefault(meter_number, {
+            "total_dispensed_units": 0.0, "total_token_count": 0,
+            "total_amount_paid": 0.0, "total_payment_count": 0,
+            **{f: None for f in LAST_FIELDS},
+        })
+
+    in_vend_range = VenderToken.meter_number.between(first, last)
+    in_payment_range = MpesaTransaction.bill_ref_number.between(first, last)
+
+    for meter_number, units, tokens in db.execute(
+        select(VenderToken.meter_number, func.sum(VenderToken.units), func.count())
+        .where(in_vend_range).group_by(VenderToken.meter_number)
+    ):
+        e = entry(meter_number)
+        e["total_dispensed_units"] = float(units or 0.0)
+        e["total_token_count"] = tokens
+
+    for meter_number, paid, payments in db.execute(
+        select(MpesaTransaction.bill_ref_number, func.sum(MpesaTransaction.trans_amount), func.count())
+        .where(in_payment_range).group_by(MpesaTransaction.bill_ref_number)
+    ):
+        e = entry(meter_number)
+        e["total_amount_paid"] = float(paid or 0.0)
+        e["total_payment_count"] = payments
+
+    latest_vend = select(
+        VenderToken.meter_number, VenderToken.units, VenderToken.amount,
+        VenderToken.phone_number, VenderToken.timestamp,
+        func.row_number().over(partition_by=VenderToken.meter_number,
+                               order_by=(VenderToken.timestamp.desc(), VenderToken.id.desc())).label("rn"),
+    ).where(in_vend_range).subquery()
+    for row in db.execute(select(latest_vend).where(latest_vend.c.rn == 1)):
+        e = entry(row.meter_number)
+        e.update(last_entered_units=row.units, last_update_at=row.timestamp, last_token_time=row.timestamp,
+                 last_entered_amount=row.amount, last_payer=row.phone_number)
+
+    latest_payment = select(
+        MpesaTransaction.bill_ref_number, MpesaTransaction.trans_amount,
+        MpesaTransaction.msisdn, MpesaTransaction.created_at,
+        func.row_number().over(partition_by=MpesaTransaction.bill_ref_number,
+                               order_by=(MpesaTransaction.created_at.desc(), MpesaTransaction.id.desc())).label("rn"),
+    ).where(in_payment_range).subquery()
+    for row in db.execute(select(latest_payment).where(latest_payment.c.rn == 1)):
+        e = entry(row.bill_ref_number)
+        e["last_payment_time"] = row.created_at
+        # last amount/payer come from whichever event happened last
+        if e["last_token_time"] is None or (row.created_at and _naive(row.created_at) > _naive(e["last_token_time"])):
+            e["last_entered_amount"] = row.trans_amount
+            e["last_payer"] = row.msisdn
+
+    return expected
+
+
+def _naive(value: datetime) -> datetime:
+    return value.replace(tzinfo=None) if value is not None and value.tzinfo else value
+
+
+def _differs(field: str, stored, expected) -> bool:
+    if stored is None or expected is None:
+        if field in TOTAL_FIELDS:
+            return (stored or 0) != (expected or 0)
+        return stored is not expected and stored != expected
+    if isinstance(expected, datetime):
+        return abs((_naive(stored) - _naive(expected)).total_seconds()) > TIME_TOLERANCE_SECONDS
+    if isinstance(expected, float) or isinstance(stored, float):
+        return abs(float(stored) - float(expected)) > FLOAT_TOLERANCE
+    return stored != expected
+
+
+def _stored_aggregates(db: Session, first: str, last: str, lock: bool = False) -> dict:
+    columns = [MeterAggregare.meter_number] + [getattr(MeterAggregare, f) for f in TOTAL_FIELDS + LAST_FIELDS]
+    stmt = select(*columns).where(MeterAggregare.meter_number.between(first, last))
+    if lock:
+        stmt = stmt.with_for_update()
+    return {row.meter_number: dict(row._mapping) for row in db.execute(stmt)}
+
+
+def _compare(db: Session, first: str, last: str, lock: bool = False) -> Tuple[List[dict], dict, dict]:
+    # Locking reads the stored rows first, so the expected values computed after
+    # the lock include every event whose aggregate update committed before it
+    stored = _stored_aggregates(db, first, last, lock)
+    expected = compute_expected(db, first, last)
+
+    drifted = []
+    for meter_number in sorted(set(expected) | set(stored)):
+        exp = expected.get(meter_number) or {f: 0 for f in TOTAL_FIELDS}
+        cur = stored.get(meter_number)
+        if cur is None:
+            drifted.append({"meter_number": meter_number, "missing_row": True, "fields": {}})
+            continue
+        fields = {
+            f: {"stored": cur.get(f), "expected": exp.get(f)}
+            for f in TOTAL_FIELDS + LAST_FIELDS
+            if f in exp and _differs(f, cur.get(f), exp.get(f))
+        }
+        if fields:
+            drifted.append({"meter_number": meter_number, "missing_row": False, "fields": fields})
+    return drifted, expected, stored
+
+
+def _begin_repair(db: Session):
+    """SQLite has no row locks: take the database write lock before reading"""
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("BEGIN IMMEDIATE"))
+
+
+def check_range(db: Session, first: str, last: str, repair: bool) -> List[dict]:
+    """
+    Compare one meter range; with repair=True re-check drifted ranges with the
+    rows locked (FOR UPDATE, or BEGIN IMMEDIATE on SQLite) and correct them in
+    that transaction, so vends and payments committed meanwhile are not lost.
+    """
+    drifted, _, _ = _compare(db, first, last)
+    # Reads are done; release the read snapshot before any writes
+    db.rollback()
+    if not (repair and drifted):
+        return drifted
+
+    try:
+        _begin_repair(db)
+        drifted, expected, stored = _compare(db, first, last, lock=True)
+        now = datetime.utcnow()
+        with_last, totals_only = [], []
+        for d in drifted:
+            meter_number = d["meter_number"]
+            exp, cur = expected.get(meter_number), stored.get(meter_number) or {}
+            # Totals are corrected by a delta, last values replaced
+            row = {f: ((exp or {}).get(f) or 0) - (cur.get(f) or 0) for f in TOTAL_FIELDS}
+            row.update(meter_number=meter_number, updated_at=now)
+            if exp is not None:
+                row.update({f: exp[f] for f in LAST_FIELDS})
+                with_last.append(row)
+            else:
+                totals_only.append(row)
+            mark_meter_changed(db, meter_number)
+        if with_last:
+            upsert_increment(db, MeterAggregare, ["meter_number"], with_last, TOTAL_FIELDS,
+                             LAST_FIELDS + ("updated_at",))
+        if totals_only:
+            upsert_increment(db, MeterAggregare, ["meter_number"], totals_only, TOTAL_FIELDS, ["updated_at"])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return drifted
+
+
+def _check_range_in_worker(args) -> List[dict]:
+    database_url, first, last, repair = args
+    engine = create_db_engine(database_url)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        return check_range(db, first, last, repair)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def rebuild_aggregates(db: Session, repair: bool, chunk_size: int = 5000,
+                       workers: int = 1, database_url: Optional[str] = None) -> Iterator[dict]:
+    """
+    Yield a drift record per drifted meter, range by range.
+    With workers > 1 the ranges are checked in a process pool, each process
+    using its own engine for `database_url`.
+    """
+    ranges = list(meter_ranges(db, chunk_size))
+    db.rollback()
+    logger.info(f"Checking {len(ranges)} meter range(s) with {workers} worker(s), repair={repair}")
+
+    if workers <= 1:
+        for first, last in ranges:
+            yield from check_range(db, first, last, repair)
+        return
+
+    url = database_url or str(db.get_bind().url.render_as_string(hide_password=False))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for drifted in pool.map(_check_range_in_worker, [(url, f, l, repair) for f, l in ranges]):
+            yield from drifted
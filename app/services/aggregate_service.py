@@ -1,86 +1,247 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select,update
+from sqlalchemy import select,func
+from sqlalchemy.ext.asyncio import AsyncSession
+import base64
+import json
 from datetime import datetime
+from typing import Iterator,List,Optional
 from app.models.meter import MeterAggregare
 from app.utils.logger import get_logger
+from app.utils.db_utils import upsert, upsert_increment, insert_if_absent
 from app.schemas.aggregate_schema import HomeAggregateResponse
+from app.services.aggregate_cache import get_aggregate_cache, mark_meter_changed
+from app.services import rollup_service
 
 logger=get_logger("AggregateService")
 
-def get_or_create_aggregate(db:Session,meter_number:str)->MeterAggregare:
+def get_or_create_aggregate(db:Session,meter_number:str,commit:bool=True)->MeterAggregare:
+    """
+    Fetch a meter's aggregate row, creating it first if needed.
+    Safe when several workers create the same meter at once (see insert_if_absent).
+    """
     agg=db.query(MeterAggregare).filter(MeterAggregare.meter_number==meter_number).first()
     if agg:
         return agg
-    agg=MeterAggregare(meter_number=meter_number)
-    db.add(agg)
-    db.commit()
-    db.refresh(agg)
-    return agg
-def update_on_payment(db:Session,meter_number:str,amount:float,msisdn:str,trans_time=None):
+    insert_if_absent(db,MeterAggregare,["meter_number"],dict(
+        meter_number=meter_number,
+        total_dispensed_units=0.0,total_token_count=0,
+        total_amount_paid=0.0,total_payment_count=0))
+    if commit:
+        db.commit()
+    return db.query(MeterAggregare).filter(MeterAggregare.meter_number==meter_number).one()
+
+def _upsert_aggregate(db:Session,meter_number:str,insert_values:dict,update_values:dict):
+    """Apply an aggregate change in one statement (see app.utils.db_utils.upsert)"""
+    update_values=dict(update_values,updated_at=func.now())
+    mark_meter_changed(db,meter_number)
+    upsert(db,MeterAggregare,["meter_number"],dict(insert_values,meter_number=meter_number),update_values)
+
+def update_on_payment(db:Session,meter_number:str,amount:float,msisdn:str,trans_time=None,commit:bool=True,
+                      trans_datetime=None):
+    """
+    Atomically add a payment to the meter aggregate (created on first use).
+    With commit=False the change is left in the caller's transaction.
+    `trans_datetime` (parsed TransTime, EAT) places the payment in its rollup buckets.
+    """
     if trans_time is None:
         trans_time=datetime.utcnow()
-    agg=get_or_create_aggregate(db,meter_number)
-    agg.last_entered_amount=amount
-    agg.last_payer=msisdn
-    agg.total_amount_paid=(agg.total_amount_paid or 0.0)+float(amount)
-    agg.total_payment_count(agg.total_payment_count or 0)+1
-    agg.last_payment_time=trans_time
-    db.add(agg)
-    db.commit()
-    db.refresh(agg)
+    amount=float(amount)
+    _upsert_aggregate(db,meter_number,
+                      insert_values=dict(
+                          last_entered_amount=amount,
+                          last_payer=msisdn,
+                          total_amount_paid=amount,
+                          total_payment_count=1,
+                          last_payment_time=trans_time,
+                          total_dispensed_units=0.0,
+                          total_token_count=0),
+                      update_values=dict(
+                          last_entered_amount=amount,
+                          last_payer=msisdn,
+                          total_amount_paid=func.coalesce(MeterAggregare.total_amount_paid,0.0)+amount,
+                          total_payment_count=func.coalesce(MeterAggregare.total_payment_count,0)+1,
+                          last_payment_time=trans_time))
+    rollup_service.record_payment(db,meter_number,amount,trans_time,trans_datetime)
+    if commit:
+        db.commit()
     logger.info(f"Aggregate updated for {meter_number} on payment: amount={amount}")
-    
-    return agg
 
-def update_on_vend(db:Session,meter_number:str,units:float,amount:float,token:str,phone_number:str,token_time=None):
+def update_on_vend(db:Session,meter_number:str,units:float,amount:float,token:str,phone_number:str,token_time=None,commit:bool=True):
+    """
+    Atomically add a vended token to the meter aggregate (created on first use).
+    With commit=False the change is left in the caller's transaction.
+    """
     if token_time is None:
-        token_time=datetime.now()
-    agg= get_or_create_aggregate(db,meter_number)
-    agg.last_entered_units=units
-    agg.last_update_at=token_time
-    agg.total_dispensed_units=(agg.total_dispensed_units or 0.0)+float(units)
-    agg.total_token_count=(agg.total_token_count + 0)+1
-    
-    agg.last_token_time=token_time
-    
-    
+        token_time=datetime.utcnow()
+    units=float(units)
+    insert_values=dict(
+        last_entered_units=units,
+        last_update_at=token_time,
+        total_dispensed_units=units,
+        total_token_count=1,
+        last_token_time=token_time,
+        total_amount_paid=0.0,
+        total_payment_count=0)
+    update_values=dict(
+        last_entered_units=units,
+        last_update_at=token_time,
+        total_dispensed_units=func.coalesce(MeterAggregare.total_dispensed_units,0.0)+units,
+        total_token_count=func.coalesce(MeterAggregare.total_token_count,0)+1,
+        last_token_time=token_time)
     if amount is not None:
-        agg.last_entered_amount=amount
+        insert_values["last_entered_amount"]=update_values["last_entered_amount"]=amount
     if phone_number:
-        agg.last_payer=phone_number
-        
-    db.add(agg)
-    db.commit()
-    db.refresh(agg)
+        insert_values["last_payer"]=update_values["last_payer"]=phone_number
+    _upsert_aggregate(db,meter_number,insert_values,update_values)
+    rollup_service.record_vend(db,meter_number,units,amount,token_time)
+    if commit:
+        db.commit()
     logger.info(f"Aggregate updates for {meter_number} on vend: units={units},amount={amount},token={token}")
-    return agg
+
+def update_on_vends(db:Session,vends:List[dict],commit:bool=True):
+    """
+    Apply many vends (dicts with meter_number, units, amount, phone_number,
+    timestamp) in one statement: totals are summed per meter and the last_*
+    columns come from each meter's latest vend in the list.
+    """
+    if not vends:
+        return
+    rows={}
+    for vend in vends:
+        meter_number=vend["meter_number"]
+        units=float(vend["units"])
+        row=rows.get(meter_number)
+        if row is None:
+            row=rows[meter_number]=dict(meter_number=meter_number,
+                                        total_dispensed_units=0.0,total_token_count=0,
+                                        total_amount_paid=0.0,total_payment_count=0,
+                                        last_token_time=None,updated_at=datetime.utcnow())
+        row["total_dispensed_units"]+=units
+        row["total_token_count"]+=1
+        if row["last_token_time"] is None or vend["timestamp"]>=row["last_token_time"]:
+            row.update(last_entered_units=units,last_update_at=vend["timestamp"],last_token_time=vend["timestamp"],
+                       last_entered_amount=vend["amount"],last_payer=vend["phone_number"])
+    for meter_number in rows:
+        mark_meter_changed(db,meter_number)
+    upsert_increment(db,MeterAggregare,["meter_number"],list(rows.values()),
+                     ["total_dispensed_units","total_token_count"],
+                     ["last_entered_units","last_update_at","last_token_time",
+                      "last_entered_amount","last_payer","updated_at"])
+    rollup_service.record_vends(db,vends)
+    if commit:
+        db.commit()
+    logger.info(f"Aggregates updated for {len(rows)} meter(s) on {len(vends)} vend(s)")
+
+AGGREGATE_COLUMNS=(
+    MeterAggregare.meter_number,
+    MeterAggregare.last_entered_units,
+    MeterAggregare.last_update_at,
+    MeterAggregare.last_entered_amount,
+    MeterAggregare.last_payer,
+    MeterAggregare.total_dispensed_units,
+    MeterAggregare.total_token_count,
+    MeterAggregare.last_token_time,
+    MeterAggregare.total_amount_paid,
+    MeterAggregare.total_payment_count,
+    MeterAggregare.last_payment_time,
+)
+
+def get_meter_aggregate(db:Session,meter_number:str)->Optional[dict]:
+    """Read-through lookup of a meter's aggregate snapshot; None if the meter has none"""
+    cache=get_aggregate_cache()
+    snapshot=cache.get(meter_number)
+    if snapshot is not None:
+        return snapshot
+    # Read before the SELECT: a commit that invalidates the meter meanwhile makes set() a no-op
+    generation=cache.generation(meter_number)
+    row=db.execute(select(*AGGREGATE_COLUMNS).where(MeterAggregare.meter_number==meter_number)).first()
+    if row is None:
+        return None
+    snapshot=dict(row._mapping)
+    cache.set(meter_number,snapshot,generation)
+    return snapshot
+
+async def update_on_payment_async(db:AsyncSession,meter_number:str,amount:float,msisdn:str,trans_time=None,commit:bool=True,
+                                  trans_datetime=None):
+    """update_on_payment on the async engine"""
+    await db.run_sync(update_on_payment,meter_number,amount,msisdn,trans_time,commit,trans_datetime)
+
+async def update_on_vend_async(db:AsyncSession,meter_number:str,units:float,amount:float,token:str,phone_number:str,token_time=None,commit:bool=True):
+    """update_on_vend on the async engine"""
+    await db.run_sync(update_on_vend,meter_number,units,amount,token,phone_number,token_time,commit)
+
+async def get_meter_aggregate_async(db:AsyncSession,meter_number:str)->Optional[dict]:
+    """get_meter_aggregate on the async engine"""
+    return await db.run_sync(get_meter_aggregate,meter_number)
 
 def get_home_aggregate(db:Session, meter_number:str):
     """Fetch meter Summary for the home page"""
-    meter_data=db.query(MeterAggregare).filter( 
-                                               MeterAggregare.meter_number==meter_number).first()
+    meter_data=get_meter_aggregate(db,meter_number)
     if not meter_data:
-        raise None 
+        return None
     return HomeAggregateResponse( 
-                                 meter_number=meter_data.meter_number,
-                                 last_units=meter_data.last_entered_units,
-                                 last_update=meter_data.last_update_at,
-                                 last_amount=meter_data.last_entered_amount,
-                                 last_phone_number=meter_data.last_payer
+                                 meter_number=meter_data["meter_number"],
+                                 last_units=meter_data["last_entered_units"],
+                                 last_update=meter_data["last_update_at"],
+                                 last_amount=meter_data["last_entered_amount"],
+                                 last_phone_number=meter_data["last_payer"]
                                  )
     
     
+HOME_COLUMNS=(
+    MeterAggregare.id,
+    MeterAggregare.meter_number,
+    MeterAggregare.last_entered_units,
+    MeterAggregare.last_update_at,
+    MeterAggregare.last_entered_amount,
+    MeterAggregare.last_payer,
+)
+
+def _home_row(row)->dict:
+    return {
+        "meter_number":row.meter_number,
+        "last_units":row.last_entered_units,
+        "last_update":row.last_update_at,
+        "last_amount":row.last_entered_amount,
+        "last_phone_number":row.last_payer,
+    }
+
+def encode_cursor(last_id:int)->str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor:str)->int:
+    """Raises ValueError on a malformed cursor"""
+    padded=cursor+"="*(-len(cursor)%4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
 def get_all_home_aggregates(db:Session):
     """Fetch all meter summaries for home page list"""
-    results=db.query(MeterAggregare).all()
-    return [
-        HomeAggregateResponse(
-            meter_number=m.meter_number,
-            last_units=m.last_entered_units,
-            last_update=m.last_update_at,
-            last_amount=m.last_entered_amount,
-            last_phone_number=m.last_payer,
-        )
-        for m in results
-    
-    ]
\ No newline at end of file
+    rows=db.execute(select(*HOME_COLUMNS).order_by(MeterAggregare.id))
+    return [_home_row(r) for r in rows]
+
+def get_home_aggregates_page(db:Session,limit:int=100,cursor:Optional[str]=None)->dict:
+    """
+    One keyset page of meter summaries ordered by id.
+    `next_cursor` is None on the last page.
+    """
+    stmt=select(*HOME_COLUMNS).order_by(MeterAggregare.id).limit(limit+1)
+    if cursor:
+        stmt=stmt.where(MeterAggregare.id>decode_cursor(cursor))
+    rows=db.execute(stmt).all()
+    has_more=len(rows)>limit
+    rows=rows[:limit]
+    return {
+        "items":[_home_row(r) for r in rows],
+        "next_cursor":encode_cursor(rows[-1].id) if has_more else None,
+    }
+
+def iter_home_aggregates_ndjson(db:Session,chunk_size:int=1000,cursor:Optional[str]=None)->Iterator[str]:
+    """Stream every meter summary as NDJSON lines, fetching `chunk_size` rows at a time"""
+    stmt=select(*HOME_COLUMNS).order_by(MeterAggregare.id).execution_options(yield_per=chunk_size)
+    if cursor:
+        stmt=stmt.where(MeterAggregare.id>decode_cursor(cursor))
+    for row in db.execute(stmt):
+        item=_home_row(row)
+        if item["last_update"] is not None:
+            item["last_update"]=item["last_update"].isoformat()
+        yield json.dumps(item)+"\n"
@@ -0,0 +1,181 @@
+# app/services/callback_queue_service.py
+
+import json
+import threading
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import update, or_, and_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.callback_queue import CallbackQueueItem
+from app.services.idempotency_service import process_mpesa_transaction_once
+from app.utils.logger import get_logger
+
+logger = get_logger("CallbackQueueService")
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+def enqueue_callback(db: Session, data: dict) -> CallbackQueueItem:
+    """
+    Persist a raw confirmation payload so it can be acknowledged immediately.
+    This is the only work done on the callback request path in queued mode.
+    """
+    item = CallbackQueueItem(
+        trans_id=data.get('TransID'),
+        payload=json.dumps(data),
+        status=PENDING,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(item)
+    db.commit()
+    return item
+
+
+def queued_trans_ids(db: Session, trans_ids: List[str]) -> set:
+    """The trans_ids among `trans_ids` that already have a pending or processing item"""
+    if not trans_ids:
+        return set()
+    return {trans_id for (trans_id,) in db.query(CallbackQueueItem.trans_id).filter(
+        CallbackQueueItem.trans_id.in_(trans_ids),
+        CallbackQueueItem.status.in_((PENDING, PROCESSING)),
+    )}
+
+
+def claim_batch(db: Session, limit: int) -> List[CallbackQueueItem]:
+    """
+    Claim up to `limit` due items for this worker.
+    Items left in `processing` longer than the lease (e.g. after a crash) are claimable again.
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.CALLBACK_QUEUE_LEASE_SECONDS)
+    candidates = (
+        db.query(CallbackQueueItem.id)
+        .filter(
+            or_(
+                and_(CallbackQueueItem.status == PENDING, CallbackQueueItem.next_attempt_at <= now),
+                and_(CallbackQueueItem.status == PROCESSING, CallbackQueueItem.locked_at < stale_before),
+            )
+        )
+        .order_by(CallbackQueueItem.id)
+        .limit(limit)
+        .all()
+    )
+
+    claimed = []
+    for (item_id,) in candidates:
+        # Conditional update: only one worker wins each row
+        result = db.execute(
+            update(CallbackQueueItem)
+            .where(
+                CallbackQueueItem.id == item_id,
+                or_(
+                    CallbackQueueItem.status == PENDING,
+                    and_(CallbackQueueItem.status == PROCESSING, CallbackQueueItem.locked_at < stale_before),
+                ),
+            )
+            .values(status=PROCESSING, locked_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(item_id)
+    db.commit()
+
+    if not claimed:
+        return []
+    return db.query(CallbackQueueItem).filter(CallbackQueueItem.id.in_(claimed)).order_by(CallbackQueueItem.id).all()
+
+
+def process_queue_item(db: Session, item: CallbackQueueItem) -> bool:
+    """Run the normal confirmation processing for one queued payload, recording the outcome."""
+    item_id = item.id
+    payload = json.loads(item.payload)
+    try:
+        process_mpesa_transaction_once(db, payload)
+    except Exception as e:
+        db.rollback()
+        _mark_failed_attempt(db, item_id, str(e))
+        return False
+
+    db.execute(
+        update(CallbackQueueItem)
+        .where(CallbackQueueItem.id == item_id)
+        .values(status=DONE, locked_at=None, last_error=None, updated_at=datetime.utcnow())
+    )
+    db.commit()
+    return True
+
+
+def _mark_failed_attempt(db: Session, item_id: int, error: str):
+    item = db.get(CallbackQueueItem, item_id)
+    if item is None:
+        return
+    item.attempts = (item.attempts or 0) + 1
+    item.last_error = error
+    item.locked_at = None
+    if item.attempts >= settings.CALLBACK_QUEUE_MAX_ATTEMPTS:
+        item.status = FAILED
+        logger.error(f"❌ Callback {item.trans_id} failed permanently after {item.attempts} attempts: {error}")
+    else:
+        backoff = settings.CALLBACK_QUEUE_RETRY_BASE_SECONDS * (2 ** (item.attempts - 1))
+        item.status = PENDING
+        item.next_attempt_at = datetime.utcnow() + timedelta(seconds=backoff)
+        logger.warning(f"⚠️ Callback {item.trans_id} attempt {item.attempts} failed, retrying in {backoff}s: {error}")
+    db.commit()
+
+
+def drain_once(batch_size: Optional[int] = None) -> int:
+    """Claim and process one batch. Returns the number of items handled."""
+    db = SessionLocal()
+    try:
+        items = claim_batch(db, batch_size or settings.CALLBACK_QUEUE_BATCH_SIZE)
+        for item in items:
+            process_queue_item(db, item)
+        return len(items)
+    finally:
+        db.close()
+
+
+class CallbackWorkerPool:
+    """Background threads that drain the confirmation queue."""
+
+    def __init__(self, workers: int = None, poll_interval: float = None):
+        self.workers = workers or settings.CALLBACK_QUEUE_WORKERS
+        self.poll_interval = poll_interval or settings.CALLBACK_QUEUE_POLL_INTERVAL
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"callback-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"🚀 Started {self.workers} callback queue worker(s)")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        logger.info("🛑 Callback queue workers stopped")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                handled = drain_once()
+            except Exception as e:
+                logger.error(f"❌ Callback worker error: {str(e)}")
+                handled = 0
+            if not handled:
+                self._stop.wait(self.poll_interval)
+
+
+worker_pool = CallbackWorkerPool()
@@ -0,0 +1,171 @@
+# app/services/idempotency_service.py
+
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.payment import MpesaTransaction
+from app.services.mpesa_transaction_service import store_mpesa_transaction, notify_vend
+from app.utils.logger import get_logger
+
+logger = get_logger("IdempotencyService")
+
+
+class RecentTransIDCache:
+    """Bounded LRU of recently processed TransIDs → result snapshot."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, trans_id: str) -> Optional[dict]:
+        with self._lock:
+            result = self._items.get(trans_id)
+            if result is not None:
+                self._items.move_to_end(trans_id)
+            return result
+
+    def put(self, trans_id: str, result: dict):
+        with self._lock:
+            self._items[trans_id] = result
+            self._items.move_to_end(trans_id)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+
+recent_trans_ids = RecentTransIDCache(settings.IDEMPOTENCY_CACHE_SIZE)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "processed": 0,
+    "duplicates": 0,
+    "memory_short_circuits": 0,
+    "db_short_circuits": 0,
+    "conflict_short_circuits": 0,
+}
+
+
+def _count(*keys: str):
+    with _stats_lock:
+        for key in keys:
+            _stats[key] += 1
+
+
+def get_idempotency_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    seen = stats["processed"] + stats["duplicates"]
+    stats["duplicate_rate"] = round(stats["duplicates"] / seen, 4) if seen else 0.0
+    stats["cache_size"] = len(recent_trans_ids)
+    stats["cache_capacity"] = recent_trans_ids.max_size
+    return stats
+
+
+def _snapshot(row) -> dict:
+    return {
+        "id": row.id,
+        "trans_id": row.trans_id,
+        "bill_ref_number": row.bill_ref_number,
+        "trans_amount": row.trans_amount,
+    }
+
+
+def _lookup(db: Session, trans_id: str):
+    """In-memory LRU first, then the unique trans_id index. Returns (snapshot, source)."""
+    if not trans_id:
+        return None, None
+
+    cached = recent_trans_ids.get(trans_id)
+    if cached is not None:
+        return cached, "memory"
+
+    row = db.execute(
+        select(
+            MpesaTransaction.id,
+            MpesaTransaction.trans_id,
+            MpesaTransaction.bill_ref_number,
+            MpesaTransaction.trans_amount,
+        ).where(MpesaTransaction.trans_id == trans_id)
+    ).first()
+    if row is None:
+        return None, None
+
+    result = _snapshot(row)
+    recent_trans_ids.put(trans_id, result)
+    return result, "db"
+
+
+def find_processed_transaction(db: Session, trans_id: str) -> Optional[dict]:
+    """Return the original result snapshot if this TransID was already stored, else None."""
+    result, source = _lookup(db, trans_id)
+    if result is not None:
+        _count("duplicates", f"{source}_short_circuits")
+    return result
+
+
+def remember_transaction(transaction) -> dict:
+    """Record a newly stored transaction so later deliveries short-circuit in memory."""
+    result = _snapshot(transaction)
+    if transaction.trans_id:
+        recent_trans_ids.put(transaction.trans_id, result)
+    return result
+
+
+def store_mpesa_transaction_once(db: Session, data: dict) -> Tuple[dict, Optional[tuple]]:
+    """
+    Idempotent front for store_mpesa_transaction. Returns the result snapshot
+    and the SMS arguments still to send (None for duplicates and in outbox mode).
+    """
+    trans_id = data.get('TransID')
+
+    existing = find_processed_transaction(db, trans_id)
+    if existing is not None:
+        logger.info(f"🔁 Duplicate confirmation for {trans_id}, returning original result")
+        return dict(existing, duplicate=True), None
+
+    try:
+        transaction, sms_args = store_mpesa_transaction(db, data)
+    except IntegrityError:
+        # A concurrent delivery of the same TransID won the insert; the
+        # whole unit of work was rolled back, so nothing was vended twice
+        existing, _ = _lookup(db, trans_id)
+        if existing is None:
+            raise
+        _count("duplicates", "conflict_short_circuits")
+        logger.info(f"🔁 Concurrent duplicate for {trans_id}, returning original result")
+        return dict(existing, duplicate=True), None
+
+    result = remember_transaction(transaction)
+    _count("processed")
+    return dict(result, duplicate=False), sms_args
+
+
+def process_mpesa_transaction_once(db: Session, data: dict) -> dict:
+    """
+    Idempotent front for process_mpesa_transaction.
+    A repeated TransID returns the original result with `duplicate=True`
+    and never vends or sends SMS a second time.
+    """
+    result, sms_args = store_mpesa_transaction_once(db, data)
+    if sms_args:
+        notify_vend(sms_args)
+    return result
+
+
+async def process_mpesa_transaction_once_async(db: AsyncSession, data: dict) -> dict:
+    """Async variant of process_mpesa_transaction_once (DB on the async engine, SMS in a worker thread)."""
+    result, sms_args = await db.run_sync(store_mpesa_transaction_once, data)
+    if sms_args:
+        await asyncio.to_thread(notify_vend, sms_args)
+    return result
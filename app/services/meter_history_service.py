@@ -0,0 +1,62 @@
+import base64
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import select, or_, and_
+from sqlalchemy.orm import Session
+from app.models.vending import VenderToken
+from app.models.payment import MpesaTransaction
+from app.services.aggregate_service import encode_cursor, decode_cursor
+
+# Keyset pages walk the composite indexes newest-first:
+#   vending_tokens     (meter_number, timestamp DESC, id DESC)
+#   mpesa_transactions (bill_ref_number, id)
+
+TOKEN_COLUMNS=(VenderToken.id,VenderToken.meter_number,VenderToken.token,VenderToken.units,
+               VenderToken.amount,VenderToken.phone_number,VenderToken.payment_id,VenderToken.timestamp)
+PAYMENT_COLUMNS=(MpesaTransaction.id,MpesaTransaction.trans_id,MpesaTransaction.trans_amount,
+                 MpesaTransaction.bill_ref_number,MpesaTransaction.msisdn,MpesaTransaction.trans_time,
+                 MpesaTransaction.created_at)
+
+def encode_token_cursor(timestamp:datetime,last_id:int)->str:
+    raw=f"{timestamp.isoformat()}|{last_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_token_cursor(cursor:str)->Tuple[datetime,int]:
+    """Raises ValueError on a malformed cursor"""
+    padded=cursor+"="*(-len(cursor)%4)
+    timestamp,last_id=base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp),int(last_id)
+
+def get_meter_tokens_page(db:Session,meter_number:str,limit:int=20,cursor:Optional[str]=None)->dict:
+    """Newest tokens first; `next_cursor` is None on the last page."""
+    stmt=(select(*TOKEN_COLUMNS)
+          .where(VenderToken.meter_number==meter_number)
+          .order_by(VenderToken.timestamp.desc(),VenderToken.id.desc())
+          .limit(limit+1))
+    if cursor:
+        ts,last_id=decode_token_cursor(cursor)
+        stmt=stmt.where(or_(VenderToken.timestamp<ts,
+                            and_(VenderToken.timestamp==ts,VenderToken.id<last_id)))
+    rows=db.execute(stmt).all()
+    has_more=len(rows)>limit
+    rows=rows[:limit]
+    return {
+        "items":[dict(r._mapping) for r in rows],
+        "next_cursor":encode_token_cursor(rows[-1].timestamp,rows[-1].id) if has_more else None,
+    }
+
+def get_meter_payments_page(db:Session,meter_number:str,limit:int=20,cursor:Optional[str]=None)->dict:
+    """Newest payments first; `next_cursor` is None on the last page."""
+    stmt=(select(*PAYMENT_COLUMNS)
+          .where(MpesaTransaction.bill_ref_number==meter_number)
+          .order_by(MpesaTransaction.id.desc())
+          .limit(limit+1))
+    if cursor:
+        stmt=stmt.where(MpesaTransaction.id<decode_cursor(cursor))
+    rows=db.execute(stmt).all()
+    has_more=len(rows)>limit
+    rows=rows[:limit]
+    return {
+        "items":[dict(r._mapping) for r in rows],
+        "next_cursor":encode_cursor(rows[-1].id) if has_more else None,
+    }
@@ -0,0 +1,129 @@
+# app/services/meter_registry.py
+
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.meter import Meter
+from app.utils.logger import get_logger
+
+logger = get_logger("MeterRegistry")
+
+
+class MeterRegistry:
+    """
+    In-memory set of known meter numbers for the validation callback.
+
+    Loaded in full at startup, then refreshed incrementally using `meters.id`
+    as the change cursor (meters are only ever appended). A periodic full
+    reload picks up deleted meters. Lookups are a set membership test; only a
+    miss (e.g. a meter created since the last refresh) is checked against the
+    database with lookup().
+    """
+
+    def __init__(self, refresh_interval: float = None, full_reload_interval: float = None):
+        self.refresh_interval = refresh_interval or settings.METER_REGISTRY_REFRESH_INTERVAL
+        self.full_reload_interval = full_reload_interval or settings.METER_REGISTRY_FULL_RELOAD_INTERVAL
+        self._meters = set()
+        self._cursor = 0
+        self._loaded = False
+        self._last_full_load = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_known(self, meter_number: str) -> Optional[bool]:
+        """
+        True/False once loaded; None while the registry is not loaded or the
+        meters table is empty (meters not registered in this deployment),
+        in which case callers should not reject.
+        """
+        if not self._loaded or not self._meters:
+            return None
+        return meter_number in self._meters
+
+    def load(self, db: Session):
+        """Full reload; swaps in a new set so readers never see a partial one"""
+        meters, cursor = set(), 0
+        for meter_id, meter_number in db.execute(select(Meter.id, Meter.meter_number).order_by(Meter.id)):
+            meters.add(meter_number)
+            cursor = meter_id
+        with self._lock:
+            self._meters, self._cursor = meters, cursor
+            self._loaded = True
+            self._last_full_load = time.monotonic()
+        if not meters:
+            logger.warning("⚠️ meters table is empty, validation accepts any account number")
+        logger.info(f"📇 Meter registry loaded: {len(meters)} meter(s)")
+
+    def refresh(self, db: Session) -> int:
+        """Add meters created since the last load/refresh; returns how many were added"""
+        rows = db.execute(
+            select(Meter.id, Meter.meter_number).where(Meter.id > self._cursor).order_by(Meter.id)
+        ).all()
+        if rows:
+            with self._lock:
+                self._meters.update(meter_number for _, meter_number in rows)
+                self._cursor = max(self._cursor, rows[-1][0])
+        return len(rows)
+
+    def lookup(self, meter_number: str) -> bool:
+        """One indexed query for a meter missing from the set; adds it if it exists"""
+        db = SessionLocal()
+        try:
+            found = db.execute(select(Meter.id).where(Meter.meter_number == meter_number)).first() is not None
+        finally:
+            db.close()
+        if found:
+            with self._lock:
+                self._meters.add(meter_number)
+            logger.info(f"📇 Meter {meter_number} registered since the last refresh, added")
+        return found
+
+    def stats(self) -> dict:
+        return {"loaded": self._loaded, "meters": len(self._meters), "cursor": self._cursor}
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        db = SessionLocal()
+        try:
+            self.load(db)
+        except Exception as e:
+            logger.error(f"❌ Meter registry initial load failed: {str(e)}")
+        finally:
+            db.close()
+        self._thread = threading.Thread(target=self._run, name="meter-registry", daemon=True)
+        self._thread.start()
+        logger.info("🚀 Meter registry refresher started")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info("🛑 Meter registry refresher stopped")
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            db = SessionLocal()
+            try:
+                if not self._loaded or time.monotonic() - self._last_full_load >= self.full_reload_interval:
+                    self.load(db)
+                else:
+                    added = self.refresh(db)
+                    if added:
+                        logger.info(f"📇 Meter registry picked up {added} new meter(s)")
+            except Exception as e:
+                logger.error(f"❌ Meter registry refresh error: {str(e)}")
+            finally:
+                db.close()
+
+
+meter_registry = MeterRegistry()
@@ -3,15 +3,122 @@
 # M-Pesa integration service with proper callback URLs
 # ============================================
 
-import requests
 import base64
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
 from app.core.config import settings
 from app.utils.logger import get_logger
 
 logger = get_logger(__name__)
 
 
-def get_access_token():
+SANDBOX_BASE_URL = "https://sandbox.safaricom.co.ke"
+
+
+def _build_http_session() -> requests.Session:
+    """
+    One keep-alive connection pool shared by every Daraja call, so only the
+    first request to Safaricom pays for the TCP + TLS handshake.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=settings.DARAJA_POOL_CONNECTIONS,
+        pool_maxsize=settings.DARAJA_POOL_MAXSIZE,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+http_session = _build_http_session()
+
+
+class DarajaTokenManager:
+    """
+    Caches the M-Pesa OAuth access token until shortly before it expires.
+
+    - A valid token is returned straight from memory (no network call).
+    - Inside the refresh window the current token is still returned and a
+      single background thread fetches the next one.
+    - With no usable token, callers block on one shared fetch instead of
+      each doing their own OAuth round trip.
+
+    The refresh window is capped at half the token lifetime, so a short-lived
+    token does not send every call down the background refresh path.
+    """
+
+    MAX_REFRESH_FRACTION = 0.5
+
+    def __init__(self, session: requests.Session, refresh_margin: int = 300):
+        self.session = session
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refresh_guard = threading.Lock()
+
+    def get_token(self) -> str:
+        now = time.monotonic()
+        token, expires_at, refresh_at = self._token, self._expires_at, self._refresh_at
+
+        if token and now < refresh_at:
+            return token
+
+        if token and now < expires_at:
+            self._refresh_in_background()
+            return token
+
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if self._token and time.monotonic() < self._expires_at:
+                return self._token
+            return self._fetch_locked()
+
+    def invalidate(self, token: str = None):
+        """
+        Drop the cached token, e.g. after Safaricom rejects it. With `token`,
+        only if that is still the cached one (another caller may have refreshed).
+        """
+        with self._lock:
+            if token is None or token == self._token:
+                self._token = None
+                self._expires_at = self._refresh_at = 0.0
+
+    def _refresh_in_background(self):
+        # Guarded separately so callers never wait on an in-flight fetch
+        with self._refresh_guard:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_refresh, name="daraja-token-refresh", daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            with self._lock:
+                self._fetch_locked()
+        except Exception as e:
+            # The old token is still valid; the next caller will retry
+            logger.warning(f"⚠️ Background token refresh failed: {str(e)}")
+        finally:
+            with self._refresh_guard:
+                self._refreshing = False
+
+    def _fetch_locked(self) -> str:
+        token, expires_in = _request_access_token(self.session)
+        now = time.monotonic()
+        margin = min(self.refresh_margin, expires_in * self.MAX_REFRESH_FRACTION)
+        self._token = token
+        self._expires_at = now + expires_in
+        self._refresh_at = now + expires_in - margin
+        return token
+
+
+def _request_access_token(session: requests.Session):
     """
     Get M-Pesa OAuth access token
     Token expires in 3600 seconds (1 hour)
@@ -22,15 +129,17 @@ def get_access_token():
         ).decode()
 
         headers = {"Authorization": f"Basic {credentials}"}
-        url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
+        url = f"{SANDBOX_BASE_URL}/oauth/v1/generate?grant_type=client_credentials"
         
         logger.info("🔑 Requesting M-Pesa access token...")
-        response = requests.get(url, headers=headers, timeout=10)
+        response = session.get(url, headers=headers, timeout=10)
 
         if response.status_code == 200:
-            token = response.json()["access_token"]
-            logger.info(f"✅ Access token obtained: {token[:20]}...")
-            return token
+            body = response.json()
+            token = body["access_token"]
+            expires_in = int(body.get("expires_in", 3600))
+            logger.info(f"✅ Access token obtained: {token[:20]}... (expires in {expires_in}s)")
+            return token, expires_in
         else:
             error_msg = f"Failed to get token: {response.text}"
             logger.error(f"❌ {error_msg}")
@@ -44,6 +153,29 @@ def get_access_token():
         raise
 
 
+token_manager = DarajaTokenManager(http_session, refresh_margin=settings.DARAJA_TOKEN_REFRESH_MARGIN)
+
+
+def get_access_token():
+    """
+    Get a cached M-Pesa OAuth access token.
+    A new token is only requested when the cached one is close to expiry.
+    """
+    return token_manager.get_token()
+
+
+def _daraja_post(url: str, access_token: str, payload: dict) -> requests.Response:
+    """POST to Daraja; on a 401 drop the cached token and retry once with a fresh one"""
+    headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
+    response = http_session.post(url, headers=headers, json=payload, timeout=15)
+    if response.status_code == 401:
+        logger.warning("⚠️ Daraja rejected the access token, retrying with a new one")
+        token_manager.invalidate(access_token)
+        headers["Authorization"] = f"Bearer {token_manager.get_token()}"
+        response = http_session.post(url, headers=headers, json=payload, timeout=15)
+    return response
+
+
 def register_urls(access_token: str):
     """
     Register callback URLs with Safaricom
@@ -54,12 +186,7 @@ def register_urls(access_token: str):
     - These URLs will work with Safaricom's filters
     """
     try:
-        url = "https://sandbox.safaricom.co.ke/mpesa/c2b/v1/registerurl"
-        
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        url = f"{SANDBOX_BASE_URL}/mpesa/c2b/v1/registerurl"
         
         # IMPORTANT: Using /api/daraja instead of /api/mpesa
         # "daraja" means "gateway" in Swahili - safe word!
@@ -78,7 +205,7 @@ def register_urls(access_token: str):
         logger.info(f"   Confirmation URL: {confirmation_url}")
         logger.info("   ✅ No forbidden keywords ('mpesa', 'safaricom', etc.)")
         
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        response = _daraja_post(url, access_token, payload)
         result = response.json()
         
         if response.status_code == 200 and result.get('ResponseCode') == '0':
@@ -103,12 +230,7 @@ def simulate_payment(access_token: str, meter_number: str = "MTR001", amount: st
         amount: Payment amount in KSh
     """
     try:
-        url = "https://sandbox.safaricom.co.ke/mpesa/c2b/v1/simulate"
-        
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        url = f"{SANDBOX_BASE_URL}/mpesa/c2b/v1/simulate"
         
         payload = {
             "ShortCode": settings.SHORTCODE,
@@ -120,7 +242,7 @@ def simulate_payment(access_token: str, meter_number: str = "MTR001", amount: st
         
         logger.info(f"💸 Simulating payment: {amount} KSh for meter {meter_number}")
         
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        response = _daraja_post(url, access_token, payload)
         result = response.json()
         
         if response.status_code == 200:
@@ -146,12 +268,7 @@ def query_transaction_status(access_token: str, transaction_id: str):
         transaction_id: M-Pesa transaction ID (e.g., MBN31H462N)
     """
     try:
-        url = "https://sandbox.safaricom.co.ke/mpesa/transactionstatus/v1/query"
-        
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
+        url = f"{SANDBOX_BASE_URL}/mpesa/transactionstatus/v1/query"
         
         # Note: In production, you need to encrypt the security credential
         # For sandbox, you can use the test credential directly
@@ -170,7 +287,7 @@ def query_transaction_status(access_token: str, transaction_id: str):
         
         logger.info(f"🔍 Querying transaction status: {transaction_id}")
         
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        response = _daraja_post(url, access_token, payload)
         result = response.json()
         
         if response.status_code == 200:
@@ -1,17 +1,38 @@
 # app/services/mpesa_transaction_service.py
 
+import asyncio
+from datetime import datetime
+from typing import Optional, Tuple
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.payment import MpesaTransaction
-from app.services.vending_services import vend_meter
+from app.models.vending import VenderToken
+from app.services.vending_services import vend_meter, send_vend_sms
 from app.services.aggregate_service import update_on_payment
+from app.services.sms_outbox_service import outbox_enabled
 from app.utils.logger import get_logger
+from app.utils.metrics import stage, VENDS
+from app.services.timeseries_export import exporter
 
 logger = get_logger("MpesaTransactionService")
 
-def process_mpesa_transaction(db: Session, data: dict):
+TRANS_TIME_FORMAT = "%Y%m%d%H%M%S"
+
+
+def parse_trans_time(value) -> Optional[datetime]:
+    """Parse Daraja's TransTime ("20251016120000"); None if missing or malformed"""
+    try:
+        return datetime.strptime(str(value).strip(), TRANS_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def store_mpesa_transaction(db: Session, data: dict) -> Tuple[MpesaTransaction, Optional[tuple]]:
     """
-    Process and store an M-Pesa C2B transaction.
-    This function can be used by both sandbox callbacks and live callbacks.
+    Store an M-Pesa C2B transaction with its aggregate update and vended token
+    in a single commit. Returns the transaction and the token SMS arguments for
+    notify_vend() (None in outbox mode, where the SMS was queued in the commit).
     """
 
     try:
@@ -20,6 +41,7 @@ def process_mpesa_transaction(db: Session, data: dict):
             transaction_type=data.get('TransactionType'),
             trans_id=data.get('TransID'),
             trans_time=data.get('TransTime'),
+            trans_datetime=parse_trans_time(data.get('TransTime')),
             trans_amount=float(data.get('TransAmount', 0)),
             business_short_code=data.get('BusinessShortCode'),
             bill_ref_number=data.get('BillRefNumber'),
@@ -31,32 +53,150 @@ def process_mpesa_transaction(db: Session, data: dict):
         )
 
         db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
-
-        logger.info(f"💾 Saved transaction {transaction.trans_id} for meter {transaction.bill_ref_number}")
+        with stage("transaction_insert"):
+            db.flush()
 
         # Step 1️⃣: Update aggregates
-        update_on_payment(
-            db=db,
-            meter_number=transaction.bill_ref_number,
-            amount=transaction.trans_amount,
-            msisdn=transaction.msisdn,
-            trans_time=None
-        )
+        with stage("payment_aggregate_update"):
+            update_on_payment(
+                db=db,
+                meter_number=transaction.bill_ref_number,
+                amount=transaction.trans_amount,
+                msisdn=transaction.msisdn,
+                trans_time=None,
+                commit=False,
+                trans_datetime=transaction.trans_datetime
+            )
 
         # Step 2️⃣: Trigger vending process
-        vend_meter(
+        vended = vend_meter(
             db=db,
             meter_number=transaction.bill_ref_number,
             phone_number=transaction.msisdn,
             amount=transaction.trans_amount,
+            commit=False,
+            payment_id=transaction.id
         )
 
-        logger.info(f"✅ Transaction processed successfully for {transaction.bill_ref_number}")
-        return transaction
+        trans_id, meter_number = transaction.trans_id, transaction.bill_ref_number
+        sms_args = (vended.meter_number, vended.phone_number, vended.units, vended.token)
+        payment_event = (meter_number, transaction.trans_amount, trans_id,
+                         transaction.transaction_type, transaction.created_at)
+        vend_event = (vended.meter_number, vended.units, vended.amount, vended.timestamp)
+
+        # Payment, aggregate and token are committed together
+        with stage("db_commit"):
+            db.commit()
+        logger.info(f"💾 Saved transaction {trans_id} for meter {meter_number}")
+        VENDS.inc()
+        exporter.record_payment(*payment_event)
+        exporter.record_vend(*vend_event)
+        logger.info(f"✅ Transaction processed successfully for {meter_number}")
+        return transaction, (None if outbox_enabled() else sms_args)
 
     except Exception as e:
         db.rollback()
         logger.error(f"❌ Failed to process transaction: {str(e)}")
         raise
+
+
+def notify_vend(sms_args: tuple):
+    """Step 3️⃣: notify the customer once the vend is durable; failures are logged, not raised"""
+    try:
+        with stage("sms_send"):
+            send_vend_sms(*sms_args)
+    except Exception as e:
+        logger.error(f"❌ Token SMS failed for meter {sms_args[0]}: {str(e)}")
+
+
+def process_mpesa_transaction(db: Session, data: dict):
+    """
+    Process and store an M-Pesa C2B transaction.
+    This function can be used by both sandbox callbacks and live callbacks.
+    The payment, aggregate update and vended token are written in a single commit.
+    """
+    transaction, sms_args = store_mpesa_transaction(db, data)
+    if sms_args:
+        notify_vend(sms_args)
+    return transaction
+
+
+async def process_mpesa_transaction_async(db: AsyncSession, data: dict):
+    """Async variant: the database work runs on the async engine, the SMS send in a worker thread."""
+    transaction, sms_args = await db.run_sync(store_mpesa_transaction, data)
+    if sms_args:
+        await asyncio.to_thread(notify_vend, sms_args)
+    return transaction
+
+
+# ============================================
+# Read projections (only the columns each response returns)
+# ============================================
+
+TRANSACTION_SUMMARY_COLUMNS = (
+    MpesaTransaction.id,
+    MpesaTransaction.trans_id,
+    MpesaTransaction.trans_amount,
+    MpesaTransaction.bill_ref_number,
+    MpesaTransaction.msisdn,
+    MpesaTransaction.trans_time,
+    MpesaTransaction.trans_datetime,
+    MpesaTransaction.first_name,
+    MpesaTransaction.last_name,
+)
+
+TRANSACTION_DETAIL_COLUMNS = (
+    MpesaTransaction.id,
+    MpesaTransaction.trans_id,
+    MpesaTransaction.trans_amount,
+    MpesaTransaction.bill_ref_number,
+    MpesaTransaction.msisdn,
+    MpesaTransaction.trans_time,
+    MpesaTransaction.first_name,
+    MpesaTransaction.middle_name,
+    MpesaTransaction.last_name,
+    MpesaTransaction.business_short_code,
+    MpesaTransaction.org_account_balance,
+)
+
+RECEIPT_TOKEN_COLUMNS = (
+    VenderToken.id.label("token_id"),
+    VenderToken.token,
+    VenderToken.units,
+    VenderToken.amount.label("token_amount"),
+    VenderToken.meter_number,
+    VenderToken.timestamp,
+)
+
+
+def get_payment_receipt(db: Session, trans_id: str) -> Optional[dict]:
+    """
+    A payment with the tokens it paid for, in one query: the unique trans_id
+    index finds the payment, the payment_id index its tokens.
+    """
+    rows = db.execute(
+        select(*TRANSACTION_DETAIL_COLUMNS, MpesaTransaction.created_at, *RECEIPT_TOKEN_COLUMNS)
+        .select_from(MpesaTransaction)
+        .outerjoin(VenderToken, VenderToken.payment_id == MpesaTransaction.id)
+        .where(MpesaTransaction.trans_id == trans_id)
+        .order_by(VenderToken.id)
+    ).all()
+    if not rows:
+        return None
+
+    receipt = {c.key: getattr(rows[0], c.key) for c in TRANSACTION_DETAIL_COLUMNS}
+    receipt["created_at"] = rows[0].created_at
+    receipt["tokens"] = [
+        {
+            "id": row.token_id,
+            "token": row.token,
+            "units": row.units,
+            "amount": row.token_amount,
+            "meter_number": row.meter_number,
+            "timestamp": row.timestamp,
+        }
+        for row in rows
+        if row.token_id is not None
+    ]
+    return receipt
+
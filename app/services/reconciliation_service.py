@@ -0,0 +1,285 @@
+# app/services/reconciliation_service.py
+"""
+Reconcile a downloaded M-Pesa statement CSV against mpesa_transactions.
+
+The statement is streamed in chunks. Each chunk is matched against the database
+with one indexed `trans_id IN (...)` query. Receipt numbers already seen are kept
+in a temporary on-disk SQLite index rather than in memory, so duplicate and
+"extra" detection stay within bounded memory whatever the statement size.
+Discrepancies are written straight to the report file as they are found.
+"""
+import csv
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator, List, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.payment import EAT_OFFSET, MpesaTransaction
+from app.services.callback_queue_service import enqueue_callback, queued_trans_ids
+from app.services.idempotency_service import process_mpesa_transaction_once
+from app.utils.logger import get_logger
+
+logger = get_logger("ReconciliationService")
+
+MISSING = "missing"            # on the statement, not in mpesa_transactions
+EXTRA = "extra"                # in mpesa_transactions, not on the statement
+DUPLICATE = "duplicate"        # receipt appears more than once on the statement
+AMOUNT_MISMATCH = "amount_mismatch"
+
+# Column names in Safaricom's organisation statement export
+DEFAULT_COLUMNS = {
+    "receipt": "Receipt No.",
+    "completed": "Completion Time",
+    "status": "Transaction Status",
+    "paid_in": "Paid In",
+    "account": "A/C No.",
+    "other_party": "Other Party Info",
+}
+
+STATEMENT_TIME_FORMATS = ("%d-%m-%Y %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%d/%m/%Y %H:%M:%S", "%d-%m-%Y %H:%M")
+
+
+class StatementRow:
+    __slots__ = ("receipt", "amount", "account", "msisdn", "completed")
+
+    def __init__(self, receipt: str, amount: float, account: str, msisdn: str, completed: Optional[datetime]):
+        self.receipt = receipt
+        self.amount = amount
+        self.account = account
+        self.msisdn = msisdn
+        self.completed = completed
+
+    def to_callback_payload(self) -> dict:
+        """Rebuild a C2B confirmation payload so the row can be processed like a callback."""
+        return {
+            "TransactionType": "Pay Bill",
+            "TransID": self.receipt,
+            "TransTime": self.completed.strftime("%Y%m%d%H%M%S") if self.completed else None,
+            "TransAmount": str(self.amount),
+            "BusinessShortCode": settings.SHORTCODE,
+            "BillRefNumber": self.account,
+            "MSISDN": self.msisdn,
+            "Source": "statement-reconciliation",
+        }
+
+
+class ReconciliationReport:
+    def __init__(self):
+        self.counts = {"statement_rows": 0, "matched": 0, MISSING: 0, EXTRA: 0,
+                       DUPLICATE: 0, AMOUNT_MISMATCH: 0, "queued": 0, "processed": 0, "process_failed": 0}
+
+    def summary(self) -> dict:
+        return dict(self.counts)
+
+
+def _parse_amount(value: str) -> Optional[float]:
+    value = (value or "").replace(",", "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _parse_time(value: str) -> Optional[datetime]:
+    value = (value or "").strip()
+    for fmt in STATEMENT_TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _parse_msisdn(other_party: str) -> str:
+    # "254708374149 - JOHN DOE"
+    return (other_party or "").split("-", 1)[0].strip()
+
+
+def iter_statement(path: str, columns: dict = None) -> Iterator[StatementRow]:
+    """Yield incoming, completed payments from a statement CSV, one row at a time."""
+    columns = dict(DEFAULT_COLUMNS, **(columns or {}))
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for raw in csv.DictReader(f):
+            status = raw.get(columns["status"])
+            if status is not None and status.strip().lower() != "completed":
+                continue
+            amount = _parse_amount(raw.get(columns["paid_in"]))
+            receipt = (raw.get(columns["receipt"]) or "").strip()
+            if not receipt or not amount:
+                continue
+            yield StatementRow(
+                receipt=receipt,
+                amount=amount,
+                account=(raw.get(columns["account"]) or "").strip(),
+                msisdn=_parse_msisdn(raw.get(columns["other_party"])),
+                completed=_parse_time(raw.get(columns["completed"])),
+            )
+
+
+def _chunks(iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _SeenReceipts:
+    """On-disk set of statement receipt numbers (temporary SQLite file)."""
+
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(prefix="reconcile_", suffix=".db")
+        os.close(fd)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=OFF")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute("CREATE TABLE seen (receipt TEXT PRIMARY KEY)")
+
+    def add(self, receipt: str) -> bool:
+        """Returns False if the receipt was already seen."""
+        return self.conn.execute("INSERT OR IGNORE INTO seen VALUES (?)", (receipt,)).rowcount == 1
+
+    def missing_from(self, receipts: List[str]) -> List[str]:
+        placeholders = ",".join("?" * len(receipts))
+        found = {r for (r,) in self.conn.execute(
+            f"SELECT receipt FROM seen WHERE receipt IN ({placeholders})", receipts)}
+        return [r for r in receipts if r not in found]
+
+    def close(self):
+        self.conn.close()
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _recover_missing(db: Session, rows: List[StatementRow], report: ReconciliationReport):
+    """
+    Hand statement rows missing from the database to the confirmation path: the
+    callback queue when its worker pool runs (CONFIRMATION_MODE=queued), else
+    processed here, inline, like a late confirmation.
+    """
+    if settings.CONFIRMATION_MODE == "queued":
+        already = queued_trans_ids(db, [r.receipt for r in rows])
+        for row in rows:
+            if row.receipt not in already:
+                enqueue_callback(db, row.to_callback_payload())
+                report.counts["queued"] += 1
+        return
+    for row in rows:
+        try:
+            process_mpesa_transaction_once(db, row.to_callback_payload())
+            report.counts["processed"] += 1
+        except Exception as e:
+            db.rollback()
+            report.counts["process_failed"] += 1
+            logger.error(f"❌ Could not process missing transaction {row.receipt}: {str(e)}")
+
+
+def reconcile_statement(db: Session, statement_path: str, report_path: str,
+                        chunk_size: int = 1000, enqueue_missing: bool = False,
+                        tolerance: float = 0.005, columns: dict = None,
+                        window_start: Optional[datetime] = None,
+                        window_end: Optional[datetime] = None) -> ReconciliationReport:
+    """
+    Compare a statement with mpesa_transactions and write every discrepancy to `report_path` (CSV).
+
+    "Extra" detection scans stored transactions whose TransTime lies in
+    [window_start, window_end] (East Africa Time, like the statement; rows without a
+    parsed TransTime use created_at shifted from UTC); by default the window spans the
+    statement's completion times (pass the statement period explicitly for exact
+    results at the edges).
+    With enqueue_missing, statement rows absent from the database are processed like a
+    late confirmation: queued for the callback worker pool in queued confirmation mode
+    (unless already pending), otherwise processed inline.
+    """
+    report = ReconciliationReport()
+    first_seen, last_seen = None, None
+
+    with _SeenReceipts() as seen, open(report_path, "w", newline="", encoding="utf-8") as out:
+        writer = csv.writer(out)
+        writer.writerow(["category", "trans_id", "statement_amount", "db_amount", "account", "completed"])
+
+        def emit(category, trans_id, statement_amount=None, db_amount=None, account=None, completed=None):
+            report.counts[category] += 1
+            writer.writerow([category, trans_id, statement_amount, db_amount, account,
+                             completed.isoformat() if completed else None])
+
+        # Pass 1: statement → database
+        for chunk in _chunks(iter_statement(statement_path, columns), chunk_size):
+            unique_rows = []
+            for row in chunk:
+                report.counts["statement_rows"] += 1
+                if row.completed:
+                    first_seen = min(first_seen or row.completed, row.completed)
+                    last_seen = max(last_seen or row.completed, row.completed)
+                if seen.add(row.receipt):
+                    unique_rows.append(row)
+                else:
+                    emit(DUPLICATE, row.receipt, row.amount, None, row.account, row.completed)
+
+            stored = {
+                trans_id: amount for trans_id, amount in db.execute(
+                    select(MpesaTransaction.trans_id, MpesaTransaction.trans_amount)
+                    .where(MpesaTransaction.trans_id.in_([r.receipt for r in unique_rows]))
+                )
+            } if unique_rows else {}
+
+            missing = []
+            for row in unique_rows:
+                if row.receipt not in stored:
+                    emit(MISSING, row.receipt, row.amount, None, row.account, row.completed)
+                    missing.append(row)
+                elif abs((stored[row.receipt] or 0.0) - row.amount) > tolerance:
+                    emit(AMOUNT_MISMATCH, row.receipt, row.amount, stored[row.receipt], row.account, row.completed)
+                else:
+                    report.counts["matched"] += 1
+            if enqueue_missing and missing:
+                _recover_missing(db, missing, report)
+            seen.conn.commit()
+
+        # Pass 2: database → statement, keyset-paged by id
+        start = window_start or first_seen
+        # Statement times have one-second resolution
+        end = window_end or (last_seen + timedelta(seconds=1) if last_seen else None)
+        if start is not None and end is not None:
+            in_window = or_(
+                MpesaTransaction.trans_datetime.between(start, end),
+                and_(MpesaTransaction.trans_datetime.is_(None),
+                     MpesaTransaction.created_at.between(start - EAT_OFFSET, end - EAT_OFFSET)),
+            )
+            last_id = 0
+            while True:
+                rows = db.execute(
+                    select(MpesaTransaction.id, MpesaTransaction.trans_id, MpesaTransaction.trans_amount,
+                           MpesaTransaction.bill_ref_number, MpesaTransaction.trans_datetime,
+                           MpesaTransaction.created_at)
+                    .where(MpesaTransaction.id > last_id, in_window)
+                    .order_by(MpesaTransaction.id)
+                    .limit(chunk_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                by_id = {r.trans_id: r for r in rows if r.trans_id}
+                for trans_id in seen.missing_from(list(by_id)) if by_id else []:
+                    r = by_id[trans_id]
+                    completed = r.trans_datetime or (r.created_at + EAT_OFFSET if r.created_at else None)
+                    emit(EXTRA, trans_id, None, r.trans_amount, r.bill_ref_number, completed)
+        else:
+            logger.warning("⚠️ No statement completion times and no window given; skipping extra-transaction check")
+
+    logger.info(f"✅ Reconciliation finished: {report.summary()}")
+    return report
@@ -0,0 +1,204 @@
+# app/services/rollup_service.py
+"""
+Hourly/daily per-meter usage and revenue buckets.
+
+Buckets are East Africa Time, like statements and reconciliation: a payment is
+placed by its TransTime (trans_datetime), else its UTC time + EAT_OFFSET; a vend
+by its UTC timestamp + EAT_OFFSET. So a "day" is an EAT calendar day, and range
+queries take EAT bounds.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import select, func, literal, union_all, delete, insert, or_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.rollup import MeterUsageRollup
+from app.models.payment import EAT_OFFSET, MpesaTransaction
+from app.models.vending import VenderToken
+from app.utils.db_utils import upsert_increment
+from app.utils.logger import get_logger
+
+logger = get_logger("RollupService")
+
+GRANULARITIES = ("hour", "day")
+
+
+def bucket_start(when: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return when.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _local_time(when: Optional[datetime]) -> datetime:
+    """EAT time of a UTC `when` (now if None)"""
+    return (when or datetime.utcnow()) + EAT_OFFSET
+
+
+def _add_to_buckets(db: Session, meter_number: str, when: datetime, **deltas):
+    """Increment the hour and day buckets containing `when` (EAT) by `deltas` (one statement)."""
+    if not settings.ROLLUPS_ENABLED:
+        return
+    rows = []
+    for granularity in GRANULARITIES:
+        row = dict(
+            meter_number=meter_number,
+            granularity=granularity,
+            bucket_start=bucket_start(when, granularity),
+            units_dispensed=0.0, token_count=0, amount_vended=0.0, amount_paid=0.0, payment_count=0,
+        )
+        row.update(deltas)
+        rows.append(row)
+    upsert_increment(db, MeterUsageRollup, ["meter_number", "granularity", "bucket_start"], rows, list(deltas))
+
+
+def record_payment(db: Session, meter_number: str, amount: float, when: datetime = None,
+                   trans_datetime: Optional[datetime] = None):
+    """`when` is UTC; `trans_datetime` (TransTime, already EAT) takes precedence"""
+    _add_to_buckets(db, meter_number, trans_datetime or _local_time(when), amount_paid=float(amount), payment_count=1)
+
+
+def record_vend(db: Session, meter_number: str, units: float, amount: Optional[float], when: datetime = None):
+    """`when` is the UTC vend time"""
+    _add_to_buckets(db, meter_number, _local_time(when),
+                    units_dispensed=float(units), token_count=1, amount_vended=float(amount or 0.0))
+
+
+def record_vends(db: Session, vends: List[dict]):
+    """
+    Add many vends (dicts with meter_number, units, amount, UTC timestamp) to
+    their buckets, summed per bucket and written in one statement.
+    """
+    if not settings.ROLLUPS_ENABLED or not vends:
+        return
+    buckets = {}
+    for vend in vends:
+        when = _local_time(vend.get("timestamp"))
+        for granularity in GRANULARITIES:
+            key = (vend["meter_number"], granularity, bucket_start(when, granularity))
+            row = buckets.setdefault(key, dict(
+                meter_number=key[0], granularity=granularity, bucket_start=key[2],
+                units_dispensed=0.0, token_count=0, amount_vended=0.0, amount_paid=0.0, payment_count=0,
+            ))
+            row["units_dispensed"] += float(vend["units"])
+            row["token_count"] += 1
+            row["amount_vended"] += float(vend["amount"] or 0.0)
+    upsert_increment(db, MeterUsageRollup, ["meter_number", "granularity", "bucket_start"], list(buckets.values()),
+                     ["units_dispensed", "token_count", "amount_vended"])
+
+
+# ============================================
+# Range queries (read buckets only)
+# ============================================
+
+ROLLUP_FIELDS = ("units_dispensed", "token_count", "amount_vended", "amount_paid", "payment_count")
+
+
+def get_meter_usage(db: Session, meter_number: str, granularity: str,
+                    start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """Buckets for one meter in [start, end) (EAT), oldest first"""
+    stmt = (
+        select(MeterUsageRollup.bucket_start, *(getattr(MeterUsageRollup, f) for f in ROLLUP_FIELDS))
+        .where(MeterUsageRollup.meter_number == meter_number,
+               MeterUsageRollup.granularity == granularity)
+        .order_by(MeterUsageRollup.bucket_start)
+    )
+    if start is not None:
+        stmt = stmt.where(MeterUsageRollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        stmt = stmt.where(MeterUsageRollup.bucket_start < end)
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+def get_revenue(db: Session, granularity: str,
+                start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[dict]:
+    """Totals across all meters per bucket in [start, end) (EAT), oldest first"""
+    stmt = (
+        select(
+            MeterUsageRollup.bucket_start,
+            *(func.sum(getattr(MeterUsageRollup, f)).label(f) for f in ROLLUP_FIELDS),
+            func.count(MeterUsageRollup.meter_number).label("active_meters"),
+        )
+        .where(MeterUsageRollup.granularity == granularity)
+        .group_by(MeterUsageRollup.bucket_start)
+        .order_by(MeterUsageRollup.bucket_start)
+    )
+    if start is not None:
+        stmt = stmt.where(MeterUsageRollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        stmt = stmt.where(MeterUsageRollup.bucket_start < end)
+    return [dict(row._mapping) for row in db.execute(stmt)]
+
+
+# ============================================
+# Backfill
+# ============================================
+
+def _eat_expr(dialect: str, column):
+    """A UTC column shifted to EAT in SQL"""
+    if dialect == "sqlite":
+        return func.datetime(column, f"+{int(EAT_OFFSET.total_seconds() // 3600)} hours")
+    return column + EAT_OFFSET
+
+
+def _bucket_expr(dialect: str, column, granularity: str):
+    if dialect == "sqlite":
+        # Same text format SQLAlchemy uses for DateTime on SQLite, so backfilled
+        # buckets compare equal to incrementally written ones
+        fmt = "%Y-%m-%d %H:00:00.000000" if granularity == "hour" else "%Y-%m-%d 00:00:00.000000"
+        return func.strftime(fmt, column)
+    return func.date_trunc(granularity, column)
+
+
+def backfill_rollups(db: Session, granularities=GRANULARITIES) -> dict:
+    """
+    Rebuild rollup buckets from vending_tokens and mpesa_transactions.
+    One INSERT ... SELECT per granularity, grouping both tables in the database.
+    Runs in the caller's transaction; the caller commits.
+    """
+    dialect = db.get_bind().dialect.name
+    written = {}
+    for granularity in granularities:
+        vends = select(
+            VenderToken.meter_number.label("meter_number"),
+            _bucket_expr(dialect, _eat_expr(dialect, VenderToken.timestamp), granularity).label("bucket"),
+            VenderToken.units.label("units"),
+            literal(1).label("tokens"),
+            VenderToken.amount.label("vended"),
+            literal(0.0).label("paid"),
+            literal(0).label("payments"),
+        ).where(VenderToken.timestamp.isnot(None))
+        payments = select(
+            MpesaTransaction.bill_ref_number,
+            _bucket_expr(dialect, func.coalesce(MpesaTransaction.trans_datetime,
+                                                _eat_expr(dialect, MpesaTransaction.created_at)), granularity),
+            literal(0.0),
+            literal(0),
+            literal(0.0),
+            func.coalesce(MpesaTransaction.trans_amount, 0.0),
+            literal(1),
+        ).where(or_(MpesaTransaction.trans_datetime.isnot(None), MpesaTransaction.created_at.isnot(None)),
+                MpesaTransaction.bill_ref_number.isnot(None))
+        events = union_all(vends, payments).subquery()
+
+        grouped = select(
+            events.c.meter_number,
+            literal(granularity),
+            events.c.bucket,
+            func.sum(events.c.units),
+            func.sum(events.c.tokens),
+            func.sum(events.c.vended),
+            func.sum(events.c.paid),
+            func.sum(events.c.payments),
+        ).group_by(events.c.meter_number, events.c.bucket)
+
+        db.execute(delete(MeterUsageRollup).where(MeterUsageRollup.granularity == granularity))
+        result = db.execute(
+            insert(MeterUsageRollup).from_select(
+                ["meter_number", "granularity", "bucket_start", *ROLLUP_FIELDS], grouped
+            )
+        )
+        written[granularity] = result.rowcount
+        logger.info(f"Backfilled {result.rowcount} {granularity} bucket(s)")
+    return written
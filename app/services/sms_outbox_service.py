@@ -0,0 +1,178 @@
+# app/services/sms_outbox_service.py
+
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import insert, update, or_, and_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.sms_outbox import SmsOutboxMessage
+from app.services.sms_services import get_sms_service
+from app.utils.logger import get_logger
+from app.utils.metrics import stage, SMS_SENT, SMS_FAILED
+
+logger = get_logger("SmsOutboxService")
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def outbox_enabled() -> bool:
+    return settings.SMS_DELIVERY_MODE == "outbox"
+
+
+def queue_sms(db: Session, phone_number: str, message: str, provider: str = None) -> SmsOutboxMessage:
+    """
+    Add an SMS to the outbox inside the caller's transaction.
+    It is only visible to the dispatcher once the caller commits.
+    """
+    item = SmsOutboxMessage(
+        provider=(provider or settings.SMS_PROVIDER).lower(),
+        phone_number=phone_number,
+        message=message,
+        status=PENDING,
+        next_attempt_at=datetime.utcnow(),
+    )
+    db.add(item)
+    return item
+
+
+def queue_sms_batch(db: Session, messages: List[dict], provider: str = None):
+    """Add many {"to", "message"} SMS to the outbox with one INSERT, inside the caller's transaction."""
+    if not messages:
+        return
+    now = datetime.utcnow()
+    provider = (provider or settings.SMS_PROVIDER).lower()
+    db.execute(insert(SmsOutboxMessage).values([
+        dict(provider=provider, phone_number=m["to"], message=m["message"],
+             status=PENDING, attempts=0, next_attempt_at=now, created_at=now)
+        for m in messages
+    ]))
+
+
+def claim_messages(db: Session, limit: int) -> List[SmsOutboxMessage]:
+    """Claim up to `limit` due messages; stale `sending` rows (crashed dispatcher) are reclaimed."""
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=settings.SMS_OUTBOX_LEASE_SECONDS)
+    claimable = or_(
+        and_(SmsOutboxMessage.status == PENDING, SmsOutboxMessage.next_attempt_at <= now),
+        and_(SmsOutboxMessage.status == SENDING, SmsOutboxMessage.locked_at < stale_before),
+    )
+    candidates = (
+        db.query(SmsOutboxMessage.id)
+        .filter(claimable)
+        .order_by(SmsOutboxMessage.id)
+        .limit(limit)
+        .all()
+    )
+
+    claimed = []
+    for (item_id,) in candidates:
+        # Conditional update: only one dispatcher wins each row
+        result = db.execute(
+            update(SmsOutboxMessage)
+            .where(SmsOutboxMessage.id == item_id, claimable)
+            .values(status=SENDING, locked_at=now)
+        )
+        if result.rowcount == 1:
+            claimed.append(item_id)
+    db.commit()
+
+    if not claimed:
+        return []
+    return db.query(SmsOutboxMessage).filter(SmsOutboxMessage.id.in_(claimed)).order_by(SmsOutboxMessage.id).all()
+
+
+def dispatch_batch(db: Session, batch_size: int = None) -> int:
+    """
+    Send one batch of pending messages, grouped per provider through send_bulk_sms.
+    Returns the number of messages attempted.
+    """
+    items = claim_messages(db, batch_size or settings.SMS_OUTBOX_BATCH_SIZE)
+    by_provider = defaultdict(list)
+    for item in items:
+        by_provider[item.provider].append(item)
+
+    for provider_name, batch in by_provider.items():
+        try:
+            provider = get_sms_service(provider_name)
+            with stage("sms_send_bulk"):
+                ok = provider.send_bulk_sms([{"to": m.phone_number, "message": m.message} for m in batch])
+            error = None if ok else "provider reported failure"
+        except Exception as e:
+            ok, error = False, str(e)
+
+        now = datetime.utcnow()
+        for item in batch:
+            item.locked_at = None
+            if ok:
+                item.status = SENT
+                item.sent_at = now
+                item.last_error = None
+                continue
+            item.attempts = (item.attempts or 0) + 1
+            item.last_error = error
+            if item.attempts >= settings.SMS_OUTBOX_MAX_ATTEMPTS:
+                item.status = FAILED
+            else:
+                item.status = PENDING
+                backoff = settings.SMS_OUTBOX_RETRY_BASE_SECONDS * (2 ** (item.attempts - 1))
+                item.next_attempt_at = now + timedelta(seconds=backoff)
+        db.commit()
+
+        if ok:
+            SMS_SENT.inc(len(batch), provider=provider_name)
+            logger.info(f"✅ Sent {len(batch)} SMS via {provider_name}")
+        else:
+            SMS_FAILED.inc(len(batch), provider=provider_name)
+            logger.error(f"❌ Bulk SMS via {provider_name} failed for {len(batch)} message(s): {error}")
+
+    return len(items)
+
+
+class SmsOutboxDispatcher:
+    """Background thread that flushes the outbox every flush interval."""
+
+    def __init__(self, batch_size: int = None, flush_interval: float = None):
+        self.batch_size = batch_size or settings.SMS_OUTBOX_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.SMS_OUTBOX_FLUSH_INTERVAL
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sms-outbox-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info("🚀 SMS outbox dispatcher started")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        logger.info("🛑 SMS outbox dispatcher stopped")
+
+    def _run(self):
+        while not self._stop.is_set():
+            db = SessionLocal()
+            try:
+                sent = dispatch_batch(db, self.batch_size)
+            except Exception as e:
+                logger.error(f"❌ SMS outbox dispatcher error: {str(e)}")
+                sent = 0
+            finally:
+                db.close()
+            # A full batch means more is waiting; otherwise wait for the next flush
+            if sent < self.batch_size:
+                self._stop.wait(self.flush_interval)
+
+
+dispatcher = SmsOutboxDispatcher()
@@ -1,25 +1,33 @@
 from app.services.sms_services.provider_factory import get_sms_provider
 from app.utils.logger import get_logger
+from app.utils.metrics import SMS_SENT, SMS_FAILED
 
 logger = get_logger(__name__)
 
+def build_token_message(meter: str, units: float, token: str) -> str:
+    return (
+        f"SmartWater Vending\n"
+        f"Meter: {meter}\n"
+        f"Units: {units}\n"
+        f"Token: {token}\n"
+        f"Thank you for using SmartWater!"
+    )
+
+
 class SMSService:
     """Central SMS service used across the backend."""
 
     def __init__(self, provider_name: str = "mock"):
+        self.provider_name = provider_name
         self.provider = get_sms_provider(provider_name)
 
     def send_token_sms(self, phone_number: str, token: str, units: float, meter: str):
-        message = (
-            f"SmartWater Vending\n"
-            f"Meter: {meter}\n"
-            f"Units: {units}\n"
-            f"Token: {token}\n"
-            f"Thank you for using SmartWater!"
-        )
+        message = build_token_message(meter, units, token)
         success = self.provider.send_sms(phone_number, message)
         if success:
+            SMS_SENT.inc(provider=self.provider_name)
             logger.info(f"✅ SMS sent successfully to {phone_number}")
         else:
+            SMS_FAILED.inc(provider=self.provider_name)
             logger.error(f"❌ Failed to send SMS to {phone_number}")
         return success
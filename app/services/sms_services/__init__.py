@@ -1,15 +1,17 @@
 import os
 from app.services.sms_services.mock_sms import MockSMSProvider
 
-from app.services.sms_services.twilio_sms import TwilioSMSService
-from app.services.sms_services.africastalking import AfricasTalkingSMSService
+# Real providers are imported on first use, so importing the app only loads the mock
+
 
 def get_sms_service(provider: str = None):
     provider = provider or os.getenv("SMS_PROVIDER", "mock").lower()
 
     if provider == "twilio":
+        from app.services.sms_services.twilio_sms import TwilioSMSService
         return TwilioSMSService()
     elif provider == "africastalking":
+        from app.services.sms_services.africastalking import AfricasTalkingSMSService
         return AfricasTalkingSMSService()
     else:
         return MockSMSProvider()
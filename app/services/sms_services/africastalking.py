@@ -21,3 +21,9 @@ class AfricasTalkingSMSService(ISMSProvider):
         # sms = africastalking.SMS
         # sms.send(message, [phone_number], sender_id=self.sender_id)
         return {"status": "stubbed", "provider": "africastalking", "to": phone_number}
+
+    def send_bulk_sms(self, messages):
+        # In production: one sms.send(message, recipients) per distinct message body
+        for msg in messages:
+            self.send_sms(msg['to'], msg['message'])
+        return True
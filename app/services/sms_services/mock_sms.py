@@ -7,10 +7,10 @@ class MockSMSProvider(ISMSProvider):
     """Mock SMS service for development."""
 
     def send_sms(self, to: str, message: str) -> bool:
-        logger.info(f"📱 Mock SMS → {to}: {message}")
+        logger.info("📱 Mock SMS → %s: %s", to, message)
         return True
 
     def send_bulk_sms(self, messages):
         for msg in messages:
-            logger.info(f"📱 Mock BULK SMS → {msg['to']}: {msg['message']}")
+            logger.info("📱 Mock BULK SMS → %s: %s", msg['to'], msg['message'])
         return True
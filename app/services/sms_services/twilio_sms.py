@@ -19,3 +19,9 @@ class TwilioSMSService(ISMSProvider):
         # client = Client(self.account_sid, self.auth_token)
         # client.messages.create(to=phone_number, from_=self.from_number, body=message)
         return {"status": "stubbed", "provider": "twilio", "to": phone_number}
+
+    def send_bulk_sms(self, messages):
+        # Twilio has no bulk endpoint; reuse one client for the whole batch in production
+        for msg in messages:
+            self.send_sms(msg['to'], msg['message'])
+        return True
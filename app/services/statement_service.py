@@ -0,0 +1,300 @@
+# app/services/statement_service.py
+"""
+Monthly per-meter statements: payments, tokens, units and the balance carried forward.
+
+Meters are split into shards of contiguous meter numbers (see meter_ranges).
+For one shard, two GROUP BY queries give every meter's opening position, then the
+month's payments and tokens are each streamed once, ordered by meter and time, and
+merged meter by meter, so the query count is per shard, not per meter.
+
+Each shard is written to its own file (via a temp file and rename), and the shard
+plan is saved next to them, so an interrupted run resumes with the missing shards
+only. Shards can be spread over a process pool.
+
+The balance is money paid minus money vended as tokens: non-zero when a payment
+was not vended, or a token was vended without a payment (e.g. a bulk vend).
+
+Periods and item times are East Africa Time, the clock of M-Pesa's TransTime:
+payments are placed by trans_datetime (created_at + EAT_OFFSET when it was not
+parsed), tokens by their UTC timestamp + EAT_OFFSET. The bounds are shifted for
+the UTC columns rather than the columns themselves, so the indexes still apply.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select, func
+from sqlalchemy.orm import Session, sessionmaker
+
+from app.core.database import create_db_engine
+from app.models.payment import EAT_OFFSET, MpesaTransaction
+from app.models.vending import VenderToken
+from app.services.aggregate_rebuild_service import meter_ranges
+from app.utils.logger import get_logger
+
+logger = get_logger("StatementService")
+
+FORMATS = ("jsonl", "csv")
+PLAN_FILE = "plan.json"
+STREAM_BATCH_SIZE = 2000
+CSV_COLUMNS = ("meter_number", "period", "opening_balance", "payment_count", "amount_paid",
+               "token_count", "amount_vended", "units", "closing_balance", "units_to_date")
+
+
+def month_bounds(period: str) -> Tuple[datetime, datetime]:
+    """"2025-10" -> (2025-10-01, 2025-11-01); raises ValueError on a bad period"""
+    start = datetime.strptime(period, "%Y-%m")
+    end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    return start, end
+
+
+def mask_token(token: Optional[str]) -> Optional[str]:
+    return "*" * (len(token) - 4) + token[-4:] if token and len(token) > 4 else token
+
+
+def _paid_between(start: Optional[datetime], end: Optional[datetime]):
+    """Payments whose EAT time is in [start, end): trans_datetime, else the UTC created_at"""
+    def window(column, offset):
+        clauses = []
+        if start is not None:
+            clauses.append(column >= start - offset)
+        if end is not None:
+            clauses.append(column < end - offset)
+        return and_(*clauses)
+
+    return or_(window(MpesaTransaction.trans_datetime, timedelta(0)),
+               and_(MpesaTransaction.trans_datetime.is_(None), window(MpesaTransaction.created_at, EAT_OFFSET)))
+
+
+def _payment_time(payment) -> Optional[datetime]:
+    if payment.trans_datetime is not None:
+        return payment.trans_datetime
+    return payment.created_at + EAT_OFFSET if payment.created_at else None
+
+
+def _in_shard(column, lower: Optional[str], upper: Optional[str]):
+    clauses = []
+    if lower is not None:
+        clauses.append(column >= lower)
+    if upper is not None:
+        clauses.append(column < upper)
+    return clauses
+
+
+def _opening_positions(db: Session, lower: Optional[str], upper: Optional[str], start: datetime) -> dict:
+    """meter -> [paid, vended, units] before `start` (EAT; one GROUP BY per table)"""
+    opening = {}
+    for meter_number, paid in db.execute(
+        select(MpesaTransaction.bill_ref_number, func.coalesce(func.sum(MpesaTransaction.trans_amount), 0.0))
+        .where(MpesaTransaction.bill_ref_number.isnot(None), _paid_between(None, start),
+               *_in_shard(MpesaTransaction.bill_ref_number, lower, upper))
+        .group_by(MpesaTransaction.bill_ref_number)
+    ):
+        opening.setdefault(meter_number, [0.0, 0.0, 0.0])[0] = float(paid)
+    for meter_number, vended, units in db.execute(
+        select(VenderToken.meter_number, func.coalesce(func.sum(VenderToken.amount), 0.0),
+               func.coalesce(func.sum(VenderToken.units), 0.0))
+        .where(VenderToken.timestamp < start - EAT_OFFSET, *_in_shard(VenderToken.meter_number, lower, upper))
+        .group_by(VenderToken.meter_number)
+    ):
+        position = opening.setdefault(meter_number, [0.0, 0.0, 0.0])
+        position[1], position[2] = float(vended), float(units)
+    return opening
+
+
+def _grouped(rows) -> Iterator[Tuple[str, list]]:
+    """(meter, [rows]) from a stream of rows ordered by meter (meter first)"""
+    meter_number, group = None, []
+    for row in rows:
+        if row[0] != meter_number:
+            if group:
+                yield meter_number, group
+            meter_number, group = row[0], []
+        group.append(row)
+    if group:
+        yield meter_number, group
+
+
+def _meter_order(db: Session, column):
+    """
+    Meter order for the streams: bytewise, so it matches the merge's Python
+    string comparisons (Postgres would otherwise sort by the locale).
+    """
+    return column.collate("C") if db.get_bind().dialect.name == "postgresql" else column
+
+
+def _stream(db: Session, stmt):
+    return db.execute(stmt.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE))
+
+
+def build_statements(db: Session, lower: Optional[str], upper: Optional[str], period: str) -> Iterator[dict]:
+    """Statements for every meter in [lower, upper) with history up to the end of `period`, in meter order"""
+    start, end = month_bounds(period)
+    opening = _opening_positions(db, lower, upper, start)
+
+    # Payments in arrival (id) order: sorting on the mixed EAT/UTC columns would interleave clocks
+    payments = _grouped(_stream(db, select(
+        MpesaTransaction.bill_ref_number, MpesaTransaction.trans_datetime, MpesaTransaction.created_at,
+        MpesaTransaction.trans_id, MpesaTransaction.trans_amount, MpesaTransaction.msisdn,
+    ).where(MpesaTransaction.bill_ref_number.isnot(None), _paid_between(start, end),
+            *_in_shard(MpesaTransaction.bill_ref_number, lower, upper))
+     .order_by(_meter_order(db, MpesaTransaction.bill_ref_number), MpesaTransaction.id)))
+
+    # A second connection, so both streams can be open at once
+    token_db = Session(bind=db.get_bind())
+    try:
+        tokens = _grouped(_stream(token_db, select(
+            VenderToken.meter_number, VenderToken.timestamp, VenderToken.token,
+            VenderToken.amount, VenderToken.units,
+        ).where(VenderToken.timestamp >= start - EAT_OFFSET, VenderToken.timestamp < end - EAT_OFFSET,
+                *_in_shard(VenderToken.meter_number, lower, upper))
+         .order_by(_meter_order(db, VenderToken.meter_number), VenderToken.timestamp, VenderToken.id)))
+
+        next_payment, next_token = next(payments, None), next(tokens, None)
+        quiet = iter(sorted(opening))
+        next_quiet = next(quiet, None)
+        while next_payment or next_token or next_quiet:
+            meter_number = min(m for m in (next_payment and next_payment[0], next_token and next_token[0],
+                                           next_quiet) if m is not None)
+            meter_payments, meter_tokens = [], []
+            if next_payment and next_payment[0] == meter_number:
+                meter_payments, next_payment = next_payment[1], next(payments, None)
+            if next_token and next_token[0] == meter_number:
+                meter_tokens, next_token = next_token[1], next(tokens, None)
+            while next_quiet is not None and next_quiet <= meter_number:
+                next_quiet = next(quiet, None)
+            yield _statement(meter_number, period, opening.get(meter_number), meter_payments, meter_tokens)
+    finally:
+        token_db.close()
+
+
+def _statement(meter_number: str, period: str, opening: Optional[list], payments: list, tokens: list) -> dict:
+    paid_before, vended_before, units_before = opening or (0.0, 0.0, 0.0)
+    opening_balance = round(paid_before - vended_before, 2)
+    amount_paid = sum(p.trans_amount or 0.0 for p in payments)
+    amount_vended = sum(t.amount or 0.0 for t in tokens)
+    units = sum(t.units or 0.0 for t in tokens)
+    return {
+        "meter_number": meter_number,
+        "period": period,
+        "opening_balance": opening_balance,
+        "payments": {
+            "count": len(payments),
+            "amount": round(amount_paid, 2),
+            "items": [{"time": _isoformat(_payment_time(p)), "trans_id": p.trans_id,
+                       "amount": p.trans_amount, "msisdn": p.msisdn} for p in payments],
+        },
+        "tokens": {
+            "count": len(tokens),
+            "amount": round(amount_vended, 2),
+            "units": round(units, 2),
+            "items": [{"time": _isoformat(t.timestamp and t.timestamp + EAT_OFFSET), "token": mask_token(t.token),
+                       "amount": t.amount, "units": t.units} for t in tokens],
+        },
+        "closing_balance": round(opening_balance + amount_paid - amount_vended, 2),
+        "units_to_date": round(units_before + units, 2),
+    }
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def _csv_row(statement: dict) -> list:
+    return [statement["meter_number"], statement["period"], statement["opening_balance"],
+            statement["payments"]["count"], statement["payments"]["amount"],
+            statement["tokens"]["count"], statement["tokens"]["amount"], statement["tokens"]["units"],
+            statement["closing_balance"], statement["units_to_date"]]
+
+
+# ============================================
+# Shards and files
+# ============================================
+
+def shard_path(out_dir: str, index: int, fmt: str) -> str:
+    return os.path.join(out_dir, f"shard-{index:05d}.{fmt}")
+
+
+def plan_shards(db: Session, shard_size: int) -> List[dict]:
+    """Half-open meter-number bounds; the first and last shards are open-ended"""
+    firsts = [first for first, _ in meter_ranges(db, shard_size)]
+    if not firsts:
+        return []
+    bounds = [None] + firsts[1:] + [None]
+    return [{"index": i, "lower": bounds[i], "upper": bounds[i + 1]} for i in range(len(firsts))]
+
+
+def write_shard(db: Session, shard: dict, period: str, out_dir: str, fmt: str) -> dict:
+    """Write one shard's statements (temp file, then rename); returns its totals"""
+    path = shard_path(out_dir, shard["index"], fmt)
+    tmp_path = path + ".tmp"
+    totals = {"index": shard["index"], "meters": 0, "payments": 0, "tokens": 0}
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(CSV_COLUMNS)
+        for statement in build_statements(db, shard["lower"], shard["upper"], period):
+            if writer:
+                writer.writerow(_csv_row(statement))
+            else:
+                f.write(json.dumps(statement, separators=(",", ":")) + "\n")
+            totals["meters"] += 1
+            totals["payments"] += statement["payments"]["count"]
+            totals["tokens"] += statement["tokens"]["count"]
+    db.rollback()
+    os.replace(tmp_path, path)
+    return totals
+
+
+def _write_shard_in_worker(args) -> dict:
+    database_url, shard, period, out_dir, fmt = args
+    engine = create_db_engine(database_url)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        return write_shard(db, shard, period, out_dir, fmt)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def generate_statements(db: Session, period: str, out_dir: str, fmt: str = "jsonl", shard_size: int = 5000,
+                        workers: int = 1, force: bool = False, database_url: Optional[str] = None) -> Iterator[dict]:
+    """
+    Write statements for `period` under out_dir/period/, yielding each finished
+    shard's totals. Shards whose file already exists are skipped (resume) unless
+    force=True, which also re-plans the shards.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {FORMATS}")
+    month_bounds(period)
+    out_dir = os.path.join(out_dir, period)
+    os.makedirs(out_dir, exist_ok=True)
+
+    plan_path = os.path.join(out_dir, PLAN_FILE)
+    if os.path.exists(plan_path) and not force:
+        with open(plan_path, encoding="utf-8") as f:
+            shards = json.load(f)["shards"]
+        logger.info(f"Resuming {period}: {len(shards)} shard(s) planned")
+    else:
+        shards = plan_shards(db, shard_size)
+        db.rollback()
+        with open(plan_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"period": period, "shard_size": shard_size, "shards": shards}, f)
+        os.replace(plan_path + ".tmp", plan_path)
+
+    pending = [s for s in shards if force or not os.path.exists(shard_path(out_dir, s["index"], fmt))]
+    logger.info(f"📄 Statements {period}: {len(pending)}/{len(shards)} shard(s) to write with {workers} worker(s)")
+
+    if workers <= 1:
+        for shard in pending:
+            yield write_shard(db, shard, period, out_dir, fmt)
+        return
+
+    url = database_url or str(db.get_bind().url.render_as_string(hide_password=False))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_write_shard_in_worker, (url, s, period, out_dir, fmt)) for s in pending]
+        for future in as_completed(futures):
+            yield future.result()
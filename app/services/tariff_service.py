@@ -0,0 +1,382 @@
+# app/services/tariff_service.py
+"""
+Block water tariffs: versioned definitions compiled into lookup tables.
+
+A tariff charges `rate` per unit inside each band, plus an optional fixed
+charge per vend, with VAT on top of both. Compiling a version precomputes the
+band bounds (units) and the cumulative cost at each bound, so pricing is one
+bisect in either direction:
+
+    cost(u)  = cum_cost[i] + (u - bounds[i]) * rates[i]   (i: band holding u)
+    units(c) = bounds[i] + (c - cum_cost[i]) / rates[i]   (i: band holding c)
+
+With blocks_reset="month" the bands apply to the meter's month-to-date units
+(UTC months), so a vend is priced from where the month's earlier purchases left
+off. Otherwise every vend starts from the first band.
+
+The running position of a meter in cost space is simply the running sum of its
+net spend, so re-rating a whole period is a per-(meter, month) cumulative sum and
+one searchsorted per tariff version (rerate_tokens, needs NumPy).
+"""
+import bisect
+import json
+import threading
+from datetime import datetime
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import String, select, func, type_coerce
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.vending import VenderToken
+from app.utils.logger import get_logger
+
+logger = get_logger("TariffService")
+
+# Used when TARIFF_FILE is not set: the original flat 10 KES per unit
+DEFAULT_TARIFFS = [{
+    "version": "flat-10",
+    "effective_from": None,
+    "blocks_reset": "vend",
+    "fixed_charge": 0.0,
+    "vat_rate": 0.0,
+    "bands": [{"up_to": None, "rate": 10.0}],
+}]
+
+UNITS_DECIMALS = 2
+
+
+def _parse_time(value) -> datetime:
+    if value is None:
+        return datetime.min
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def month_start(when: datetime) -> datetime:
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+class CompiledTariff:
+    """One tariff version as cumulative-threshold tables"""
+
+    def __init__(self, definition: dict):
+        self.version = str(definition["version"])
+        self.effective_from = _parse_time(definition.get("effective_from"))
+        self.blocks_reset = definition.get("blocks_reset", "vend")
+        self.fixed_charge = float(definition.get("fixed_charge", 0.0))
+        self.vat_rate = float(definition.get("vat_rate", 0.0))
+        if self.blocks_reset not in ("vend", "month"):
+            raise ValueError(f"Tariff {self.version}: blocks_reset must be 'vend' or 'month'")
+        if self.fixed_charge < 0 or self.vat_rate < 0:
+            raise ValueError(f"Tariff {self.version}: fixed_charge and vat_rate must not be negative")
+
+        bands = definition.get("bands") or []
+        if not bands or bands[-1].get("up_to") is not None:
+            raise ValueError(f"Tariff {self.version}: the last band must be open-ended (up_to: null)")
+        bounds, rates, cum_cost = [0.0], [], [0.0]
+        for band in bands:
+            rate = float(band["rate"])
+            if rate <= 0:
+                raise ValueError(f"Tariff {self.version}: band rates must be positive")
+            rates.append(rate)
+            up_to = band.get("up_to")
+            if up_to is None:
+                break
+            if float(up_to) <= bounds[-1]:
+                raise ValueError(f"Tariff {self.version}: band limits must increase")
+            cum_cost.append(cum_cost[-1] + (float(up_to) - bounds[-1]) * rate)
+            bounds.append(float(up_to))
+        if len(rates) != len(bands):
+            raise ValueError(f"Tariff {self.version}: only the last band may be open-ended")
+
+        self.bounds = tuple(bounds)
+        self.rates = tuple(rates)
+        self.cum_cost = tuple(cum_cost)
+        self._arrays = None
+
+    @property
+    def monthly_blocks(self) -> bool:
+        """True if pricing depends on the meter's month-to-date units"""
+        return self.blocks_reset == "month" and len(self.rates) > 1
+
+    def net_amount(self, amount: float) -> float:
+        """What is left for water once VAT and the fixed charge are taken off"""
+        return max(float(amount) / (1 + self.vat_rate) - self.fixed_charge, 0.0)
+
+    def cost_of_units(self, units: float) -> float:
+        units = max(units, 0.0)
+        i = bisect.bisect_right(self.bounds, units) - 1
+        return self.cum_cost[i] + (units - self.bounds[i]) * self.rates[i]
+
+    def units_at_cost(self, cost: float) -> float:
+        cost = max(cost, 0.0)
+        i = bisect.bisect_right(self.cum_cost, cost) - 1
+        return self.bounds[i] + (cost - self.cum_cost[i]) / self.rates[i]
+
+    def units_for(self, amount: float, consumed: float = 0.0) -> float:
+        """Units bought by `amount` (VAT inclusive) after `consumed` units this month"""
+        net = self.net_amount(amount)
+        if net <= 0:
+            return 0.0
+        if not self.monthly_blocks:
+            return round(self.units_at_cost(net), UNITS_DECIMALS)
+        start = self.cost_of_units(consumed)
+        return round(self.units_at_cost(start + net) - consumed, UNITS_DECIMALS)
+
+    def price_of(self, units: float, consumed: float = 0.0) -> float:
+        """Amount (VAT inclusive) to pay for `units` after `consumed` units this month"""
+        if not self.monthly_blocks:
+            consumed = 0.0
+        water = self.cost_of_units(consumed + units) - self.cost_of_units(consumed)
+        return round((water + self.fixed_charge) * (1 + self.vat_rate), 2)
+
+    # Vectorized counterparts (NumPy arrays in and out)
+
+    def _tables(self):
+        if self._arrays is None:
+            import numpy as np
+            self._arrays = (np.asarray(self.bounds), np.asarray(self.rates), np.asarray(self.cum_cost))
+        return self._arrays
+
+    def cost_of_units_array(self, units):
+        import numpy as np
+        bounds, rates, cum_cost = self._tables()
+        units = np.maximum(units, 0.0)
+        i = np.searchsorted(bounds, units, side="right") - 1
+        return cum_cost[i] + (units - bounds[i]) * rates[i]
+
+    def units_at_cost_array(self, cost):
+        import numpy as np
+        bounds, rates, cum_cost = self._tables()
+        cost = np.maximum(cost, 0.0)
+        i = np.searchsorted(cum_cost, cost, side="right") - 1
+        return bounds[i] + (cost - cum_cost[i]) / rates[i]
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "effective_from": None if self.effective_from == datetime.min else self.effective_from.isoformat(),
+            "blocks_reset": self.blocks_reset,
+            "fixed_charge": self.fixed_charge,
+            "vat_rate": self.vat_rate,
+            "bands": [{"from": self.bounds[i], "up_to": self.bounds[i + 1] if i + 1 < len(self.bounds) else None,
+                       "rate": rate} for i, rate in enumerate(self.rates)],
+        }
+
+
+class TariffSchedule:
+    """Tariff versions ordered by effective_from; the one in force is found by bisect"""
+
+    def __init__(self, definitions: Sequence[dict]):
+        if not definitions:
+            raise ValueError("At least one tariff version is required")
+        self.tariffs = sorted((CompiledTariff(d) for d in definitions), key=lambda t: t.effective_from)
+        self.effective_from = [t.effective_from for t in self.tariffs]
+        versions = [t.version for t in self.tariffs]
+        if len(set(versions)) != len(versions):
+            raise ValueError("Tariff versions must be unique")
+
+    def for_time(self, when: datetime) -> CompiledTariff:
+        """The version in force at `when` (the earliest one for times before it)"""
+        i = bisect.bisect_right(self.effective_from, when.replace(tzinfo=None)) - 1
+        return self.tariffs[max(i, 0)]
+
+    def version_index_array(self, timestamps):
+        import numpy as np
+        starts = np.array(self.effective_from, dtype="datetime64[us]")
+        return np.maximum(np.searchsorted(starts, timestamps, side="right") - 1, 0)
+
+
+def load_tariff_schedule(path: str) -> TariffSchedule:
+    """Read {"tariffs": [...]} (see DEFAULT_TARIFFS for the shape of one version)"""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return TariffSchedule(data["tariffs"] if isinstance(data, dict) else data)
+
+
+_schedule = None
+_schedule_lock = threading.Lock()
+
+
+def get_tariff_schedule() -> TariffSchedule:
+    """The configured schedule, compiled on first use"""
+    global _schedule
+    if _schedule is None:
+        with _schedule_lock:
+            if _schedule is None:
+                _schedule = load_tariff_schedule(settings.TARIFF_FILE) if settings.TARIFF_FILE \
+                    else TariffSchedule(DEFAULT_TARIFFS)
+                logger.info(f"💧 Tariffs loaded: {', '.join(t.version for t in _schedule.tariffs)}")
+    return _schedule
+
+
+def reload_tariffs() -> TariffSchedule:
+    """Recompile from TARIFF_FILE (e.g. after a tariff change was published)"""
+    global _schedule
+    with _schedule_lock:
+        _schedule = None
+    return get_tariff_schedule()
+
+
+# ============================================
+# Pricing vends
+# ============================================
+
+def month_to_date_units(db: Session, meter_numbers: List[str], when: datetime) -> dict:
+    """Units already vended to each meter since the start of `when`'s month (one query)"""
+    rows = db.execute(
+        select(VenderToken.meter_number, func.coalesce(func.sum(VenderToken.units), 0.0))
+        .where(VenderToken.meter_number.in_(meter_numbers),
+               VenderToken.timestamp >= month_start(when),
+               VenderToken.timestamp < when)
+        .group_by(VenderToken.meter_number)
+    ).all()
+    return {meter_number: float(units) for meter_number, units in rows}
+
+
+def units_for_vend(db: Session, meter_number: str, amount: float, when: datetime) -> float:
+    """Units for one vend; reads month-to-date units only for tariffs with monthly blocks"""
+    tariff = get_tariff_schedule().for_time(when)
+    consumed = 0.0
+    if tariff.monthly_blocks:
+        consumed = month_to_date_units(db, [meter_number], when).get(meter_number, 0.0)
+    return tariff.units_for(amount, consumed)
+
+
+def units_for_vends(db: Session, vends: List[Tuple[str, float]], when: datetime) -> List[float]:
+    """Units for (meter_number, amount) pairs vended together at `when`, in order"""
+    tariff = get_tariff_schedule().for_time(when)
+    if not tariff.monthly_blocks:
+        return [tariff.units_for(amount) for _, amount in vends]
+    consumed = month_to_date_units(db, list({meter_number for meter_number, _ in vends}), when)
+    units = []
+    for meter_number, amount in vends:
+        bought = tariff.units_for(amount, consumed.get(meter_number, 0.0))
+        consumed[meter_number] = consumed.get(meter_number, 0.0) + bought
+        units.append(bought)
+    return units
+
+
+# ============================================
+# Re-rating a period (vectorized)
+# ============================================
+
+def load_tokens(db: Session, start: datetime, end: datetime, meter_number: Optional[str] = None):
+    """
+    Token columns as NumPy arrays, ordered by meter, time and id. Starts at the
+    beginning of `start`'s month so monthly blocks have their opening position.
+    """
+    import numpy as np
+
+    # Timestamps skip the per-row DateTime processor: NumPy parses SQLite's ISO
+    # text itself, and drivers that return datetimes are passed through as is
+    stmt = (select(VenderToken.id, VenderToken.meter_number, type_coerce(VenderToken.timestamp, String),
+                   VenderToken.amount, VenderToken.units)
+            .where(VenderToken.timestamp >= month_start(start), VenderToken.timestamp < end)
+            .order_by(VenderToken.meter_number, VenderToken.timestamp, VenderToken.id))
+    if meter_number:
+        stmt = stmt.where(VenderToken.meter_number == meter_number)
+    rows = db.execute(stmt).all()
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    return {
+        "id": np.asarray(columns[0], dtype=np.int64),
+        "meter_number": np.asarray(columns[1], dtype=str),
+        "timestamp": np.asarray(columns[2], dtype="datetime64[us]"),
+        "amount": np.asarray([a or 0.0 for a in columns[3]], dtype=float),
+        "units": np.asarray([u or 0.0 for u in columns[4]], dtype=float),
+    }
+
+
+def rerate(tokens: dict, schedule: TariffSchedule):
+    """
+    Re-rated units for token arrays sorted by meter and time (see load_tokens).
+    Loops over tariff versions only; every row of a version is priced at once.
+    """
+    import numpy as np
+
+    meters, timestamps, amounts = tokens["meter_number"], tokens["timestamp"], tokens["amount"]
+    n = len(amounts)
+    units = np.zeros(n)
+    if n == 0:
+        return units
+
+    months = timestamps.astype("datetime64[M]")
+    new_group = np.ones(n, dtype=bool)
+    new_group[1:] = (meters[1:] != meters[:-1]) | (months[1:] != months[:-1])
+    group = np.cumsum(new_group) - 1
+    consumed = np.zeros(group[-1] + 1)  # units per (meter, month) so far, across versions
+    version = schedule.version_index_array(timestamps)
+
+    for v, tariff in enumerate(schedule.tariffs):
+        rows = np.nonzero(version == v)[0]
+        if len(rows) == 0:
+            continue
+        net = np.maximum(amounts[rows] / (1 + tariff.vat_rate) - tariff.fixed_charge, 0.0)
+        if not tariff.monthly_blocks:
+            units[rows] = tariff.units_at_cost_array(net)
+            continue
+        # A version's rows of one (meter, month) are contiguous: the running
+        # cost position is the group's opening cost plus its spend so far
+        g = group[rows]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = g[1:] != g[:-1]
+        spent = np.cumsum(net)
+        first_index = np.maximum.accumulate(np.where(first, np.arange(len(rows)), 0))
+        before = spent - net - (spent[first_index] - net[first_index])
+        start_cost = tariff.cost_of_units_array(consumed[g]) + before
+        bought = tariff.units_at_cost_array(start_cost + net) - tariff.units_at_cost_array(start_cost)
+        units[rows] = bought
+        consumed += np.bincount(g, weights=bought, minlength=len(consumed))
+    return np.round(units, UNITS_DECIMALS)
+
+
+def rerate_tokens(db: Session, start: datetime, end: datetime, schedule: Optional[TariffSchedule] = None,
+                  meter_number: Optional[str] = None) -> dict:
+    """
+    Re-rate the tokens vended in [start, end) under `schedule` (the configured
+    one by default, or e.g. a proposed tariff to simulate a change). Returns the
+    token arrays restricted to the period, with `rerated` units alongside.
+    """
+    import numpy as np
+
+    tokens = load_tokens(db, start, end, meter_number)
+    tokens["rerated"] = rerate(tokens, schedule or get_tariff_schedule())
+    in_period = tokens["timestamp"] >= np.datetime64(start.replace(tzinfo=None), "us")
+    return {name: values[in_period] for name, values in tokens.items()}
+
+
+def rerate_by_meter(result: dict, tolerance: float = 0.01) -> Iterator[dict]:
+    """Per-meter stored vs re-rated totals for meters where they differ by more than `tolerance`"""
+    import numpy as np
+
+    meters = result["meter_number"]
+    if len(meters) == 0:
+        return
+    starts = np.nonzero(np.concatenate(([True], meters[1:] != meters[:-1])))[0]
+    stored = np.add.reduceat(result["units"], starts)
+    rerated = np.add.reduceat(result["rerated"], starts)
+    counts = np.diff(np.append(starts, len(meters)))
+    for i in np.nonzero(np.abs(rerated - stored) > tolerance)[0]:
+        yield {
+            "meter_number": str(meters[starts[i]]),
+            "tokens": int(counts[i]),
+            "stored_units": round(float(stored[i]), 2),
+            "rerated_units": round(float(rerated[i]), 2),
+            "delta_units": round(float(rerated[i] - stored[i]), 2),
+        }
+
+
+def summarize_rerate(result: dict, tolerance: float = 0.01) -> dict:
+    import numpy as np
+
+    differs = np.abs(result["rerated"] - result["units"]) > tolerance
+    return {
+        "tokens": int(len(result["id"])),
+        "meters": int(len(np.unique(result["meter_number"]))),
+        "amount": round(float(result["amount"].sum()), 2),
+        "stored_units": round(float(result["units"].sum()), 2),
+        "rerated_units": round(float(result["rerated"].sum()), 2),
+        "tokens_differing": int(differs.sum()),
+    }
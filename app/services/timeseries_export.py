@@ -0,0 +1,264 @@
+# app/services/timeseries_export.py
+"""
+Buffered export of vend and payment events as InfluxDB line protocol.
+
+Request threads only append to a bounded in-memory buffer; a background thread
+flushes batches to a pluggable sink when the batch is full or the flush
+interval elapses. When the buffer is full the overflow policy decides what
+happens: drop the new event, drop the oldest buffered event, or block briefly.
+"""
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from app.core.config import settings
+from app.utils.logger import get_logger
+
+logger = get_logger("TimeSeriesExport")
+
+
+# ============================================
+# Line protocol
+# ============================================
+
+def _escape_key(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace(",", "\\,").replace("=", "\\=").replace(" ", "\\ ")
+
+
+def _format_field(value) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def to_line_protocol(measurement: str, tags: dict, fields: dict, timestamp_ns: int) -> Optional[str]:
+    """One line of line protocol; None when every field is None (a point needs at least one field)"""
+    field_str = ",".join(f"{_escape_key(k)}={_format_field(v)}" for k, v in fields.items() if v is not None)
+    if not field_str:
+        return None
+    tag_str = "".join(
+        f",{_escape_key(k)}={_escape_key(v)}" for k, v in sorted(tags.items()) if v not in (None, "")
+    )
+    return f"{_escape_key(measurement)}{tag_str} {field_str} {timestamp_ns}"
+
+
+def _timestamp_ns(when: Optional[datetime]) -> int:
+    if when is None:
+        return time.time_ns()
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp() * 1_000_000_000)
+
+
+# ============================================
+# Sinks
+# ============================================
+
+class HttpLineProtocolSink:
+    """Writes batches to the InfluxDB v2 /api/v2/write endpoint over a keep-alive session."""
+
+    def __init__(self, url: str, token: str, org: str, bucket: str, timeout: float = 10):
+        self.write_url = f"{url.rstrip('/')}/api/v2/write"
+        self.params = {"org": org, "bucket": bucket, "precision": "ns"}
+        self.timeout = timeout
+        import requests  # only needed when exporting over HTTP
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Token {token}",
+            "Content-Type": "text/plain; charset=utf-8",
+        })
+
+    def write(self, lines: List[str]):
+        response = self.session.post(self.write_url, params=self.params,
+                                     data="\n".join(lines).encode(), timeout=self.timeout)
+        if response.status_code >= 300:
+            raise Exception(f"InfluxDB write failed ({response.status_code}): {response.text[:200]}")
+
+    def close(self):
+        self.session.close()
+
+
+class RotatingFileSink:
+    """Appends line protocol to a local file, rotating to path.1 ... path.N by size."""
+
+    def __init__(self, path: str, max_bytes: int, backup_count: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, lines: List[str]):
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def close(self):
+        self._file.close()
+
+
+def build_sink():
+    if settings.TIMESERIES_EXPORT == "http":
+        return HttpLineProtocolSink(settings.INFLUX_URL, settings.INFLUX_TOKEN,
+                                    settings.INFLUX_ORG, settings.INFLUX_BUCKET)
+    if settings.TIMESERIES_EXPORT == "file":
+        return RotatingFileSink(settings.TIMESERIES_FILE_PATH, settings.TIMESERIES_FILE_MAX_BYTES,
+                                settings.TIMESERIES_FILE_BACKUPS)
+    return None
+
+
+# ============================================
+# Exporter
+# ============================================
+
+class TimeSeriesExporter:
+    def __init__(self, sink_factory, buffer_size: int, batch_size: int,
+                 flush_interval: float, overflow_policy: str = "drop_newest"):
+        self.sink_factory = sink_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self._buffer = queue.Queue(maxsize=buffer_size)
+        self._sink = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {"enqueued": 0, "dropped": 0, "written": 0, "write_errors": 0}
+
+    def _count(self, **deltas):
+        # Request threads and the flush thread all update the counters
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink_factory is not None
+
+    def record(self, measurement: str, tags: dict, fields: dict, when: Optional[datetime] = None):
+        """Buffer one event. Never blocks longer than the `block` policy timeout."""
+        if not self.enabled:
+            return
+        self._ensure_started()
+        line = to_line_protocol(measurement, tags, fields, _timestamp_ns(when))
+        if line is None:
+            return
+        try:
+            if self.overflow_policy == "block":
+                self._buffer.put(line, timeout=0.05)
+            else:
+                self._buffer.put_nowait(line)
+            self._count(enqueued=1)
+        except queue.Full:
+            if self.overflow_policy == "drop_oldest":
+                try:
+                    self._buffer.get_nowait()
+                    self._buffer.put_nowait(line)
+                    self._count(enqueued=1)
+                except (queue.Empty, queue.Full):
+                    pass
+            self._count(dropped=1)
+
+    def record_vend(self, meter_number: str, units: float, amount: float, when: Optional[datetime] = None):
+        self.record("vend", {"meter_number": meter_number},
+                    {"units": float(units), "amount": float(amount or 0.0), "tokens": 1}, when)
+
+    def record_payment(self, meter_number: str, amount: float, trans_id: str,
+                       transaction_type: str = None, when: Optional[datetime] = None):
+        self.record("payment", {"meter_number": meter_number, "transaction_type": transaction_type},
+                    {"amount": float(amount or 0.0), "trans_id": trans_id}, when)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="timeseries-exporter", daemon=True)
+                self._thread.start()
+
+    def _drain(self, max_items: int) -> List[str]:
+        lines = []
+        while len(lines) < max_items:
+            try:
+                lines.append(self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return lines
+
+    def _write(self, lines: List[str]):
+        if not lines:
+            return
+        try:
+            if self._sink is None:
+                self._sink = self.sink_factory()
+            self._sink.write(lines)
+            self._count(written=len(lines))
+        except Exception as e:
+            # Analytics export is best effort; the batch is dropped rather than
+            # letting a dead sink grow the buffer without bound
+            self._count(write_errors=1, dropped=len(lines))
+            logger.error(f"❌ Time-series export of {len(lines)} line(s) failed: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Collect until the batch is full or the flush interval elapses
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._buffer.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+        # Final flush on shutdown
+        while True:
+            lines = self._drain(self.batch_size)
+            if not lines:
+                break
+            self._write(lines)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+
+exporter = TimeSeriesExporter(
+    sink_factory=build_sink if settings.TIMESERIES_EXPORT in ("http", "file") else None,
+    buffer_size=settings.TIMESERIES_BUFFER_SIZE,
+    batch_size=settings.TIMESERIES_BATCH_SIZE,
+    flush_interval=settings.TIMESERIES_FLUSH_INTERVAL,
+    overflow_policy=settings.TIMESERIES_OVERFLOW_POLICY,
+)
@@ -1,11 +1,26 @@
+import asyncio
 import random
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session 
 from app.models.vending import VenderToken
 
 from app.schemas.vending_schema import VendedTokenCreate
-from app.services.sms_service import SMSService
+from app.services.sms_service import SMSService, build_token_message
 from app.services.sms_services import get_sms_service
-from app.services.aggregate_service import update_on_vend
+from app.services.aggregate_service import update_on_vend, update_on_vends
+from app.services.sms_outbox_service import outbox_enabled, queue_sms, queue_sms_batch
+from app.core.config import settings
+from app.utils.metrics import stage, VENDS, SMS_SENT, SMS_FAILED
+from app.services.timeseries_export import exporter
+from app.services.tariff_service import get_tariff_schedule, units_for_vend, units_for_vends
+from app.utils.logger import get_logger
+
+logger=get_logger("VendingService")
+
+VEND_BATCH_CHUNK_SIZE=500
 
 
 
@@ -13,43 +28,136 @@ def generate_token_string()->str:
     """Simulate a token in (in the final implementation Hexing API will be added here)"""
     return ''.join([str(random.randint(0,9)) for _ in range(20)])
 
-def compute_units(amount:float)->float:
-    """Simple logic to convert amount to units"""
-    rate_per_unit=10
-    
-    return round(amount/rate_per_unit,2)
-def vend_meter(db:Session, meter_number:str, phone_number:str, amount:float):
-    """Core vending logic: generate token, comoute units, store results"""
-    units=compute_units(amount)
-    token=generate_token_string()
+def compute_units(amount:float,when:Optional[datetime]=None,consumed:float=0.0)->float:
+    """Units bought by `amount` under the tariff in force at `when` (see tariff_service)"""
+    return get_tariff_schedule().for_time(when or datetime.utcnow()).units_for(amount,consumed)
+def send_vend_sms(meter_number:str, phone_number:str, units:float, token:str):
+    """Notify the customer of a vended token"""
+    sms_service = SMSService(provider_name="mock")
+    sms_service.send_token_sms(phone_number, token, units, meter_number)
+    sms_service = get_sms_service()  # Uses mock by default
+    message = build_token_message(meter_number, units, token)
+    if sms_service.send_sms(phone_number, message):
+        SMS_SENT.inc(provider=settings.SMS_PROVIDER)
+    else:
+        SMS_FAILED.inc(provider=settings.SMS_PROVIDER)
+
+def vend_meter(db:Session, meter_number:str, phone_number:str, amount:float, commit:bool=True, notify:bool=True,
+               payment_id:Optional[int]=None):
+    """
+    Core vending logic: generate token, comoute units, store results.
+    With commit=False the token and aggregate change stay in the caller's
+    transaction and the caller must call send_vend_sms(),
+    exporter.record_vend() and VENDS.inc() once it has committed.
+    With notify=False the caller sends the SMS itself (see vend_meter_async).
+    `payment_id` links the token to the M-Pesa transaction that paid for it.
+    In outbox mode the SMS is queued in the same transaction instead of sent.
+    """
+    vended_at=datetime.utcnow()
+    with stage("token_generation"):
+        units=units_for_vend(db,meter_number,amount,vended_at)
+        token=generate_token_string()
     vended_data=VenderToken( 
                                   meter_number=meter_number,
                                   amount=amount,
                                   units=units,
                                   token=token,
-                                  phone_number=phone_number)
+                                  phone_number=phone_number,
+                                  payment_id=payment_id,
+                                  timestamp=vended_at)
     #vended_token=VenderToken(**vended_data.dict())
     db.add(vended_data)
-    db.commit()
+    with stage("vend_aggregate_update"):
+        update_on_vend(db,meter_number=meter_number,
+                       units=units,
+                       amount=amount,
+                       token=token,
+                       phone_number=phone_number,
+                       token_time=vended_at,
+                       commit=False)
+    if outbox_enabled():
+        queue_sms(db, phone_number, build_token_message(meter_number, units, token))
+    if not commit:
+        with stage("token_insert"):
+            db.flush()
+        return vended_data
+    with stage("db_commit"):
+        db.commit()
+    VENDS.inc()
+    exporter.record_vend(meter_number, units, amount, vended_at)
     db.refresh(vended_data)
     # ✅ Trigger SMS
-    sms_service = SMSService(provider_name="mock")
-    sms_service.send_token_sms(phone_number, token, units, meter_number)
-    sms_service = get_sms_service()  # Uses mock by default
-    message = (
-        f"SmartWater Vending\n"
-        f"Meter: {meter_number}\n"
-        f"Units: {units}\n"
-        f"Token: {token}\n"
-        f"Thank you for using SmartWater!"
-    )
-    sms_service.send_sms(phone_number, message)
-    
-    
-    update_on_vend(db,meter_number=vended_data.meter_number,
-                   units=vended_data.units,
-                   amount=vended_data.amount,
-                   token=vended_data.token,
-                   phone_number=vended_data.phone_number,
-                   token_time=vended_data.timestamp)
-    return vended_data
\ No newline at end of file
+    if notify and not outbox_enabled():
+        with stage("sms_send"):
+            send_vend_sms(meter_number, phone_number, units, token)
+    return vended_data
+
+async def vend_meter_async(db:AsyncSession, meter_number:str, phone_number:str, amount:float):
+    """vend_meter on the async engine; the SMS is sent from a worker thread"""
+    vended=await db.run_sync(vend_meter,meter_number,phone_number,amount,notify=False)
+    if not outbox_enabled():
+        await asyncio.to_thread(send_vend_sms,meter_number,phone_number,vended.units,vended.token)
+    return vended
+
+def _vend_chunk(db:Session,items:List[dict])->List[dict]:
+    """One transaction: a multi-row token INSERT, one aggregate upsert and the SMS hand-off"""
+    now=datetime.utcnow()
+    with stage("token_generation"):
+        units=units_for_vends(db,[(item["meter_number"],item["amount"]) for item in items],now)
+        rows=[dict(meter_number=item["meter_number"],
+                   phone_number=item["phone_number"],
+                   amount=item["amount"],
+                   units=item_units,
+                   token=generate_token_string(),
+                   timestamp=now)
+              for item,item_units in zip(items,units)]
+    with stage("token_insert"):
+        ids=dict(db.execute(insert(VenderToken).values(rows).returning(VenderToken.token,VenderToken.id)).all())
+    with stage("vend_aggregate_update"):
+        update_on_vends(db,rows,commit=False)
+    messages=[{"to":r["phone_number"],"message":build_token_message(r["meter_number"],r["units"],r["token"])}
+              for r in rows]
+    if outbox_enabled():
+        queue_sms_batch(db,messages)
+    with stage("db_commit"):
+        db.commit()
+    VENDS.inc(len(rows))
+    for r in rows:
+        exporter.record_vend(r["meter_number"],r["units"],r["amount"],r["timestamp"])
+    if not outbox_enabled():
+        sms_service=get_sms_service()
+        try:
+            with stage("sms_send_bulk"):
+                ok=sms_service.send_bulk_sms(messages)
+        except Exception as e:
+            logger.error(f"❌ Bulk SMS for {len(messages)} vend(s) failed: {e}")
+            ok=False
+        (SMS_SENT if ok else SMS_FAILED).inc(len(messages),provider=settings.SMS_PROVIDER)
+    return [dict(r,id=ids.get(r["token"]),status="vended") for r in rows]
+
+def vend_batch(db:Session,items:List[dict],chunk_size:int=VEND_BATCH_CHUNK_SIZE)->List[dict]:
+    """
+    Vend many (meter_number, phone_number, amount) items.
+    Items are committed in chunks of `chunk_size`; a chunk that fails is rolled
+    back and its items reported as failed, later chunks still run.
+    Returns one result per item, in request order.
+    """
+    results=[None]*len(items)
+    valid=[]
+    for i,item in enumerate(items):
+        if not item.get("meter_number") or not item.get("amount") or item["amount"]<=0:
+            results[i]=dict(item,status="rejected",error="meter_number and a positive amount are required")
+        else:
+            valid.append((i,item))
+    for start in range(0,len(valid),chunk_size):
+        chunk=valid[start:start+chunk_size]
+        try:
+            vended=_vend_chunk(db,[item for _,item in chunk])
+        except Exception as e:
+            db.rollback()
+            logger.error(f"❌ Vend batch chunk of {len(chunk)} failed: {e}")
+            vended=[dict(item,status="failed",error=str(e)) for _,item in chunk]
+        for (i,_),result in zip(chunk,vended):
+            results[i]=result
+    return results
+
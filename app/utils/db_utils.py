@@ -0,0 +1,85 @@
+from sqlalchemy import insert, update, and_, func
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+
+def upsert(db: Session, model, conflict_columns: list, insert_values: dict, update_values: dict):
+    """
+    Insert a row or, if one already exists for `conflict_columns`, apply `update_values`.
+
+    SQLite and Postgres use a single INSERT ... ON CONFLICT DO UPDATE (this needs a
+    unique constraint on conflict_columns); other dialects fall back to UPDATE, then
+    INSERT if no row matched, retrying the UPDATE if a concurrent transaction
+    inserted the row first. `update_values` may use SQL expressions such as
+    `model.total + 1` to increment in the database.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = dialect_insert(model).values(**insert_values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[getattr(model, c) for c in conflict_columns],
+            set_=update_values,
+        )
+        db.execute(stmt)
+        return
+
+    match = and_(*(getattr(model, c) == insert_values[c] for c in conflict_columns))
+    result = db.execute(update(model).where(match).values(**update_values))
+    if result.rowcount == 0:
+        try:
+            with db.begin_nested():
+                db.execute(insert(model).values(**insert_values))
+        except IntegrityError:
+            db.execute(update(model).where(match).values(**update_values))
+
+
+def insert_if_absent(db: Session, model, conflict_columns: list, values: dict):
+    """
+    Insert a row unless one already exists for `conflict_columns`, without a
+    select-then-insert race: ON CONFLICT DO NOTHING on SQLite and Postgres, a
+    savepoint that swallows the unique violation elsewhere.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = dialect_insert(model).values(**values)
+        db.execute(stmt.on_conflict_do_nothing(index_elements=[getattr(model, c) for c in conflict_columns]))
+        return
+
+    try:
+        with db.begin_nested():
+            db.execute(insert(model).values(**values))
+    except IntegrityError:
+        pass
+
+
+def upsert_increment(db: Session, model, conflict_columns: list, rows: list, increment_columns: list,
+                     replace_columns: list = ()):
+    """
+    Insert several rows in one statement; rows that already exist for
+    `conflict_columns` get `increment_columns` added to their current values
+    (NULL counts as 0) and `replace_columns` overwritten with the new values.
+
+    Rows are written in `conflict_columns` order, so two concurrent batches
+    touching the same keys lock them in the same order and cannot deadlock.
+    """
+    rows = sorted(rows, key=lambda row: tuple(row[c] for c in conflict_columns))
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = dialect_insert(model).values(rows)
+        set_ = {c: func.coalesce(getattr(model, c), 0) + getattr(stmt.excluded, c) for c in increment_columns}
+        set_.update({c: getattr(stmt.excluded, c) for c in replace_columns})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[getattr(model, c) for c in conflict_columns],
+            set_=set_,
+        )
+        db.execute(stmt)
+        return
+
+    for row in rows:
+        update_values = {c: func.coalesce(getattr(model, c), 0) + row[c] for c in increment_columns}
+        update_values.update({c: row[c] for c in replace_columns})
+        upsert(db, model, conflict_columns, row, update_values)
@@ -1,13 +1,129 @@
+import atexit
+import json
 import logging
+import queue
+import random
+import re
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.core.config import settings
+
+# Kenyan mobile numbers (2547XXXXXXXX / 2541XXXXXXXX / 07XXXXXXXX) and 20-digit tokens
+_MSISDN_RE = re.compile(r"(?<!\d)(?:254|0)([17]\d{5})(\d{3})(?!\d)")
+_TOKEN_RE = re.compile(r"(?<!\d)\d{16}(\d{4})(?!\d)")
+
+
+def redact(text: str) -> str:
+    text = _TOKEN_RE.sub(r"****************\1", text)
+    return _MSISDN_RE.sub(lambda m: "254" + "*" * len(m.group(1)) + m.group(2), text)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s")
+
+    def format(self, record):
+        text = super().format(record)
+        return redact(text) if settings.LOG_REDACT else text
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        text = json.dumps(entry, ensure_ascii=False, default=str)
+        return redact(text) if settings.LOG_REDACT else text
+
+
+def _build_formatter() -> logging.Formatter:
+    return JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter()
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """
+    Enqueue the record as-is: message interpolation, JSON encoding and
+    redaction all happen on the listener thread, not the request path.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+_queue_handler = None
+_listener = None
+
+
+def _get_queue_handler() -> QueueHandler:
+    global _queue_handler, _listener
+    if _queue_handler is None:
+        log_queue = queue.SimpleQueue()
+        stream = logging.StreamHandler()
+        stream.setFormatter(_build_formatter())
+        _listener = QueueListener(log_queue, stream, respect_handler_level=False)
+        _listener.start()
+        atexit.register(stop_logging)
+        _queue_handler = _DeferredQueueHandler(log_queue)
+    return _queue_handler
+
+
+def stop_logging():
+    """
+    Flush and stop the queue listener (no-op in sync mode). Loggers that used
+    the queue are switched to a direct stream handler first, so nothing logged
+    after shutdown is left in a queue nobody drains.
+    """
+    global _queue_handler, _listener
+    if _listener is None:
+        return
+    stream = logging.StreamHandler()
+    stream.setFormatter(_build_formatter())
+    for logger in list(logging.Logger.manager.loggerDict.values()):
+        if isinstance(logger, logging.Logger) and _queue_handler in logger.handlers:
+            logger.addHandler(stream)
+            logger.removeHandler(_queue_handler)
+    _listener.stop()
+    _listener, _queue_handler = None, None
+
 
 def get_logger(name: str):
     logger = logging.getLogger(name)
     if not logger.handlers:
-        handler = logging.StreamHandler()
-        formatter = logging.Formatter(
-            "%(asctime)s - %(levelname)s - %(message)s"
-        )
-        handler.setFormatter(formatter)
+        if settings.LOG_MODE == "queue":
+            handler = _get_queue_handler()
+        else:
+            handler = logging.StreamHandler()
+            handler.setFormatter(_build_formatter())
         logger.addHandler(handler)
-        logger.setLevel(logging.INFO)
+        logger.setLevel(getattr(logging, settings.LOG_LEVEL, logging.INFO))
     return logger
+
+
+class LazyJson:
+    """Serialised only if and when the record is actually formatted"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, separators=(",", ":"), default=str)
+
+
+def log_payload(logger: logging.Logger, label: str, data):
+    """Dump a callback payload for LOG_PAYLOAD_SAMPLE_RATE of the calls (at INFO)"""
+    rate = settings.LOG_PAYLOAD_SAMPLE_RATE
+    if rate <= 0 or not logger.isEnabledFor(logging.INFO):
+        return
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.info("%s: %s", label, LazyJson(data))
@@ -0,0 +1,361 @@
+"""
+Lightweight Prometheus-style metrics (counters and histograms) rendered in
+the Prometheus text exposition format.
+
+Each uvicorn worker keeps its own in-memory values. When METRICS_MULTIPROC_DIR
+is set, every worker periodically writes a snapshot to that directory and
+/metrics sums the snapshots of all workers, so any worker can answer a scrape.
+Values of workers that have exited are merged into an archive file (as in
+prometheus_client's multiprocess mode), so summed counters never go down.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, archive updates are best effort
+    fcntl = None
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ARCHIVE_FILE = "metrics_archive.json"
+ARCHIVE_LOCK_FILE = "metrics_archive.lock"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(into: dict, other: dict):
+        for key, value in other.items():
+            into[key] = into.get(key, 0) + value
+
+    def render(self, values: dict) -> Iterable[str]:
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, json.loads(key))} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {json.dumps(key): list(state) for key, state in self._values.items()}
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def merge(into: dict, other: dict):
+        for key, state in other.items():
+            if key in into:
+                into[key] = [a + b for a, b in zip(into[key], state)]
+            else:
+                into[key] = list(state)
+
+    def render(self, values: dict) -> Iterable[str]:
+        for key, state in sorted(values.items()):
+            label_values = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames + ("le",), label_values + [le])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, label_values)
+            yield f"{self.name}_sum{labels} {state[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def _format_labels(names: Tuple[str, ...], values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append(f'{name}="{escaped}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class MetricsRegistry:
+    def __init__(self, multiproc_dir: Optional[str] = None):
+        self._metrics: Dict[str, object] = {}
+        self.multiproc_dir = multiproc_dir
+        self._lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    # ---- multi-worker aggregation ----
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.multiproc_dir, f"metrics_{os.getpid()}.json")
+
+    def write_snapshot(self):
+        if not self.multiproc_dir:
+            return
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        path = self._snapshot_path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"started": _process_start(os.getpid()), "metrics": self.snapshot()}, f)
+        os.replace(tmp, path)
+
+    def start_flusher(self, interval: float):
+        """Periodically publish this worker's snapshot for other workers' scrapes."""
+        if not self.multiproc_dir or self._flusher:
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.write_snapshot()
+                except OSError:
+                    pass
+
+        self._flusher = threading.Thread(target=run, name="metrics-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop_flusher(self):
+        """Stop publishing and fold this worker's values into the archive, so totals never go down."""
+        self._stop.set()
+        if self._flusher:
+            self._flusher.join(timeout=2)
+            self._flusher = None
+        if not self.multiproc_dir:
+            return
+        try:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            with self._archive_lock():
+                self._merge_into_archive(self.snapshot())
+                # Reset so a flusher restarted in this process does not count them twice
+                for metric in self._metrics.values():
+                    metric.reset()
+                _remove(self._snapshot_path())
+        except OSError:
+            pass
+
+    @contextmanager
+    def _archive_lock(self):
+        with open(os.path.join(self.multiproc_dir, ARCHIVE_LOCK_FILE), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_archive(self) -> dict:
+        try:
+            with open(os.path.join(self.multiproc_dir, ARCHIVE_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_into_archive(self, values: dict):
+        """Add one worker's final values to the archive (caller holds the archive lock)"""
+        archive = self._read_archive()
+        for name, metric_values in values.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(archive.setdefault(name, {}), metric_values)
+        path = os.path.join(self.multiproc_dir, ARCHIVE_FILE)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(archive, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _archive_dead(self, path: str):
+        """Move a dead worker's snapshot into the archive; only one worker gets to do it"""
+        with self._archive_lock():
+            try:
+                with open(path) as f:
+                    snap = json.load(f)
+            except FileNotFoundError:
+                return  # already archived by another worker
+            except ValueError:
+                snap = {}
+            self._merge_into_archive(snap.get("metrics", {}))
+            _remove(path)
+
+    def _collect(self) -> dict:
+        merged = {name: {} for name in self._metrics}
+        if not self.multiproc_dir:
+            return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+        own = self._snapshot_path()
+        snapshots = [self.snapshot()]
+        for path in glob.glob(os.path.join(self.multiproc_dir, "metrics_*.json")):
+            pid = _snapshot_pid(path)
+            if path == own or pid is None:
+                continue
+            try:
+                with open(path) as f:
+                    snap = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _worker_alive(pid, snap.get("started")):
+                snapshots.append(snap.get("metrics", {}))
+                continue
+            # Left behind by a worker that died without stop_flusher()
+            try:
+                self._archive_dead(path)
+            except OSError:
+                pass
+        # Read last, after any dead worker above was folded in
+        snapshots.append(self._read_archive())
+        for snap in snapshots:
+            for name, values in snap.items():
+                metric = self._metrics.get(name)
+                if metric is not None:
+                    metric.merge(merged[name], values)
+        return merged
+
+    def render(self) -> str:
+        collected = self._collect()
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(collected.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+
+def _snapshot_pid(path: str) -> Optional[int]:
+    """The pid in metrics_<pid>.json; None for other files (e.g. the archive)"""
+    try:
+        return int(os.path.basename(path)[len("metrics_"):-len(".json")])
+    except ValueError:
+        return None
+
+
+def _process_start(pid: int) -> Optional[str]:
+    """Start time of `pid` from /proc (Linux), to tell a reused pid from the original worker"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _worker_alive(pid: int, started: Optional[str]) -> bool:
+    """Whether the worker that wrote a snapshot is still running (and is not a reused pid)"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return started is None or _process_start(pid) in (None, started)
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+metrics = MetricsRegistry(multiproc_dir=settings.METRICS_MULTIPROC_DIR)
+
+# ============================================
+# Application metrics
+# ============================================
+
+HTTP_REQUESTS = metrics.counter(
+    "http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+STAGE_SECONDS = metrics.histogram(
+    "vending_stage_duration_seconds",
+    "Time spent in each stage of payment processing and vending", ("stage",))
+CALLBACKS = metrics.counter(
+    "mpesa_callbacks_total", "M-Pesa callbacks received", ("kind", "outcome"))
+VENDS = metrics.counter("vends_total", "Tokens vended")
+SMS_SENT = metrics.counter("sms_sent_total", "SMS messages accepted by the provider", ("provider",))
+SMS_FAILED = metrics.counter("sms_failed_total", "SMS messages the provider failed to send", ("provider",))
+
+
+def stage(name: str):
+    """Time one processing stage: `with stage("db_commit"): db.commit()`"""
+    return STAGE_SECONDS.time(stage=name)
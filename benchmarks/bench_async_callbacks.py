@@ -0,0 +1,125 @@
+"""
+Concurrent confirmation throughput of one worker: blocking Session vs DB_ASYNC.
+
+Each mode runs in its own process (settings are read at import) against a fresh
+SQLite file. N concurrent clients POST confirmations to the app in-process
+through httpx's ASGI transport, so every request shares one event loop, as in a
+single uvicorn worker. --sms-latency adds a sleep to the mock SMS provider to
+stand in for a real provider round trip.
+
+Run from the repo root:
+    python -m benchmarks.bench_async_callbacks --clients 32 --payments 1000 --sms-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _payload(i: int, meters: int) -> dict:
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": f"ASYNC{i:08d}",
+        "TransTime": "20251016120000",
+        "TransAmount": "100",
+        "BusinessShortCode": "600984",
+        "BillRefNumber": f"MTR{i % meters:05d}",
+        "MSISDN": "254708374149",
+    }
+
+
+async def _drive(app, clients: int, payments: int, meters: int) -> dict:
+    import httpx
+
+    queue = asyncio.Queue()
+    for i in range(payments):
+        queue.put_nowait(i)
+    latencies = []
+
+    async def client(http):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            t0 = time.perf_counter()
+            response = await http.post("/api/daraja/confirmation", json=_payload(i, meters))
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "callbacks_per_sec": round(payments / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+    }
+
+
+def child(args):
+    """Runs inside the per-mode process: environment is already set up"""
+    logging.disable(logging.CRITICAL)
+    from app.main import app
+    from app.core.database import Base, engine
+    from app.core.schema import prepare_schema
+    from app.services.sms_services.mock_sms import MockSMSProvider
+
+    # The ASGI transport does not run the startup hooks
+    prepare_schema(engine, Base.metadata)
+
+    if args.sms_latency:
+        send_sms = MockSMSProvider.send_sms
+
+        def slow_send_sms(self, to, message):
+            time.sleep(args.sms_latency)
+            return send_sms(self, to, message)
+
+        MockSMSProvider.send_sms = slow_send_sms
+
+    result = asyncio.run(_drive(app, args.clients, args.payments, args.meters))
+    print(json.dumps(result))
+
+
+def run_mode(name: str, db_async: bool, args) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_async_"), "bench.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{path}", DB_ASYNC="true" if db_async else "false")
+    cmd = [sys.executable, "-m", "benchmarks.bench_async_callbacks", "--child",
+           "--clients", str(args.clients), "--payments", str(args.payments),
+           "--meters", str(args.meters), "--sms-latency", str(args.sms_latency)]
+    out = subprocess.run(cmd, env=env, check=True, capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    print(f"{name:<22} {result['callbacks_per_sec']:>10,.1f}/s   p50 {result['p50_ms']:>8.2f} ms   p99 {result['p99_ms']:>8.2f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--payments", type=int, default=1000)
+    parser.add_argument("--meters", type=int, default=200)
+    parser.add_argument("--sms-latency", type=float, default=0.0, help="seconds added to every mock SMS send")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    print(f"{args.payments} confirmations, {args.clients} concurrent clients, sms latency {args.sms_latency}s")
+    blocking = run_mode("blocking Session", False, args)
+    non_blocking = run_mode("DB_ASYNC=true", True, args)
+    print(f"speed-up: {non_blocking['callbacks_per_sec'] / blocking['callbacks_per_sec']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
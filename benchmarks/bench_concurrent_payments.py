@@ -0,0 +1,175 @@
+"""
+Multi-process stress test: concurrent payments on the same meters, exact totals.
+
+W worker processes (each with its own engine, like uvicorn workers) push
+P payments for each of M meters through process_mpesa_transaction_once, with
+payments for every meter interleaved across workers. A share of the TransIDs
+is delivered twice from different workers. Afterwards the meter aggregates,
+rollups, tokens and transactions are checked against the expected totals.
+
+Defaults to a fresh SQLite file; pass --database-url to run against Postgres
+(an empty database: the schema is created and existing rows are refused).
+
+Run from the repo root:
+    python -m benchmarks.bench_concurrent_payments --workers 4 --meters 20 --payments 50
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+_engine = None
+_Session = None
+
+
+def _amount(meter: int, i: int) -> float:
+    return float(50 + (meter * 31 + i) % 7 * 10)
+
+
+def _payload(meter: int, i: int) -> dict:
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": f"S{meter:05d}P{i:06d}",
+        "TransTime": "20251016120000",
+        "TransAmount": str(_amount(meter, i)),
+        "BusinessShortCode": "600984",
+        "BillRefNumber": f"MTR{meter:05d}",
+        "MSISDN": "254708374149",
+    }
+
+
+def _init_worker(database_url: str):
+    global _engine, _Session
+    logging.disable(logging.CRITICAL)
+    from sqlalchemy.orm import sessionmaker
+    from app.core.database import create_db_engine
+
+    _engine = create_db_engine(database_url)
+    _Session = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+
+
+def _run_worker(worker: int, workers: int, meters: int, payments: int, duplicate_every: int) -> dict:
+    from app.services.idempotency_service import process_mpesa_transaction_once
+
+    # Round-robin over meters so every worker hits every meter at the same time
+    plan = [(m, i) for i in range(payments) for m in range(meters) if (m + i) % workers == worker]
+    if duplicate_every:
+        plan += [(m, i) for i in range(payments) for m in range(meters)
+                 if (m + i) % workers == (worker + 1) % workers and i % duplicate_every == 0]
+    errors = []
+    for meter, i in plan:
+        db = _Session()
+        try:
+            process_mpesa_transaction_once(db, _payload(meter, i))
+        except Exception as e:
+            db.rollback()
+            errors.append(f"{type(e).__name__}: {str(e)[:200]}")
+        finally:
+            db.close()
+    return {"calls": len(plan), "errors": errors}
+
+
+def _check(database_url: str, meters: int, payments: int) -> list:
+    from sqlalchemy import func, select
+    from app.core.database import create_db_engine
+    from app.models.meter import MeterAggregare
+    from app.models.payment import MpesaTransaction
+    from app.models.rollup import MeterUsageRollup
+    from app.models.vending import VenderToken
+
+    expected = {f"MTR{m:05d}": (payments, sum(_amount(m, i) for i in range(payments))) for m in range(meters)}
+    engine = create_db_engine(database_url)
+    problems = []
+    with engine.connect() as conn:
+        aggregates = {r.meter_number: r for r in conn.execute(select(
+            MeterAggregare.meter_number, MeterAggregare.total_payment_count, MeterAggregare.total_amount_paid,
+            MeterAggregare.total_token_count))}
+        transactions = dict(conn.execute(select(MpesaTransaction.bill_ref_number, func.count())
+                                         .group_by(MpesaTransaction.bill_ref_number)).all())
+        tokens = dict(conn.execute(select(VenderToken.meter_number, func.count())
+                                   .group_by(VenderToken.meter_number)).all())
+        rollups = {r.meter_number: r for r in conn.execute(
+            select(MeterUsageRollup.meter_number, func.sum(MeterUsageRollup.payment_count).label("payment_count"),
+                   func.sum(MeterUsageRollup.amount_paid).label("amount_paid"),
+                   func.sum(MeterUsageRollup.token_count).label("token_count"))
+            .where(MeterUsageRollup.granularity == "day").group_by(MeterUsageRollup.meter_number))}
+    engine.dispose()
+
+    for meter_number, (count, amount) in expected.items():
+        agg = aggregates.get(meter_number)
+        if agg is None:
+            problems.append(f"{meter_number}: no aggregate row")
+            continue
+        if agg.total_payment_count != count or abs(agg.total_amount_paid - amount) > 0.005:
+            problems.append(f"{meter_number}: aggregate payments {agg.total_payment_count}/{agg.total_amount_paid}"
+                            f" != {count}/{amount}")
+        if agg.total_token_count != count:
+            problems.append(f"{meter_number}: aggregate tokens {agg.total_token_count} != {count}")
+        if transactions.get(meter_number) != count:
+            problems.append(f"{meter_number}: {transactions.get(meter_number)} transactions != {count}")
+        if tokens.get(meter_number) != count:
+            problems.append(f"{meter_number}: {tokens.get(meter_number)} tokens != {count}")
+        rollup = rollups.get(meter_number)
+        if rollup is not None and (rollup.payment_count != count or rollup.token_count != count
+                                   or abs(rollup.amount_paid - amount) > 0.005):
+            problems.append(f"{meter_number}: day rollup {rollup.payment_count}/{rollup.amount_paid}/"
+                            f"{rollup.token_count} != {count}/{amount}/{count}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--meters", type=int, default=20)
+    parser.add_argument("--payments", type=int, default=50, help="payments per meter")
+    parser.add_argument("--duplicate-every", type=int, default=10,
+                        help="redeliver every Nth payment from another worker (0 = never)")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    database_url = args.database_url or \
+        f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_concurrent_'), 'bench.db')}"
+    os.environ["DATABASE_URL"] = database_url
+
+    from sqlalchemy import func, select
+    import app.main  # noqa: F401  registers every model on Base.metadata
+    from app.core.database import Base, create_db_engine
+    from app.models.payment import MpesaTransaction
+
+    engine = create_db_engine(database_url)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(MpesaTransaction)).scalar():
+            sys.exit("refusing to run against a database that already has transactions")
+    engine.dispose()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker, initargs=(database_url,)) as pool:
+        futures = [pool.submit(_run_worker, w, args.workers, args.meters, args.payments, args.duplicate_every)
+                   for w in range(args.workers)]
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    calls = sum(r["calls"] for r in results)
+    errors = [e for r in results for e in r["errors"]]
+    unique = args.meters * args.payments
+    print(f"{args.workers} workers, {args.meters} meters x {args.payments} payments "
+          f"({calls - unique} redeliveries) on {database_url.split(':')[0]}")
+    print(f"{calls / elapsed:,.1f} callbacks/s   {unique / elapsed:,.1f} payments/s   "
+          f"{elapsed:.2f} s   errors={len(errors)}")
+    for error in sorted(set(errors))[:10]:
+        print(f"  error: {error}")
+
+    problems = _check(database_url, args.meters, args.payments)
+    for problem in problems[:20]:
+        print(f"  mismatch: {problem}")
+    print("totals exact" if not problems else f"{len(problems)} mismatch(es)")
+    sys.exit(1 if problems or errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Write throughput of concurrent confirmations: SQLite defaults vs tuned PRAGMAs.
+
+Each configuration gets a fresh database file and N threads that each run
+process_mpesa_transaction in their own session, as concurrent callbacks do.
+
+Run from the repo root:
+    python -m benchmarks.bench_db_write_throughput --threads 8 --payments 100
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base, create_db_engine, default_sqlite_pragmas
+from app.services.mpesa_transaction_service import process_mpesa_transaction
+
+
+def _payload(worker: int, i: int, meters: int) -> dict:
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": f"W{worker:02d}P{i:07d}",
+        "TransTime": "20251016120000",
+        "TransAmount": "100",
+        "BusinessShortCode": "600984",
+        "BillRefNumber": f"MTR{(worker * 7 + i) % meters:05d}",
+        "MSISDN": "254708374149",
+    }
+
+
+def run(name: str, pragmas: dict, threads: int, payments: int, meters: int):
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_write_"), "bench.db")
+    engine = create_db_engine(f"sqlite:///{path}", sqlite_pragmas=pragmas)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    errors = []
+
+    def worker(worker_id: int):
+        for i in range(payments):
+            db = Session()
+            try:
+                process_mpesa_transaction(db, _payload(worker_id, i, meters))
+            except Exception as e:
+                errors.append(str(e))
+            finally:
+                db.close()
+
+    pool = [threading.Thread(target=worker, args=(w,)) for w in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    done = threads * payments - len(errors)
+    print(
+        f"{name:<10} threads={threads:<3} ok={done:<6} errors={len(errors):<4} "
+        f"payments/sec={done / elapsed:,.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--payments", type=int, default=100, help="payments per thread")
+    parser.add_argument("--meters", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    run("defaults", {}, args.threads, args.payments, args.meters)
+    run("tuned", default_sqlite_pragmas(), args.threads, args.payments, args.meters)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Confirmation callback latency with logging off, synchronous and queued.
+
+Each mode runs in its own process (logging settings are read at import) with
+a fresh SQLite file and stderr written to a real file, so the synchronous mode
+pays for its writes on the request path. Callbacks are sent one at a time
+through httpx's ASGI transport.
+
+Run from the repo root:
+    python -m benchmarks.bench_logging --payments 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    "off (WARNING)": {"LOG_LEVEL": "WARNING"},
+    "sync text": {"LOG_MODE": "sync", "LOG_FORMAT": "text"},
+    "sync json": {"LOG_MODE": "sync", "LOG_FORMAT": "json"},
+    "queue json": {"LOG_MODE": "queue", "LOG_FORMAT": "json"},
+    "queue json, 1% dumps": {"LOG_MODE": "queue", "LOG_FORMAT": "json", "LOG_PAYLOAD_SAMPLE_RATE": "0.01"},
+}
+
+
+def _payload(i: int, meters: int) -> dict:
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": f"LOG{i:08d}",
+        "TransTime": "20251016120000",
+        "TransAmount": "100",
+        "BusinessShortCode": "600984",
+        "BillRefNumber": f"MTR{i % meters:05d}",
+        "MSISDN": "254708374149",
+        "FirstName": "Bench",
+    }
+
+
+async def _drive(app, payments: int, meters: int) -> dict:
+    import httpx
+
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for i in range(payments):
+            t0 = time.perf_counter()
+            response = await http.post("/api/daraja/confirmation", json=_payload(i, meters))
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - t0)
+
+    latencies.sort()
+    return {
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def child(args):
+    from app.main import app
+    from app.core.database import Base, engine
+    from app.core.schema import prepare_schema
+    from app.utils.logger import stop_logging
+
+    # The ASGI transport does not run the startup hooks
+    prepare_schema(engine, Base.metadata)
+
+    result = asyncio.run(_drive(app, args.payments, args.meters))
+    stop_logging()
+    print(json.dumps(result))
+
+
+def run_mode(name: str, overrides: dict, args) -> dict:
+    tmpdir = tempfile.mkdtemp(prefix="bench_logging_")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'bench.db')}", **overrides)
+    cmd = [sys.executable, "-m", "benchmarks.bench_logging", "--child",
+           "--payments", str(args.payments), "--meters", str(args.meters)]
+    log_path = os.path.join(tmpdir, "app.log")
+    with open(log_path, "w") as log_file:
+        out = subprocess.run(cmd, env=env, check=True, stdout=subprocess.PIPE, stderr=log_file, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["log_bytes"] = os.path.getsize(log_path)
+    print(f"{name:<24} p50 {result['p50_ms']:>7.3f} ms   p99 {result['p99_ms']:>7.3f} ms   "
+          f"mean {result['mean_ms']:>7.3f} ms   log {result['log_bytes'] / 1024:>8.1f} KiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--meters", type=int, default=200)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    print(f"{args.payments} sequential confirmations")
+    for name, overrides in MODES.items():
+        run_mode(name, overrides, args)
+
+
+if __name__ == "__main__":
+    main()
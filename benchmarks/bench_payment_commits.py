@@ -0,0 +1,95 @@
+"""
+Commits per payment and payments per second for the confirmation flow.
+
+Compares the per-step flow (every service function commits on its own)
+with the single-transaction flow used by process_mpesa_transaction.
+
+Run from the repo root:
+    python -m benchmarks.bench_payment_commits --payments 500
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+_tmpdir = tempfile.mkdtemp(prefix="bench_commits_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmpdir, 'bench.db')}"
+
+from sqlalchemy import event
+
+from app.core.database import Base, SessionLocal, engine
+from app.models.payment import MpesaTransaction
+from app.services.aggregate_service import update_on_payment
+from app.services.mpesa_transaction_service import process_mpesa_transaction
+from app.services.vending_services import vend_meter
+
+commit_count = 0
+
+
+@event.listens_for(engine, "commit")
+def _count_commit(conn):
+    global commit_count
+    commit_count += 1
+
+
+def _payload(i: int, meters: int) -> dict:
+    return {
+        "TransactionType": "Pay Bill",
+        "TransID": f"BENCH{i:08d}",
+        "TransTime": "20251016120000",
+        "TransAmount": "100",
+        "BusinessShortCode": "600984",
+        "BillRefNumber": f"MTR{i % meters:05d}",
+        "MSISDN": "254708374149",
+        "FirstName": "Bench",
+    }
+
+
+def per_step_flow(db, data: dict):
+    """The pre-unit-of-work flow: every step commits and refreshes on its own."""
+    transaction = MpesaTransaction(
+        trans_id=data["TransID"],
+        trans_amount=float(data["TransAmount"]),
+        bill_ref_number=data["BillRefNumber"],
+        msisdn=data["MSISDN"],
+    )
+    db.add(transaction)
+    db.commit()
+    db.refresh(transaction)
+    update_on_payment(db, transaction.bill_ref_number, transaction.trans_amount, transaction.msisdn)
+    vend_meter(db, transaction.bill_ref_number, transaction.msisdn, transaction.trans_amount)
+
+
+def run(name: str, flow, payments: int, meters: int, offset: int):
+    global commit_count
+    db = SessionLocal()
+    commit_count = 0
+    start = time.perf_counter()
+    try:
+        for i in range(offset, offset + payments):
+            flow(db, _payload(i, meters))
+    finally:
+        db.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:<20} payments={payments:<6} commits/payment={commit_count / payments:.2f} "
+        f"payments/sec={payments / elapsed:,.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--payments", type=int, default=300)
+    parser.add_argument("--meters", type=int, default=50)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    Base.metadata.create_all(bind=engine)
+
+    run("per-step commits", per_step_flow, args.payments, args.meters, offset=0)
+    run("unit of work", process_mpesa_transaction, args.payments, args.meters, offset=args.payments)
+
+
+if __name__ == "__main__":
+    main()
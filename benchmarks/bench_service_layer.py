@@ -0,0 +1,162 @@
+"""
+Microbenchmarks for the service-layer hot paths on the vending path.
+
+Every case runs against a fresh temporary SQLite database (tuned PRAGMAs,
+mock SMS provider, aggregate cache disabled) seeded with a given number of
+meters and rows of payment/token history.
+
+Run from the repo root:
+    python -m benchmarks.bench_service_layer                 # print results
+    python -m benchmarks.bench_service_layer --save          # write the baseline
+    python -m benchmarks.bench_service_layer --compare       # diff against the baseline
+"""
+import argparse
+import logging
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from itertools import product
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base, create_db_engine
+from app.models.meter import MeterAggregare
+from app.models.payment import MpesaTransaction
+from app.models.vending import VenderToken
+from app.services.aggregate_cache import get_aggregate_cache
+from app.services.aggregate_service import (
+    get_all_home_aggregates,
+    get_home_aggregate,
+    update_on_payment,
+    update_on_vend,
+)
+from app.services.mpesa_transaction_service import process_mpesa_transaction
+from app.services.vending_services import vend_meter
+from benchmarks.harness import StatementCounter, load_baseline, measure, print_results, save_baseline
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "service_layer.json")
+
+
+def seed(engine, meters: int, history: int):
+    """Bulk-insert `meters` aggregates and `history` payments + tokens spread across them."""
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        conn.execute(insert(MeterAggregare), [
+            {
+                "meter_number": f"MTR{m:06d}",
+                "last_entered_units": 10.0,
+                "last_update_at": now,
+                "last_entered_amount": 100.0,
+                "last_payer": "254700000000",
+                "total_dispensed_units": 10.0,
+                "total_token_count": 1,
+                "total_amount_paid": 100.0,
+                "total_payment_count": 1,
+            }
+            for m in range(meters)
+        ])
+        if history:
+            conn.execute(insert(MpesaTransaction), [
+                {
+                    "transaction_type": "Pay Bill",
+                    "trans_id": f"HIST{h:09d}",
+                    "trans_time": "20251016120000",
+                    "trans_amount": 100.0,
+                    "bill_ref_number": f"MTR{h % meters:06d}",
+                    "msisdn": "254700000000",
+                }
+                for h in range(history)
+            ])
+            conn.execute(insert(VenderToken), [
+                {
+                    "meter_number": f"MTR{h % meters:06d}",
+                    "amount": 100.0,
+                    "units": 10.0,
+                    "token": f"{h:020d}",
+                    "phone_number": "254700000000",
+                    "timestamp": now - timedelta(minutes=h),
+                }
+                for h in range(history)
+            ])
+
+
+def run_case(meters: int, history: int, iterations: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_service_"), "bench.db")
+    engine = create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    seed(engine, meters, history)
+    counter = StatementCounter(engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    def meter(i: int) -> str:
+        return f"MTR{(i * 7919) % meters:06d}"
+
+    def payment(i: int):
+        process_mpesa_transaction(db, {
+            "TransactionType": "Pay Bill",
+            "TransID": f"BENCH{i + 1000:09d}",
+            "TransTime": "20251016120000",
+            "TransAmount": "100",
+            "BusinessShortCode": "600984",
+            "BillRefNumber": meter(i),
+            "MSISDN": "254708374149",
+        })
+
+    cases = {
+        "process_mpesa_transaction": (payment, iterations),
+        "vend_meter": (lambda i: vend_meter(db, meter(i), "254708374149", 100.0), iterations),
+        "update_on_vend": (lambda i: update_on_vend(db, meter(i), 10.0, 100.0, "T", "254708374149"), iterations),
+        "update_on_payment": (lambda i: update_on_payment(db, meter(i), 100.0, "254708374149"), iterations),
+        "get_home_aggregate": (lambda i: get_home_aggregate(db, meter(i)), iterations),
+        # One call reads every meter, so fewer iterations keep the run short
+        "get_all_home_aggregates": (lambda i: get_all_home_aggregates(db), max(5, iterations // 20)),
+    }
+
+    results = {}
+    try:
+        for name, (fn, n) in cases.items():
+            results[f"{name}[meters={meters},history={history}]"] = measure(fn, n, counter)
+    finally:
+        db.close()
+        engine.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--meters", type=int, nargs="+", default=[100, 10000])
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 50000])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="ops/sec drop that counts as a regression")
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    get_aggregate_cache().enabled = False
+
+    results = {}
+    for meters, history in product(args.meters, args.history):
+        results.update(run_case(meters, history, args.iterations))
+
+    baseline = load_baseline(args.baseline) if args.compare and os.path.exists(args.baseline) else None
+    regressions = print_results(results, baseline, args.threshold)
+
+    if args.save:
+        save_baseline(args.baseline, results, {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "iterations": args.iterations,
+        })
+        print(f"\nBaseline written to {args.baseline}")
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against baseline")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+Cold-start cost of the API: `import app.main`, the startup hooks and the first request.
+
+Every sample is a fresh interpreter. The database is prepared once per mode:
+  - create_all: DB_SCHEMA_STARTUP=create_all on an existing database
+  - auto @ head: DB_SCHEMA_STARTUP=auto on a database stamped at the Alembic head
+
+Run from the repo root:
+    python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    t2 = time.perf_counter()
+    client.get("/api/meter/MTR00001/aggregate")
+    t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1000, "startup_ms": (t2 - t1) * 1000, "first_request_ms": (t3 - t2) * 1000}))
+"""
+
+
+def _prepare(db_url: str, stamp_head: bool):
+    env = dict(os.environ, DATABASE_URL=db_url, DB_SCHEMA_STARTUP="create_all", LOG_LEVEL="WARNING")
+    script = "import app.main\nfrom app.core.database import Base, engine\nBase.metadata.create_all(bind=engine)"
+    if stamp_head:
+        script += ("\nfrom alembic import command\nfrom alembic.config import Config\n"
+                   "from app.core.schema import ALEMBIC_INI\ncommand.stamp(Config(str(ALEMBIC_INI)), 'head')")
+    subprocess.run([sys.executable, "-c", script], env=env, check=True, capture_output=True)
+
+
+def run_mode(name: str, schema_mode: str, stamp_head: bool, runs: int):
+    db_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='bench_startup_'), 'bench.db')}"
+    _prepare(db_url, stamp_head)
+    env = dict(os.environ, DATABASE_URL=db_url, DB_SCHEMA_STARTUP=schema_mode, LOG_LEVEL="WARNING")
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", CHILD], env=env, check=True,
+                             capture_output=True, text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    med = {k: statistics.median(s[k] for s in samples) for k in samples[0]}
+    print(f"{name:<14} import {med['import_ms']:>7.1f} ms   startup {med['startup_ms']:>7.1f} ms   "
+          f"first request {med['first_request_ms']:>6.1f} ms   (median of {runs})")
+    return med
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    run_mode("create_all", "create_all", False, args.runs)
+    run_mode("auto @ head", "auto", True, args.runs)
+
+
+if __name__ == "__main__":
+    main()
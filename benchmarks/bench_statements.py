@@ -0,0 +1,109 @@
+"""
+Monthly statement generation throughput (meters/sec), one process vs a pool.
+
+Seeds a fresh SQLite file with --meters meters, each with a payment and a token
+in the previous month and --per-meter payments and tokens in the statement
+month (every tenth payment left unvended, so balances carry forward). Then it
+writes the month's statements with each --workers setting, checks the totals
+against the seed, and checks that a re-run with one shard file removed
+rewrites only that shard.
+
+Run from the repo root:
+    python -m benchmarks.bench_statements --meters 100000 --workers 1 4
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+PERIOD = "2025-10"
+
+
+def _seed(engine, meters: int, per_meter: int):
+    from sqlalchemy import insert
+    from app.models.payment import EAT_OFFSET, MpesaTransaction
+    from app.models.vending import VenderToken
+
+    previous, current = datetime(2025, 9, 20), datetime(2025, 10, 1)
+    payments, tokens = [], []
+    for m in range(meters):
+        meter_number = f"MTR{m:07d}"
+        events = [(previous, 0)] + [(current + timedelta(hours=(m + i * 97) % 700), i + 1) for i in range(per_meter)]
+        for when, i in events:
+            trans_id = f"S{m:07d}{i:03d}"
+            # TransTime is EAT; created_at and token timestamps are UTC
+            payments.append(dict(trans_id=trans_id, trans_amount=100.0, bill_ref_number=meter_number,
+                                 msisdn="254708374149", trans_datetime=when, created_at=when - EAT_OFFSET))
+            if i % 10 != 9:
+                tokens.append(dict(meter_number=meter_number, amount=100.0, units=10.0, token=f"{m:010d}{i:010d}",
+                                   phone_number="254708374149", timestamp=when - EAT_OFFSET))
+    with engine.begin() as conn:
+        for i in range(0, len(payments), 5000):
+            conn.execute(insert(MpesaTransaction), payments[i:i + 5000])
+        for i in range(0, len(tokens), 5000):
+            conn.execute(insert(VenderToken), tokens[i:i + 5000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--meters", type=int, default=100000)
+    parser.add_argument("--per-meter", type=int, default=3, help="payments and tokens per meter in the month")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--shard-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    from sqlalchemy.orm import sessionmaker
+    import app.main  # noqa: F401  registers every model on Base.metadata
+    from app.core.database import Base, create_db_engine
+    from app.services.statement_service import generate_statements, shard_path
+
+    tmpdir = tempfile.mkdtemp(prefix="bench_statements_")
+    url = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    engine = create_db_engine(url)
+    Base.metadata.create_all(bind=engine)
+    t0 = time.perf_counter()
+    _seed(engine, args.meters, args.per_meter)
+    print(f"seeded {args.meters:,} meters in {time.perf_counter() - t0:.1f} s")
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    expected_payments = args.meters * args.per_meter
+    expected_tokens = sum(1 for i in range(1, args.per_meter + 1) if i % 10 != 9) * args.meters
+    for workers in args.workers:
+        out_dir = os.path.join(tmpdir, f"out-{workers}")
+        db = Session()
+        t0 = time.perf_counter()
+        shards = list(generate_statements(db, PERIOD, out_dir, shard_size=args.shard_size,
+                                          workers=workers, database_url=url))
+        elapsed = time.perf_counter() - t0
+        db.close()
+        meters = sum(s["meters"] for s in shards)
+        payments = sum(s["payments"] for s in shards)
+        tokens = sum(s["tokens"] for s in shards)
+        ok = (meters, payments, tokens) == (args.meters, expected_payments, expected_tokens)
+        print(f"workers={workers:<3} {len(shards)} shards  {meters:,} meters in {elapsed:.2f} s  "
+              f"{meters / elapsed:,.0f} meters/s  totals {'ok' if ok else 'MISMATCH'}")
+
+    # Balances: opening 0 (September fully vended); closing = unvended October payments
+    with open(shard_path(os.path.join(out_dir, PERIOD), 0, "jsonl"), encoding="utf-8") as f:
+        statement = json.loads(f.readline())
+    unvended = sum(1 for i in range(1, args.per_meter + 1) if i % 10 == 9) * 100.0
+    print(f"first statement: opening {statement['opening_balance']}, closing {statement['closing_balance']} "
+          f"(expected 0.0, {unvended}), units to date {statement['units_to_date']}")
+
+    # Resume: only the missing shard is written again
+    os.remove(shard_path(os.path.join(out_dir, PERIOD), 0, "jsonl"))
+    db = Session()
+    rewritten = list(generate_statements(db, PERIOD, out_dir, database_url=url))
+    db.close()
+    print(f"resume after removing one shard: {len(rewritten)} shard(s) rewritten")
+    engine.dispose()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
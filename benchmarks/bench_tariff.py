@@ -0,0 +1,127 @@
+"""
+Tariff engine: per-vend pricing and re-rating a period, per-row Python vs NumPy.
+
+Seeds a fresh SQLite file with --tokens synthetic vends spread over --meters
+meters and two months, rates them under tariffs.example.json (monthly blocks,
+a version change between the months), and checks that the vectorized re-rate
+matches a per-row loop over CompiledTariff.units_for.
+
+Run from the repo root:
+    python -m benchmarks.bench_tariff --tokens 200000
+"""
+import argparse
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+EXAMPLE_TARIFFS = Path(__file__).resolve().parents[1] / "tariffs.example.json"
+
+
+def _seed(engine, tokens: int, meters: int, start: datetime):
+    from sqlalchemy import insert
+    from app.models.vending import VenderToken
+
+    rng = random.Random(7)
+    span = 61 * 24 * 3600
+    rows = [dict(meter_number=f"MTR{rng.randrange(meters):05d}",
+                 amount=float(rng.choice((20, 50, 100, 200, 500, 1000))),
+                 units=0.0,
+                 token=f"{i:020d}",
+                 phone_number="254708374149",
+                 timestamp=start + timedelta(seconds=rng.randrange(span)))
+            for i in range(tokens)]
+    with engine.begin() as conn:
+        for i in range(0, len(rows), 5000):
+            conn.execute(insert(VenderToken), rows[i:i + 5000])
+
+
+def fetch_rows(db, start: datetime, end: datetime) -> list:
+    from sqlalchemy import select
+    from app.models.vending import VenderToken
+
+    return db.execute(select(VenderToken.meter_number, VenderToken.timestamp, VenderToken.amount)
+                      .where(VenderToken.timestamp >= start, VenderToken.timestamp < end)
+                      .order_by(VenderToken.meter_number, VenderToken.timestamp, VenderToken.id)).all()
+
+
+def rerate_rows_python(rows: list, schedule) -> list:
+    """One units_for call per token, month-to-date units tracked in a dict"""
+    consumed, units = {}, []
+    for meter_number, timestamp, amount in rows:
+        key = (meter_number, timestamp.year, timestamp.month)
+        bought = schedule.for_time(timestamp).units_for(amount, consumed.get(key, 0.0))
+        consumed[key] = consumed.get(key, 0.0) + bought
+        units.append(bought)
+    return units
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--tokens", type=int, default=200000)
+    parser.add_argument("--meters", type=int, default=2000)
+    parser.add_argument("--pricing-calls", type=int, default=200000)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    import numpy as np
+    from sqlalchemy.orm import sessionmaker
+    import app.main  # noqa: F401  registers every model on Base.metadata
+    from app.core.database import Base, create_db_engine
+    from app.services.tariff_service import (DEFAULT_TARIFFS, TariffSchedule, load_tariff_schedule,
+                                             load_tokens, rerate)
+
+    schedule = load_tariff_schedule(str(EXAMPLE_TARIFFS))
+    flat = TariffSchedule(DEFAULT_TARIFFS)
+
+    # Per-vend pricing
+    rng = random.Random(1)
+    amounts = [float(rng.randrange(10, 2000)) for _ in range(args.pricing_calls)]
+    consumed = [rng.uniform(0, 80) for _ in range(args.pricing_calls)]
+    when = datetime(2025, 11, 15)
+    for name, tariff in (("flat-10", flat.for_time(when)), ("tiered, monthly blocks", schedule.for_time(when))):
+        t0 = time.perf_counter()
+        for amount, used in zip(amounts, consumed):
+            tariff.units_for(amount, used)
+        elapsed = time.perf_counter() - t0
+        print(f"units_for {name:<24} {args.pricing_calls / elapsed:>12,.0f} calls/s")
+
+    # Re-rating a period
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_tariff_"), "bench.db")
+    engine = create_db_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    start, end = datetime(2025, 10, 1), datetime(2025, 12, 1)
+    _seed(engine, args.tokens, args.meters, start)
+    db = sessionmaker(bind=engine)()
+
+    t0 = time.perf_counter()
+    rows = fetch_rows(db, start, end)
+    python_fetch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    expected = rerate_rows_python(rows, schedule)
+    python_rate = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    tokens = load_tokens(db, start, end)
+    numpy_fetch = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    units = rerate(tokens, schedule)
+    numpy_rate = time.perf_counter() - t0
+    db.close()
+    engine.dispose()
+
+    worst = float(np.max(np.abs(units - np.asarray(expected)))) if len(units) else 0.0
+    print(f"\nre-rate {len(units):,} tokens over {args.meters} meters, 2 months, 2 tariff versions")
+    print(f"  {'':<16} {'fetch':>9} {'rate':>9} {'total':>9}")
+    print(f"  {'per-row python':<16} {python_fetch:>8.3f}s {python_rate:>8.3f}s {python_fetch + python_rate:>8.3f}s")
+    print(f"  {'numpy':<16} {numpy_fetch:>8.3f}s {numpy_rate:>8.3f}s {numpy_fetch + numpy_rate:>8.3f}s")
+    print(f"  rating {python_rate / numpy_rate:.0f}x faster, "
+          f"end to end {(python_fetch + python_rate) / (numpy_fetch + numpy_rate):.1f}x")
+    print(f"  max |numpy - python| = {worst:.4f} units (per-vend rounding of month-to-date units)")
+
+
+if __name__ == "__main__":
+    main()
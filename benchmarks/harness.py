@@ -0,0 +1,93 @@
+"""
+Small timing harness shared by the benchmark scripts.
+
+Reports ops/sec, p50/p99 latency and SQL statements per call, and can save
+results as a JSON baseline or compare a run against one.
+"""
+import json
+import os
+import statistics
+import time
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class StatementCounter:
+    """Counts SQL statements executed on an engine."""
+
+    def __init__(self, engine: Engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def measure(fn: Callable[[int], object], iterations: int, counter: StatementCounter, warmup: int = 5) -> dict:
+    """
+    Call fn(i) `iterations` times after `warmup` untimed calls.
+    `i` lets the benchmark vary its input (e.g. unique TransIDs).
+    """
+    for i in range(warmup):
+        fn(-1 - i)
+
+    timings: List[float] = []
+    statements_before = counter.count
+    for i in range(iterations):
+        start = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - start)
+    statements = counter.count - statements_before
+
+    timings.sort()
+    total = sum(timings)
+    return {
+        "iterations": iterations,
+        "ops_per_sec": round(iterations / total, 2) if total else 0.0,
+        "p50_ms": round(statistics.median(timings) * 1000, 4),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 4),
+        "statements_per_call": round(statements / iterations, 2),
+    }
+
+
+def print_results(results: Dict[str, dict], baseline: Optional[Dict[str, dict]] = None, threshold: float = 0.2):
+    """Print a results table; with a baseline, flag ops/sec drops and statement increases."""
+    header = f"{'benchmark':<55} {'ops/sec':>11} {'p50 ms':>9} {'p99 ms':>9} {'stmts':>6}"
+    if baseline:
+        header += f" {'vs base':>9}"
+    print(header)
+    print("-" * len(header))
+
+    regressions = []
+    for name, r in results.items():
+        line = f"{name:<55} {r['ops_per_sec']:>11,.1f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} {r['statements_per_call']:>6.2f}"
+        base = (baseline or {}).get(name)
+        if base:
+            change = (r["ops_per_sec"] - base["ops_per_sec"]) / base["ops_per_sec"] if base["ops_per_sec"] else 0.0
+            line += f" {change:>+8.1%}"
+            if change < -threshold or r["statements_per_call"] > base["statements_per_call"]:
+                line += "  <-- REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, dict]:
+    with open(path) as f:
+        return json.load(f)["results"]
+
+
+def save_baseline(path: str, results: Dict[str, dict], meta: dict):
+    """Write a baseline, keeping the existing file's record of accepted regressions"""
+    baseline = {"meta": meta, "results": results}
+    if os.path.exists(path):
+        with open(path) as f:
+            accepted = json.load(f).get("accepted_regressions")
+        if accepted:
+            baseline["accepted_regressions"] = accepted
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write("\n")